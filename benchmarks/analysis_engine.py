@@ -0,0 +1,59 @@
+'''
+Wall time and peak memory of the pandas analysis engine on a synthetic dataset.
+
+    python benchmarks/analysis_engine.py --tickers 500 --years 30
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+import analysis_engine
+import synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    today = datetime.today()
+    raw_data = synthetic.generate_market_data(args.tickers, args.years, end_date=today, seed=args.seed)
+    raw_tickers = synthetic.generate_tickers(args.tickers, updated_at=today, seed=args.seed)
+
+    start = time.perf_counter()
+    document = analysis_engine.run_analysis(raw_data, raw_tickers, today=today)
+    body = analysis_engine.to_json(document)
+    elapsed = time.perf_counter() - start
+
+    # tracing slows allocations down, so peak memory is measured on a separate run
+    tracemalloc.start()
+    analysis_engine.to_json(analysis_engine.run_analysis(raw_data, raw_tickers, today=today))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        'tickers': args.tickers,
+        'years': args.years,
+        'rows': len(raw_data),
+        'input_mb': round(raw_data.memory_usage(deep=True).sum() / 2**20, 1),
+        'companies': len(document[0]['companies']),
+        'output_mb': round(len(body) / 2**20, 2),
+        'wall_time_s': round(elapsed, 3),
+        'peak_traced_mb': round(peak / 2**20, 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 1)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+'''
+Compares the pandas analysis engine with the dividend analysis Glue job on a synthetic dataset.
+The Glue script runs unchanged on a local Spark session (requires pyspark and Java), with the
+awsglue entry points replaced by local stand-ins and S3 by a local moto server (requires moto[server]),
+which the Spark executors writing the detail documents reach as well.
+
+The job runs four times, as on two consecutive days:
+
+    full on the day before - over the rows up to the day before
+    incremental - folds the rows of the last day into the metadata of the first run, the
+                  bookmarked read returns only the file added since
+    full - recomputes everything over both files
+    after full - incremental again without a new file, the full run moved the bookmark past
+                 both files, so the bookmarked read returns none
+
+The incremental outputs must equal the full one, and the full one the analysis engine's.
+The first company keeps a single session in the beta window (synthetic.thin_history), so it has
+one pair of returns and both outputs must keep it with a null beta, --engine-only checks that on
+the analysis engine alone, without Spark.
+Every run reports its wall time and the shuffles and stage times of its Spark jobs, and the
+plan shuffles, broadcasts and step times the job records itself. --script runs another version of the job,
+to compare its plan with the current one:
+
+    python benchmarks/analysis_parity.py --tickers 50 --years 15
+    git show 418302d~1:glue/dividend_analysis.py > /tmp/dividend_analysis.py
+    python benchmarks/analysis_parity.py --tickers 50 --years 15 --script /tmp/dividend_analysis.py
+'''
+
+import os
+import sys
+import json
+import math
+import types
+import time
+import argparse
+import tempfile
+import urllib.request
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+import analysis_engine
+import synthetic
+from pipeline import frozen_datetime
+
+PLACEHOLDERS = {
+    '${GlueDB}': 'parity',
+    '${pRawFolder}': 'raw',
+    '${pS3BucketName}': 'parity-bucket',
+    '${pAnalysisFolder}': 'analysis',
+}
+
+
+def install_glue_stand_ins(tables, job_args):
+    '''
+    Registers awsglue modules whose catalog reads return the given local csv tables
+    tables maps a table name to its csv files and separator, job_args holds the job arguments,
+    both are read on every run so they can change between runs
+    a read with a transformation_ctx only returns the files not committed by an earlier run,
+    like a job bookmark, and only the files of a frame that was read are committed
+    '''
+    from pyspark.sql import SparkSession
+    from pyspark.sql.types import StructType
+
+    bookmarks = {}
+
+    class DynamicFrame:
+        def __init__(self, df, transformation_ctx=None, paths=()):
+            self.df = df
+            self.transformation_ctx = transformation_ctx
+            self.paths = paths
+
+        def toDF(self):
+            if self.transformation_ctx:
+                Job.pending.setdefault(self.transformation_ctx, set()).update(self.paths)
+            return self.df
+
+    class GlueContext:
+        def __init__(self, sc):
+            self.spark_session = SparkSession(sc)
+            self.create_dynamic_frame = self
+
+        def from_catalog(self, database, table_name, transformation_ctx=None, **kwargs):
+            paths, sep = tables[table_name]
+            if transformation_ctx:
+                paths = [path for path in paths if path not in bookmarks.get(transformation_ctx, set())]
+                Job.bookmarked[transformation_ctx] = len(paths)
+            if not paths:
+                # an empty bookmarked read has no schema
+                return DynamicFrame(self.spark_session.createDataFrame([], StructType([])), transformation_ctx)
+            df = self.spark_session.read.csv(paths, header=True, sep=sep)
+            # the crawler lower cases the column names
+            return DynamicFrame(df.toDF(*[column.lower() for column in df.columns]), transformation_ctx, paths)
+
+    class Job:
+        # files read by the bookmarked reads of the current run
+        pending = {}
+        # files returned by the bookmarked reads of the current run
+        bookmarked = {}
+
+        def __init__(self, glue_context):
+            Job.pending = {}
+            Job.bookmarked = {}
+
+        def init(self, name, args):
+            pass
+
+        def commit(self):
+            for transformation_ctx, paths in Job.pending.items():
+                bookmarks.setdefault(transformation_ctx, set()).update(paths)
+
+    modules = {
+        'awsglue': types.ModuleType('awsglue'),
+        'awsglue.utils': types.ModuleType('awsglue.utils'),
+        'awsglue.context': types.ModuleType('awsglue.context'),
+        'awsglue.job': types.ModuleType('awsglue.job'),
+    }
+    modules['awsglue.utils'].getResolvedOptions = lambda argv, names: {name: job_args[name] for name in names}
+    modules['awsglue.context'].GlueContext = GlueContext
+    modules['awsglue.job'].Job = Job
+    sys.modules.update(modules)
+    return Job
+
+
+def run_glue_job(script_path, workdir, today):
+    '''
+    Runs the Glue script as of today, every run shares the Spark context of the first
+    '''
+    source = open(script_path).read()
+    for placeholder, value in PLACEHOLDERS.items():
+        source = source.replace(placeholder, value)
+    source = source.replace('s3://', f'file://{workdir}/')
+    source = source.replace('SparkContext()', 'SparkContext.getOrCreate()')
+    source = source.replace('from datetime import datetime, timedelta\n', '')
+    exec(compile(source, script_path, 'exec'), {'__name__': '__main__', 'datetime': frozen_datetime(today), 'timedelta': timedelta})
+
+
+def spark_stages(group):
+    '''
+    Shuffles and stage times of the Spark jobs of a job group, from the REST API of the Spark UI
+    stages skipped because their shuffle output was reused are not counted
+    '''
+    from pyspark import SparkContext
+
+    sc = SparkContext.getOrCreate()
+    base = f'{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}'
+
+    def get(path):
+        with urllib.request.urlopen(f'{base}/{path}') as response:
+            return json.loads(response.read())
+
+    def epoch_ms(timestamp):
+        return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%fGMT').timestamp() * 1000
+
+    # the UI records the end of a job asynchronously, shortly after the action returned
+    for _ in range(50):
+        jobs = [job for job in get('jobs') if job.get('jobGroup') == group]
+        if all(job['status'] != 'RUNNING' for job in jobs):
+            break
+        time.sleep(0.1)
+    stage_ids = {stage_id for job in jobs for stage_id in job['stageIds']}
+    stages = [stage for stage in get('stages') if stage['stageId'] in stage_ids and stage['status'] == 'COMPLETE']
+    times = sorted(
+        ((round(epoch_ms(stage['completionTime']) - epoch_ms(stage['submissionTime'])), stage['stageId'], stage['name'])
+         for stage in stages),
+        reverse=True
+    )
+    return {
+        'jobs': len(jobs),
+        'stages': len(stages),
+        'shuffles': sum(1 for stage in stages if stage['shuffleWriteBytes'] > 0),
+        'shuffleWriteMb': round(sum(stage['shuffleWriteBytes'] for stage in stages) / 2**20, 2),
+        'shuffleReadMb': round(sum(stage['shuffleReadBytes'] for stage in stages) / 2**20, 2),
+        'stageMs': sum(ms for ms, _, _ in times),
+        'slowestStages': [f'{stage_id} {name}: {ms} ms' for ms, stage_id, name in times[:5]]
+    }
+
+
+def job_metrics(s3_client):
+    '''
+    The plan shuffles and broadcasts and the step times the job records, jobs before the instrumentation record none
+    '''
+    try:
+        body = s3_client.get_object(Bucket=PLACEHOLDERS['${pS3BucketName}'], Key='analysis/metrics.json')['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    report = json.loads(body)
+    return {
+        'planExchanges': {name: value for name, value in report['Counts'].items() if name.endswith(('Shuffles', 'Broadcasts'))},
+        'stepMs': {name: step['ms'] for name, step in report['Steps'].items()}
+    }
+
+
+def read_output(s3_client):
+    '''
+    Returns the summary document and the detail documents written by the Glue job
+    '''
+    bucket_name = PLACEHOLDERS['${pS3BucketName}']
+
+    def read(key):
+        return json.loads(s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read())
+
+    manifest = read('analysis/manifest.json')
+    return read(manifest['summary']), {ticker: read(key) for ticker, key in manifest['tickers'].items()}
+
+
+def values_match(expected, actual, tolerance):
+    if isinstance(expected, float) or isinstance(actual, float):
+        return math.isclose(expected, actual, rel_tol=tolerance, abs_tol=tolerance)
+    if isinstance(expected, list):
+        return len(expected) == len(actual) and all(values_match(e, a, tolerance) for e, a in zip(expected, actual))
+    if isinstance(expected, dict):
+        return expected.keys() == actual.keys() and all(values_match(expected[k], actual[k], tolerance) for k in expected)
+    return expected == actual
+
+
+def compare(spark_document, engine_document, tolerance, names=('spark', 'engine')):
+    '''
+    Returns a list of differences between the two output documents
+    '''
+    first, second = names
+    differences = []
+    spark_companies = {company['ticker']: company for company in spark_document['companies']}
+    engine_companies = {company['ticker']: company for company in engine_document['companies']}
+
+    for ticker in sorted(spark_companies.keys() ^ engine_companies.keys()):
+        differences.append(f'{ticker}: only in {first if ticker in spark_companies else second} output')
+
+    for ticker in sorted(spark_companies.keys() & engine_companies.keys()):
+        for field, expected in spark_companies[ticker].items():
+            actual = engine_companies[ticker].get(field)
+            if not values_match(expected, actual, tolerance):
+                differences.append(f'{ticker}.{field}: {first}={expected} {second}={actual}')
+
+    spark_benchmarks = sorted(spark_document['benchmarks'], key=lambda b: b['ticker'])
+    engine_benchmarks = sorted(engine_document['benchmarks'], key=lambda b: b['ticker'])
+    if not values_match(spark_benchmarks, engine_benchmarks, tolerance):
+        differences.append(f'benchmarks: {first}={spark_benchmarks} {second}={engine_benchmarks}')
+
+    return differences
+
+
+def compare_outputs(expected, actual, tolerance, names):
+    '''
+    Differences between two pairs of summary and detail documents
+    '''
+    (expected_summary, expected_details), (actual_summary, actual_details) = expected, actual
+    first, second = names
+    differences = compare(expected_summary[0], actual_summary[0], tolerance, names)
+    for ticker in sorted(expected_details.keys() ^ actual_details.keys()):
+        differences.append(f'{ticker}: detail only in {first if ticker in expected_details else second} output')
+    for ticker in sorted(expected_details.keys() & actual_details.keys()):
+        if not values_match(expected_details[ticker], actual_details[ticker], tolerance):
+            differences.append(f'{ticker}: detail {first}={expected_details[ticker]} {second}={actual_details[ticker]}')
+    return differences
+
+
+def undefined_beta(document, ticker, name):
+    '''
+    Differences when the ticker is missing from a summary document or has a beta
+    '''
+    companies = {company['ticker']: company for company in document['companies']}
+    if ticker not in companies:
+        return [f'{ticker}: missing from the {name} output']
+    if companies[ticker].get('beta') is not None:
+        return [f"{ticker}: {name} beta={companies[ticker]['beta']}, expected null with a single pair of returns"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=50)
+    parser.add_argument('--years', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=1e-9)
+    parser.add_argument('--beta-benchmarks', default='^GSPC', help='comma separated, as the job argument')
+    parser.add_argument('--beta-lookbacks', default='5y-daily', help='comma separated, as the job argument')
+    parser.add_argument('--script', default=os.path.join(ROOT, 'glue', 'dividend_analysis.py'), help='the Glue script to run')
+    parser.add_argument('--engine-only', action='store_true', help='only check the short history company on the analysis engine')
+    args = parser.parse_args()
+
+    today = datetime.today().replace(microsecond=0)
+    # the collector stores the sessions before the day of the run
+    raw_data = synthetic.generate_market_data(args.tickers, args.years, end_date=today - timedelta(days=1), seed=args.seed)
+    raw_tickers = synthetic.generate_tickers(args.tickers, updated_at=today, seed=args.seed)
+    benchmarks, lookbacks = args.beta_benchmarks.split(','), args.beta_lookbacks.split(',')
+    short = analysis_engine.run_analysis(raw_data, raw_tickers, today=today, benchmarks=benchmarks, lookbacks=lookbacks)[0]['companies'][0]['ticker']
+    lookback_years = max(analysis_engine.parse_lookback(lookback)[1] for lookback in lookbacks)
+    raw_data = synthetic.thin_history(raw_data, short, today - timedelta(days=365 * lookback_years))
+    engine = analysis_engine.split_output(analysis_engine.run_analysis(
+        raw_data, raw_tickers, today=today, benchmarks=benchmarks, lookbacks=lookbacks
+    ))
+
+    if args.engine_only:
+        differences = undefined_beta(engine[0][0], short, 'engine')
+        print(json.dumps({
+            'companies': len(engine[0][0]['companies']),
+            'short_history': next(company for company in engine[0][0]['companies'] if company['ticker'] == short),
+            'short_history_betas': engine[1][short]['betas'],
+            'differences': len(differences)
+        }, indent=2))
+        for difference in differences:
+            print(difference)
+        sys.exit(1 if differences else 0)
+
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    os.environ.setdefault('PYSPARK_SUBMIT_ARGS', '--master local[*] --conf spark.sql.session.timeZone=UTC pyspark-shell')
+    # the executors inherit the environment, so their clients reach the same server
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ.update(
+        AWS_ENDPOINT_URL=f'http://{host}:{port}', AWS_DEFAULT_REGION='us-east-1',
+        AWS_ACCESS_KEY_ID='parity', AWS_SECRET_ACCESS_KEY='parity'
+    )
+    s3_client = boto3.client('s3')
+    s3_client.create_bucket(Bucket=PLACEHOLDERS['${pS3BucketName}'])
+
+    # the first run is on the day of the last session, before its rows are collected
+    last_session = raw_data['Date'].max()
+    day_before = datetime.combine(last_session.date(), today.time())
+
+    outputs = {}
+    plans = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        # the rows collected up to the day before, and the rows of the last day in a file of their own
+        data_paths = [os.path.join(workdir, 'data-1.csv'), os.path.join(workdir, 'data-2.csv')]
+        ticker_path = os.path.join(workdir, 'tickers.csv')
+        last_day = raw_data['Date'] == last_session
+        for path, rows in zip(data_paths, (raw_data[~last_day], raw_data[last_day])):
+            rows.assign(Date=rows['Date'].dt.strftime('%Y-%m-%d')).to_csv(path, index=False)
+        raw_tickers.to_csv(ticker_path, index=False, sep='|')
+
+        tables = {'ticker-raw': ([ticker_path], '|')}
+        job_args = {
+            'JOB_NAME': 'parity',
+            'beta_benchmarks': args.beta_benchmarks,
+            'beta_lookbacks': args.beta_lookbacks
+        }
+        job = install_glue_stand_ins(tables, job_args)
+        from pyspark import SparkContext
+        sc = SparkContext.getOrCreate()
+        for run, mode, day, paths in (
+            ('day_before', 'full', day_before, data_paths[:1]),
+            ('incremental', 'incremental', today, data_paths),
+            ('full', 'full', today, data_paths),
+            ('after_full', 'incremental', today, data_paths)
+        ):
+            tables['data-raw'] = (paths, ',')
+            job_args['analysis_mode'] = mode
+            s3_client.delete_object(Bucket=PLACEHOLDERS['${pS3BucketName}'], Key='analysis/metrics.json')
+            sc.setJobGroup(run, f'{mode} analysis')
+            start = time.perf_counter()
+            run_glue_job(args.script, workdir, day)
+            plans[run] = {
+                'seconds': round(time.perf_counter() - start, 2), **spark_stages(run), 'job': job_metrics(s3_client),
+                'bookmarkedFiles': job.bookmarked.get('raw_data', 0)
+            }
+            outputs[run] = read_output(s3_client)
+
+    server.stop()
+
+    differences = compare_outputs(outputs['full'], engine, args.tolerance, ('spark', 'engine'))
+    differences += compare_outputs(outputs['full'], outputs['incremental'], args.tolerance, ('full', 'incremental'))
+    differences += compare_outputs(outputs['full'], outputs['after_full'], args.tolerance, ('full', 'after full'))
+    if plans['after_full']['bookmarkedFiles']:
+        differences.append(f"bookmark: the run after full read {plans['after_full']['bookmarkedFiles']} files again")
+    differences += undefined_beta(outputs['full'][0][0], short, 'spark') + undefined_beta(engine[0][0], short, 'engine')
+
+    print(json.dumps({
+        'script': os.path.relpath(args.script, ROOT),
+        'companies': len(outputs['full'][0][0]['companies']),
+        'differences': len(differences),
+        'runs': plans
+    }, indent=2))
+    for difference in differences:
+        print(difference)
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''
+Latency and payload size of the analysis API on a synthetic analysis output: the first (cold)
+request that loads and indexes the summary, warm requests served from the in-process cache,
+compressed bodies, filtered queries and per-ticker details, against the size of the single
+document with every history that the API used to serve. S3 is replaced by an in-memory
+stand-in with a fixed round trip latency.
+
+    python benchmarks/api_reads.py --tickers 500 --years 30 --s3-latency 0.03
+'''
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import statistics
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.update(BUCKET_NAME='api-bucket', OBJECT_KEY='analysis/summary.json', TICKER_PREFIX='analysis/tickers')
+
+import analysis_engine
+import read_s3
+import synthetic
+import instrumentation
+from stand_ins import LocalS3Client, use_client
+
+# the handler's metric log lines are built as in production but not printed
+instrumentation.log = lambda line: None
+
+
+def request(query=None, headers=None, ticker=None):
+    start = time.perf_counter()
+    event = {'queryStringParameters': query, 'headers': headers, 'pathParameters': {'ticker': ticker} if ticker else None}
+    response = read_s3.lambda_handler(event, None)
+    elapsed = time.perf_counter() - start
+    body = base64.b64decode(response['body']) if response.get('isBase64Encoded') else response['body'].encode('utf-8')
+    return response, elapsed, len(body)
+
+
+def timed(repeat, query=None, headers=None, ticker=None):
+    times = []
+    for _ in range(repeat):
+        response, elapsed, size = request(query, headers, ticker)
+        times.append(elapsed)
+    return {
+        'status': response['statusCode'],
+        'encoding': response['headers'].get('Content-Encoding'),
+        'payload_kb': round(size / 2**10, 1),
+        'median_ms': round(statistics.median(times) * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--s3-latency', type=float, default=0.03)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    today = datetime.today()
+    raw_data = synthetic.generate_market_data(args.tickers, args.years, end_date=today)
+    raw_tickers = synthetic.generate_tickers(args.tickers, updated_at=today)
+    document = analysis_engine.run_analysis(raw_data, raw_tickers, today=today)
+    summary, details = analysis_engine.split_output(document)
+
+    client = LocalS3Client(latency=args.s3_latency)
+    client.put_object(Bucket=os.environ['BUCKET_NAME'], Key=os.environ['OBJECT_KEY'], Body=analysis_engine.to_json(summary))
+    for ticker, detail in details.items():
+        client.put_object(Bucket=os.environ['BUCKET_NAME'], Key=f"{os.environ['TICKER_PREFIX']}/{ticker}.json", Body=analysis_engine.to_json(detail))
+    client.requests = 0
+    use_client('s3', client)
+    read_s3.cache.clear()
+
+    _, cold, raw_size = request()
+    companies = read_s3.cache[os.environ['OBJECT_KEY']].companies
+    etag = read_s3.load(os.environ['BUCKET_NAME'], os.environ['OBJECT_KEY']).etag
+
+    results = {
+        'tickers': args.tickers,
+        'companies': len(companies),
+        'brotli': read_s3.brotli is not None,
+        'full_document_kb': round(len(analysis_engine.to_json(document)) / 2**10, 1),
+        'cold': {'payload_kb': round(raw_size / 2**10, 1), 'ms': round(cold * 1000, 3)},
+        'warm': timed(args.repeat),
+        'warm_gzip': timed(args.repeat, headers={'Accept-Encoding': 'gzip'}),
+        'warm_br': timed(args.repeat, headers={'Accept-Encoding': 'br, gzip'}),
+        'not_modified': timed(args.repeat, headers={'If-None-Match': f'"{etag}"'})
+    }
+    # a short history qualifies no company, which leaves nothing to filter or look up
+    if companies:
+        results.update({
+            'ticker_filter': timed(args.repeat, query={'ticker': ','.join(company['ticker'] for company in companies[:5])}),
+            'sector_filter': timed(args.repeat, query={'sector': companies[0]['sector']}),
+            'threshold_filter': timed(args.repeat, query={'min_consecutiveGrowthYears': '5', 'max_beta': '1'}),
+            'ticker_cold': timed(1, ticker=companies[-1]['ticker']),
+            'ticker_warm': timed(args.repeat, ticker=companies[-1]['ticker']),
+            'ticker_warm_gzip': timed(args.repeat, headers={'Accept-Encoding': 'gzip'}, ticker=companies[-1]['ticker'])
+        })
+    results['s3_requests'] = client.requests
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
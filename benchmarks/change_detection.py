@@ -0,0 +1,208 @@
+'''
+Analysis runs skipped by the change detection over a year of scheduled runs, at 00:00 UTC from
+Monday to Friday like the ticker collector's schedule. The synthetic source only has bars on NYSE
+trading days, and the bars of a share of the sessions are published late, so the first run after
+them downloads nothing. Each run is replayed twice against the Lambda handlers:
+
+    always - the ticker collector and the analysis run on every scheduled run, as before
+    skip - runs with no session since the last stored date stop at the ticker collector, and
+           executions whose tickers and data are unchanged stop after the change detection
+
+The analysis engine stands in for the Glue job. The summary of the skip mode must equal the one of
+the always mode on every day it analyzes. The analysis windows end on the day of the run, so on a
+skipped day they are a day behind, like on weekends; the days where that changes the summary are
+counted. One analysis of the skip mode fails, the next execution must analyze even without changes.
+
+    python benchmarks/change_detection.py --tickers 30 --years 3 --start-date 2024-01-01 --days 366
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+import numpy as np
+import pandas as pd
+import clients
+import instrumentation
+import market_calendar
+import synthetic
+from pipeline import BUCKET_NAME, FOLDERS, FakeMarketSource, dividend_analysis, patched, frozen_datetime
+from stand_ins import LocalS3Client, LocalStepFunctionsClient
+
+# the handlers' metric log lines are built as in production but not printed
+instrumentation.log = lambda line: None
+
+
+class LateSource(FakeMarketSource):
+    '''
+    Hides the bars of the late sessions from the first run after them
+    '''
+
+    def __init__(self, data, late):
+        super().__init__(data)
+        self.late = {np.datetime64(day, 'ns') for day in late}
+
+    def __call__(self, tickers, start_date, end_date):
+        data = super().__call__(tickers, start_date, end_date)
+        latest = np.datetime64(end_date - timedelta(days=1), 'ns')
+        if latest in self.late and len(data):
+            data = data[data['Date'].to_numpy() != latest]
+        return data
+
+
+def summary_of(s3_client):
+    summary = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=f"{FOLDERS['analysis_folder']}/summary.json")['Body'].read())
+    return summary[0].pop('lastUpdated'), summary
+
+
+def replay(mode, schedule, companies, source, fail_on):
+    import ticker_collector
+    import start_step_function
+    import ticker_diff
+    import shard_tickers
+    import data_collector
+    import merge_shards
+    import detect_changes
+
+    s3_client = LocalS3Client()
+    services = {'s3': s3_client, 'stepfunctions': LocalStepFunctionsClient()}
+    data_collector.DATA_FORMAT = 'parquet'
+    data_collector.HISTORY_PREFIX = None
+    ticker_collector.SKIP_CLOSED_DAYS = mode == 'skip'
+
+    counts = {'runs': 0, 'executions': 0, 'skipped_closed': 0, 'skipped_unchanged': 0, 'analyses': 0, 'failed_analyses': 0}
+    times = {'total_s': 0.0, 'analysis_s': 0.0}
+    # the summary stored after every run, and the days it was analyzed
+    summaries = {}
+    analyzed = set()
+    last_updated = None
+    refreshed = 0
+    recovered = None
+
+    clients.clear()
+    with patched(boto3, 'client', lambda service, *a, **kw: services[service]):
+        for now in schedule:
+            counts['runs'] += 1
+            day = f'{now:%Y-%m-%d}'
+            frozen = frozen_datetime(now)
+            start = time.perf_counter()
+            with patched(ticker_collector, 'datetime', frozen), patched(shard_tickers, 'datetime', frozen), \
+                    patched(data_collector, 'datetime', frozen), patched(pd, 'read_html', lambda *a, **kw: [companies.copy()]):
+                existing = set(s3_client.keys(BUCKET_NAME, f"{FOLDERS['ticker_folder']}/"))
+                ticker_collector.lambda_handler({}, None)
+                ticker_keys = sorted(set(s3_client.keys(BUCKET_NAME, f"{FOLDERS['ticker_folder']}/")) - existing)
+                if not ticker_keys:
+                    counts['skipped_closed'] += 1
+                else:
+                    record = {'s3': {'bucket': {'name': BUCKET_NAME, 'arn': f'arn:aws:s3:::{BUCKET_NAME}'}, 'object': {'key': ticker_keys[0]}}}
+                    start_step_function.lambda_handler({'Records': [record]}, None)
+                    execution = json.loads(services['stepfunctions'].executions[-1]['input'])
+                    counts['executions'] += 1
+
+                    diffed = ticker_diff.lambda_handler(execution, None)
+                    sharded = shard_tickers.lambda_handler(execution, None)
+                    shard_results = [data_collector.lambda_handler(dict(execution, shard=shard), None, source=source) for shard in sharded['Shards']]
+                    collected = merge_shards.lambda_handler(dict(execution, shardresults=shard_results), None)
+
+                    changed = True
+                    if mode == 'skip':
+                        changes = detect_changes.lambda_handler(dict(execution, tickerresult=diffed, taskresult=collected), None)
+                        changed = changes['Changed']
+                        if recovered is None and counts['failed_analyses']:
+                            recovered = 'pending' in changes['Changes']
+                    if not changed:
+                        counts['skipped_unchanged'] += 1
+                    elif mode == 'skip' and counts['analyses'] == fail_on and not counts['failed_analyses']:
+                        # the Glue job fails, the analyzed inputs are not recorded
+                        counts['failed_analyses'] += 1
+                    else:
+                        analysis_start = time.perf_counter()
+                        dividend_analysis(s3_client, now)
+                        times['analysis_s'] += time.perf_counter() - analysis_start
+                        counts['analyses'] += 1
+                        analyzed.add(day)
+                        if mode == 'skip':
+                            detect_changes.lambda_handler(dict(execution, action='analyzed'), None)
+            times['total_s'] += time.perf_counter() - start
+
+            if counts['analyses']:
+                previous, (last_updated, summaries[day]) = last_updated, summary_of(s3_client)
+                refreshed += last_updated != previous
+    clients.clear()
+
+    return {
+        'mode': mode,
+        **counts,
+        **{name: round(value, 3) for name, value in times.items()},
+        'last_updated_changes': refreshed,
+        'recovered_after_failure': recovered
+    }, summaries, analyzed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=30)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--start-date', default='2024-01-01')
+    parser.add_argument('--days', type=int, default=366, help='calendar days of scheduled runs')
+    parser.add_argument('--late', type=float, default=0.05, help='share of the sessions published late')
+    parser.add_argument('--fail-on', type=int, default=20, help='analysis of the skip mode that fails')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.update({
+        'BUCKETNAME': BUCKET_NAME,
+        'BUCKET_NAME': BUCKET_NAME,
+        'TICKER_FOLDER': FOLDERS['ticker_folder'],
+        'DATA_FOLDER': FOLDERS['data_folder'],
+        'RAW_FOLDER': FOLDERS['raw_folder'],
+        'TRANSFORM_FOLDER': FOLDERS['transform_folder'],
+        'ANALYSIS_FOLDER': FOLDERS['analysis_folder'],
+        'ARCHIVE_FOLDER': FOLDERS['archive_folder'],
+        'ERROR_FOLDER': FOLDERS['error_folder'],
+        'STEP_FUNC_ARN': 'arn:aws:states:us-east-1:000000000000:stateMachine:pipeline'
+    })
+
+    start = pd.Timestamp(args.start_date)
+    end = start + timedelta(days=args.days)
+    # the cron(0 0 ? * MON-FRI *) schedule
+    schedule = [day.to_pydatetime() for day in pd.date_range(start, end, inclusive='left') if day.weekday() < 5]
+
+    companies = synthetic.generate_tickers(args.tickers, seed=args.seed)
+    companies = companies[~companies['Symbol'].str.startswith('^')].drop(columns='updatedAt')
+    data = synthetic.generate_market_data(args.tickers, args.years, end_date=end, seed=args.seed)
+    data = data[[market_calendar.is_trading_day(day.date()) for day in data['Date']]]
+    trading_days = sorted({day.date() for day in data['Date'] if day >= start})
+    rng = np.random.default_rng(args.seed)
+    late = sorted(rng.choice(trading_days, int(len(trading_days) * args.late), replace=False))
+
+    results = {}
+    summaries = {}
+    for mode in ('always', 'skip'):
+        results[mode], summaries[mode], analyzed = replay(mode, schedule, companies, LateSource(data, late), args.fail_on)
+
+    behind = [day for day in summaries['skip'] if day not in analyzed and summaries['skip'][day] != summaries['always'][day]]
+    report = {
+        'config': vars(args),
+        'holidays': sorted(f'{day:%Y-%m-%d}' for year in range(start.year, end.year + 1) for day in market_calendar.holidays(year) if start.date() <= day < end.date()),
+        'late_sessions': len(late),
+        'results': list(results.values()),
+        'analyses_skipped': results['always']['analyses'] - results['skip']['analyses'],
+        'speedup': round(results['always']['total_s'] / results['skip']['total_s'], 2),
+        'parity_on_analyzed_days': all(summaries['skip'][day] == summaries['always'][day] for day in analyzed),
+        # skipped days whose windows a day behind changed the summary
+        'skipped_days_behind': len(behind)
+    }
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
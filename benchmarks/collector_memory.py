@@ -0,0 +1,124 @@
+'''
+Peak memory of writing one collector batch: the previous stack + in-memory csv string
+versus streaming per-ticker frames through the bounded csv and parquet writers.
+
+    python benchmarks/collector_memory.py --tickers 100 --years 40
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+from io import StringIO
+import raw_data
+from s3_stream import bound_buffers
+import synthetic
+
+
+class CountingSink:
+    '''
+    Binary sink that keeps at most part_size bytes, like the S3 multipart writer
+    a spilled sink keeps nothing in memory, the writer would buffer on disk
+    '''
+
+    def __init__(self, part_size):
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.spilled = False
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.spilled:
+            return len(data)
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            self.buffer = bytearray()
+        return len(data)
+
+    def buffered(self):
+        return len(self.buffer)
+
+    def spill(self):
+        self.buffer = bytearray()
+        self.spilled = True
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+
+def stacked_csv(wide):
+    # what the collector did before: stack the yf.download frame and build the whole csv string
+    data = wide.stack(level=0, future_stack=True).rename_axis(['Date', 'Ticker']).reset_index()
+    csv_buffer = StringIO()
+    data.to_csv(csv_buffer, index=False)
+    return len(csv_buffer.getvalue())
+
+
+def streamed_csv(frames, part_size):
+    sink = CountingSink(part_size)
+    raw_data.write_csv(frames, sink)
+    return sink.size
+
+
+def streamed_parquet(frames, part_size):
+    sinks = []
+
+    def open_sink(partition):
+        sinks.append(CountingSink(part_size))
+        return sinks[-1]
+
+    with raw_data.ParquetPartitionWriter(open_sink) as writer:
+        for frame in frames:
+            writer.write(frame)
+            bound_buffers(sinks, part_size)
+    return sum(sink.size for sink in sinks)
+
+
+def profile(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'output_mb': round(size / 2**20, 1), 'traced_wall_time_s': round(elapsed, 2), 'peak_mb': round(peak / 2**20, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=100)
+    parser.add_argument('--years', type=int, default=40)
+    parser.add_argument('--buffer-mb', type=int, default=8)
+    args = parser.parse_args()
+
+    data = synthetic.generate_market_data(args.tickers, args.years)
+    frames = [frame.reset_index(drop=True) for _, frame in data.groupby('Ticker', sort=False)]
+    wide = data.set_index(['Date', 'Ticker']).unstack('Ticker').swaplevel(axis=1).sort_index(axis=1)
+    input_mb = round(data.memory_usage(deep=True).sum() / 2**20, 1)
+    del data
+
+    part_size = args.buffer_mb * 2**20
+    print(json.dumps({
+        'tickers': args.tickers,
+        'years': args.years,
+        'input_mb': input_mb,
+        'buffer_mb': args.buffer_mb,
+        'stacked_csv': profile(stacked_csv, wide),
+        'streamed_csv': profile(streamed_csv, frames, part_size),
+        'streamed_parquet': profile(streamed_parquet, frames, part_size)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+'''
+Throughput and retry behaviour of the concurrent batch downloader with the yfinance source,
+its requests answered by a stand-in with a fixed latency that fails tickers at random.
+
+    python benchmarks/collector_throughput.py --tickers 500 --latency 0.02 --failure-rate 0.05
+'''
+
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+import numpy as np
+import pandas as pd
+from batch_downloader import Batch, RateLimiter, collect
+from market_data import YFinanceSource
+import synthetic
+
+
+class FakeRequests:
+    '''
+    Stands in for the yfinance requests: every yf.Ticker(...).history returns a year of
+    synthetic bars after a fixed latency, or fails at random, and counts the requests that
+    overlapped
+    '''
+
+    def __init__(self, latency, failure_rate, days=252, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.dates = pd.bdate_range(end='2024-01-02', periods=days)
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+
+    def history(self, ticker, **kwargs):
+        with self.lock:
+            self.requests += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            failed = self.rng.random() < self.failure_rate
+        time.sleep(self.latency)
+        with self.lock:
+            self.active -= 1
+        if failed:
+            raise ConnectionError(f'{ticker}: request failed')
+        return pd.DataFrame({'Adj Close': 1.0, 'Close': 1.0, 'Dividends': 0.0}, index=self.dates)
+
+    def module(self):
+        requests = self
+
+        class Ticker:
+            def __init__(self, ticker):
+                self.ticker = ticker
+
+            def history(self, **kwargs):
+                return requests.history(self.ticker, **kwargs)
+
+        return types.SimpleNamespace(Ticker=Ticker)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per ticker request')
+    parser.add_argument('--failure-rate', type=float, default=0.05, help='chance a ticker is dropped on each attempt')
+    parser.add_argument('--rate', type=float, default=None, help='yfinance requests per second')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    tickers = synthetic.ticker_symbols(args.tickers)
+    batches = [
+        Batch(f'batch-{batch}', tickers[batch:batch + args.batch_size], None, None)
+        for batch in range(0, len(tickers), args.batch_size)
+    ]
+
+    results = []
+    for workers in args.workers:
+        requests = FakeRequests(args.latency, args.failure_rate)
+        sys.modules['yfinance'] = requests.module()
+        source = YFinanceSource(RateLimiter(rate=args.rate))
+        saved = []
+        start = time.perf_counter()
+        report = collect(
+            batches,
+            source=source,
+            save=lambda frames, name: saved.append(sum(len(frame) for frame in frames)) or [name],
+            max_workers=workers,
+            retries=3,
+            backoff=0.01
+        )
+        elapsed = time.perf_counter() - start
+        results.append({
+            'workers': workers,
+            'wall_time_s': round(elapsed, 3),
+            'tickers_per_s': round(len(report['Succeeded']) / elapsed, 1),
+            'ticker_requests': requests.requests,
+            'max_concurrent_requests': requests.max_active,
+            'succeeded': len(report['Succeeded']),
+            'failed': len(report['Failed']),
+            'files': len(report['Files'])
+        })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+'''
+File count and scan time of the raw folders before and after compaction (compact_files.py), on a
+synthetic year of daily runs: one file per batch of tickers per run in the data folder, and one
+ticker file per run. Every tenth run downloads the previous day again with other prices, so the
+latest copy of a row has to win. A scan lists and reads every file like the analysis job, with a
+fixed latency per S3 request, and keeps the latest row of every ticker and date (or symbol).
+
+The data and ticker scans after compaction are compared with the ones before. A second run must
+find nothing to compact, and a run that fails while archiving must be finished by the next one.
+
+    python benchmarks/compaction.py --tickers 500 --days 252 --latency 0.005
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+from io import BytesIO
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import clients
+import compact_files
+import instrumentation
+import synthetic
+from pipeline import patched
+from raw_data import PARQUET_COLUMNS, conform, to_csv, to_parquet_partitions
+from stand_ins import LocalS3Client
+
+# the handler's metric log lines are built as in production but not printed
+instrumentation.log = lambda line: None
+
+BUCKET_NAME = 'compaction-bucket'
+FOLDERS = {
+    'BUCKETNAME': BUCKET_NAME,
+    'DATA_FOLDER': 'data',
+    'TICKER_FOLDER': 'ticker',
+    'RAW_FOLDER': 'raw',
+    'TRANSFORM_FOLDER': 'transform',
+    'ARCHIVE_FOLDER': 'archive'
+}
+
+
+def populate(client, tickers, days, batch_size, data_format, seed):
+    rng = np.random.default_rng(seed)
+    symbols = synthetic.ticker_symbols(tickers)
+    companies = synthetic.generate_tickers(tickers, seed=seed)
+    run_dates = pd.bdate_range('2023-01-02', periods=days)
+    for run, day in enumerate(run_dates):
+        name = f'{day:%Y-%m-%d}-00-00-00'
+        dates = run_dates[max(run - 1, 0):run + 1] if run % 10 == 9 else run_dates[run:run + 1]
+        for batch in range(0, tickers, batch_size):
+            batch_symbols = symbols[batch:batch + batch_size]
+            data = pd.DataFrame({
+                'Date': np.tile(dates, len(batch_symbols)),
+                'Ticker': np.repeat(batch_symbols, len(dates)),
+                'Adj Close': rng.uniform(10, 100, len(dates) * len(batch_symbols)).round(4),
+                'Dividends': 0.0
+            })
+            if data_format == 'parquet':
+                for partition, body in to_parquet_partitions(data).items():
+                    client.store(BUCKET_NAME, f'data/raw/{partition}/{name}-batch-{batch // batch_size}.parquet', body)
+            else:
+                client.store(BUCKET_NAME, f'data/raw/{name}-batch-{batch // batch_size}.csv', to_csv(conform(data)).encode('utf-8'))
+        # one company renamed on every run, so the latest row of a symbol differs from the first
+        companies.loc[run % tickers, 'Security'] = f'Renamed {run}'
+        companies['updatedAt'] = day
+        client.store(BUCKET_NAME, f'ticker/raw/{name}.csv', companies.to_csv(index=False, sep='|').encode('utf-8'))
+
+
+def scan_data(client):
+    '''
+    Reads every data file and keeps the latest row of every ticker and date
+    '''
+    columns = {column: name for name, column in PARQUET_COLUMNS.items()}
+    frames = []
+    for obj in client.list_objects_v2(Bucket=BUCKET_NAME, Prefix='data/raw/')['Contents']:
+        body = client.get_object(Bucket=BUCKET_NAME, Key=obj['Key'])['Body'].read()
+        if obj['Key'].endswith('.parquet'):
+            frames.append(pq.read_table(BytesIO(body)).to_pandas().rename(columns=columns))
+        else:
+            frames.append(pd.read_csv(BytesIO(body)))
+    data = pd.concat([conform(frame) for frame in frames], ignore_index=True)
+    data = data.drop_duplicates(['Ticker', 'Date'], keep='last').sort_values(['Ticker', 'Date'])
+    return data[['Ticker', 'Date', 'Adj Close']].reset_index(drop=True)
+
+
+def scan_tickers(client):
+    '''
+    Reads every ticker file and keeps the latest row of every symbol, like the analysis job
+    '''
+    frames = []
+    for obj in client.list_objects_v2(Bucket=BUCKET_NAME, Prefix='ticker/raw/')['Contents']:
+        body = client.get_object(Bucket=BUCKET_NAME, Key=obj['Key'])['Body'].read()
+        frames.append(pd.read_csv(BytesIO(body), sep='|', dtype=str, keep_default_na=False, compression='gzip' if obj['Key'].endswith('.gz') else None))
+    tickers = pd.concat(frames, ignore_index=True)
+    tickers = tickers.sort_values('updatedAt', kind='mergesort').drop_duplicates('Symbol', keep='last')
+    return tickers.sort_values('Symbol').reset_index(drop=True)
+
+
+def timed(client, scan):
+    requests = client.requests
+    start = time.perf_counter()
+    result = scan(client)
+    return result, round(time.perf_counter() - start, 3), client.requests - requests
+
+
+def count(client, prefix):
+    return len(client.keys(BUCKET_NAME, prefix))
+
+
+def measure(args, data_format):
+    client = LocalS3Client(latency=args.latency)
+    populate(client, args.tickers, args.days, args.batch_size, data_format, args.seed)
+    compact_files.DATA_FORMAT = data_format
+
+    before = {'data_files': count(client, 'data/raw/'), 'ticker_files': count(client, 'ticker/raw/')}
+    data_before, before['data_scan_s'], before['data_scan_requests'] = timed(client, scan_data)
+    tickers_before, before['ticker_scan_s'], before['ticker_scan_requests'] = timed(client, scan_tickers)
+
+    with patched(boto3, 'client', lambda service, *a, **kw: client):
+        clients.clear()
+        start = time.perf_counter()
+        result = compact_files.lambda_handler({}, None)
+        compaction_s = round(time.perf_counter() - start, 3)
+        again = compact_files.lambda_handler({}, None)
+    clients.clear()
+
+    after = {'data_files': count(client, 'data/raw/'), 'ticker_files': count(client, 'ticker/raw/')}
+    data_after, after['data_scan_s'], after['data_scan_requests'] = timed(client, scan_data)
+    tickers_after, after['ticker_scan_s'], after['ticker_scan_requests'] = timed(client, scan_tickers)
+
+    return {
+        'data_format': data_format,
+        'before': before,
+        'after': after,
+        'file_reduction': round((before['data_files'] + before['ticker_files']) / (after['data_files'] + after['ticker_files']), 1),
+        'data_scan_speedup': round(before['data_scan_s'] / after['data_scan_s'], 1),
+        'ticker_scan_speedup': round(before['ticker_scan_s'] / after['ticker_scan_s'], 1),
+        'compaction_s': compaction_s,
+        'archived': count(client, 'data/archive/') + count(client, 'ticker/archive/'),
+        'data_parity': data_before.equals(data_after),
+        'ticker_parity': tickers_before.equals(tickers_after),
+        'second_run_compacted': len(again['Compacted']),
+        'periods': [{key: period[key] for key in ('Dataset', 'Period', 'Sources', 'Rows')} for period in result['Compacted']]
+    }
+
+
+def recovery(args):
+    '''
+    Fails the first archive after the commit, the next run archives the committed sources
+    '''
+    client = LocalS3Client()
+    populate(client, args.tickers, 20, args.batch_size, 'parquet', args.seed)
+    compact_files.DATA_FORMAT = 'parquet'
+    expected = scan_data(client)
+    archive = compact_files.archive
+
+    def failing(*a, **kw):
+        raise RuntimeError('archive failed')
+
+    with patched(boto3, 'client', lambda service, *a, **kw: client):
+        clients.clear()
+        try:
+            with patched(compact_files, 'archive', failing):
+                compact_files.lambda_handler({'datasets': ['data']}, None)
+        except RuntimeError:
+            pass
+        interrupted = {'data_files': count(client, 'data/raw/'), 'manifests': count(client, 'data/transform/compaction/')}
+        result = compact_files.lambda_handler({'datasets': ['data']}, None)
+    clients.clear()
+    assert compact_files.archive is archive
+    return {
+        'interrupted': interrupted,
+        'recovered': result['Recovered'],
+        'data_files': count(client, 'data/raw/'),
+        'manifests': count(client, 'data/transform/compaction/'),
+        'parity': scan_data(client).equals(expected)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--days', type=int, default=252, help='daily runs, from 2023-01-02')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds per S3 request')
+    parser.add_argument('--formats', nargs='+', choices=['parquet', 'csv'], default=['parquet', 'csv'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.update(FOLDERS)
+    # every synthetic file is older than the minimum age
+    compact_files.MIN_AGE = timedelta(0)
+    report = {
+        'config': vars(args),
+        'results': [measure(args, data_format) for data_format in args.formats],
+        'recovery': recovery(args)
+    }
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
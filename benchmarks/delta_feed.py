@@ -0,0 +1,156 @@
+'''
+Bytes a client downloads per refresh of the analysis summary, the full document against the
+changes since the version it has (/data?since=<version>). The analysis engine runs once per
+business day over a synthetic market, every run is published as a new version with its delta
+(analysis_versions.py), and every few days one company leaves the list and one joins it.
+
+Clients refresh after 1, 5 or 21 versions, and after more than the versions kept, where the API
+falls back to the full summary. Every delta is applied to the summary the client had and compared
+with the latest summary.
+
+    python benchmarks/delta_feed.py --tickers 200 --years 10 --days 45 --lags 1 5 21 40
+'''
+
+import os
+import sys
+import json
+import base64
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.update(BUCKET_NAME='delta-bucket', OBJECT_KEY='analysis/summary.json', TICKER_PREFIX='analysis/tickers')
+
+import pandas as pd
+import analysis_engine
+import analysis_versions
+import read_s3
+import synthetic
+import instrumentation
+from stand_ins import LocalS3Client, use_client
+
+# the handler's metric log lines are built as in production but not printed
+instrumentation.log = lambda line: None
+
+BUCKET_NAME = os.environ['BUCKET_NAME']
+
+
+def apply(summary, delta):
+    '''
+    Applies a delta to a summary, as a client does
+    '''
+    companies = {company['ticker']: dict(company) for company in summary['companies'] if company['ticker'] not in delta['removed']}
+    companies.update({ticker: dict(company) for ticker, company in delta['added'].items()})
+    for ticker, fields in delta['changed'].items():
+        for field, value in fields.items():
+            if value is None:
+                companies[ticker].pop(field, None)
+            else:
+                companies[ticker][field] = value
+    return {
+        'companies': companies,
+        'benchmarks': delta.get('benchmarks', summary.get('benchmarks'))
+    }
+
+
+def comparable(summary):
+    return {
+        'companies': {company['ticker']: company for company in summary['companies']},
+        'benchmarks': summary.get('benchmarks')
+    }
+
+
+def refresh(since=None):
+    '''
+    Returns the body of a gzip refresh, its size and its size uncompressed
+    '''
+    event = {'queryStringParameters': {'since': since} if since else None, 'headers': {'Accept-Encoding': 'gzip'}}
+    response = read_s3.lambda_handler(event, None)
+    body = base64.b64decode(response['body']) if response.get('isBase64Encoded') else response['body'].encode('utf-8')
+    import gzip
+    raw = gzip.decompress(body) if response['headers'].get('Content-Encoding') == 'gzip' else body
+    return json.loads(raw), len(body), len(raw)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=200)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--days', type=int, default=45, help='daily analysis runs')
+    parser.add_argument('--churn-every', type=int, default=5, help='days between list changes')
+    parser.add_argument('--lags', type=int, nargs='+', default=[1, 5, 21, 40], help='versions between refreshes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run_dates = pd.bdate_range(end='2024-06-28', periods=args.days)
+    changes = args.days // args.churn_every + 1
+    data = synthetic.generate_market_data(args.tickers + changes, args.years, end_date=run_dates[-1], seed=args.seed)
+    tickers = synthetic.generate_tickers(args.tickers + changes, seed=args.seed)
+    companies, benchmarks = tickers[~tickers['Symbol'].str.startswith('^')], tickers[tickers['Symbol'].str.startswith('^')]
+
+    client = LocalS3Client()
+    use_client('s3', client)
+    read_s3.cache.clear()
+    read_s3.CACHE_TTL = 0
+
+    versions = []
+    summaries = {}
+    results = {lag: {'full': [], 'delta': [], 'delta_raw': [], 'full_raw': [], 'fallbacks': 0, 'correct': True} for lag in args.lags}
+    for day, run_date in enumerate(run_dates):
+        shift = day // args.churn_every
+        listed = pd.concat([companies.iloc[shift:shift + args.tickers], benchmarks])
+        document = analysis_engine.run_analysis(data[data['Date'] < run_date], listed, today=run_date.to_pydatetime())
+        summary, _ = analysis_engine.split_output(document)
+        version = f'{run_date:%Y-%m-%d}-00-00-00'
+        summary[0]['version'] = version
+        analysis_versions.publish(client, BUCKET_NAME, 'analysis', summary[0])
+        client.put_object(Bucket=BUCKET_NAME, Key=os.environ['OBJECT_KEY'], Body=analysis_engine.to_json(summary))
+        versions.append(version)
+        summaries[version] = summary[0]
+
+        full, full_size, full_raw = refresh()
+        for lag in args.lags:
+            if day < lag:
+                continue
+            since = versions[day - lag]
+            body, size, raw = refresh(since)
+            result = results[lag]
+            result['full'].append(full_size)
+            result['full_raw'].append(full_raw)
+            result['delta'].append(size)
+            result['delta_raw'].append(raw)
+            if isinstance(body, list):
+                result['fallbacks'] += 1
+                result['correct'] &= comparable(body[0]) == comparable(full[0])
+            else:
+                result['correct'] &= apply(summaries[since], body) == comparable(full[0])
+
+    index = json.loads(client.get_object(Bucket=BUCKET_NAME, Key='analysis/versions.json')['Body'].read())
+    report = {
+        'config': vars(args),
+        'companies': len(summaries[versions[-1]]['companies']),
+        'versions_kept': len(index['versions']),
+        'changed_companies_per_version': round(statistics.mean(entry.get('changed', 0) for entry in index['versions'][1:]), 1),
+        'refreshes': [
+            {
+                'versions_behind': lag,
+                'refreshes': len(result['full']),
+                'fallbacks': result['fallbacks'],
+                'full_kb': round(statistics.mean(result['full']) / 2**10, 2),
+                'delta_kb': round(statistics.mean(result['delta']) / 2**10, 2),
+                'full_raw_kb': round(statistics.mean(result['full_raw']) / 2**10, 2),
+                'delta_raw_kb': round(statistics.mean(result['delta_raw']) / 2**10, 2),
+                'reduction': round(sum(result['full']) / sum(result['delta']), 2),
+                'applied_equals_full': result['correct']
+            }
+            for lag, result in results.items() if result['full']
+        ]
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
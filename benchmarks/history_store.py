@@ -0,0 +1,133 @@
+'''
+Range lookups on the per-ticker history store against filtering the raw data of a ticker, over
+histories of increasing length, and the requests and bytes of a daily append.
+The analysis histories read from the store are compared with the ones built from the raw data.
+
+    latest_30d - the price history window of the analysis
+    latest_365d - the dividend history window of the analysis
+    latest_5y - the window of the five year returns
+    middle_1y - a year in the middle of the history, like an API range request
+
+    python benchmarks/history_store.py --years 1 10 30 60 --tickers 50
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+import analysis_engine
+from history_store import HistoryStore, to_records
+from raw_data import conform
+from stand_ins import LocalS3Client
+import synthetic
+
+
+def median_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def lookups(years, today, repeat, workdir):
+    data = conform(synthetic.generate_market_data(1, years, end_date=today))
+    rows = data[data['Ticker'] == data['Ticker'].iloc[0]]
+    ticker = rows['Ticker'].iloc[0]
+
+    s3 = LocalS3Client()
+    store = HistoryStore(s3, 'history-bucket', 'data/history', cache_dir=os.path.join(workdir, str(years)), ttl=3600)
+    records = to_records(rows)
+    # the history up to a week ago in one append, then one append per day
+    store.append(ticker, records[:-5])
+    requests, written = s3.requests, s3.bytes_written
+    for day in range(5, 0, -1):
+        store.append(ticker, records[len(records) - day:len(records) - day + 1])
+    daily_append = {'requests': (s3.requests - requests) / 5, 'kb_written': round((s3.bytes_written - written) / 5 / 1024, 1)}
+    store.range(ticker)
+
+    middle = today - timedelta(days=365 * years // 2)
+    windows = {
+        'latest_30d': (today - timedelta(days=30), None),
+        'latest_365d': (today - timedelta(days=365), None),
+        'latest_5y': (today - timedelta(days=365 * 5), None),
+        'middle_1y': (middle - timedelta(days=365), middle)
+    }
+
+    def filtered(start, end):
+        selected = rows[rows['Date'] >= start]
+        return selected if end is None else selected[selected['Date'] < end]
+
+    results = {}
+    for name, (start, end) in windows.items():
+        assert len(store.range(ticker, start, end)) == len(filtered(start, end))
+        results[name] = {
+            'store_us': round(median_time(lambda: store.range(ticker, start, end), repeat) * 1e6, 1),
+            'filter_us': round(median_time(lambda: filtered(start, end), repeat) * 1e6, 1)
+        }
+    return {
+        'years': years,
+        'rows': len(records),
+        'stored_kb': round(sum(len(stored['Body']) for stored in s3.objects.values()) / 1024, 1),
+        'daily_append': daily_append,
+        'windows': results
+    }
+
+
+def parity(n_tickers, years, today, workdir):
+    '''
+    Differences between the analysis histories read from the store and built from the raw data
+    '''
+    data = synthetic.generate_market_data(n_tickers, years, end_date=today, staggered=True)
+    store = HistoryStore(LocalS3Client(), 'history-bucket', 'data/history', cache_dir=os.path.join(workdir, 'parity'), ttl=3600)
+    for ticker, rows in conform(data).groupby('Ticker'):
+        store.append(ticker, to_records(rows))
+
+    company_data = analysis_engine.transform_data(data)
+    company_data = company_data[~company_data['ticker'].isin(analysis_engine.BENCHMARK_TICKERS)].reset_index(drop=True)
+    start = time.perf_counter()
+    expected = analysis_engine.historical_prices(company_data, today)
+    filter_s = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = analysis_engine.store_histories(store, company_data['ticker'].unique(), today)
+    store_s = time.perf_counter() - start
+
+    expected = expected.set_index('ticker').sort_index()
+    actual = actual.set_index('ticker').sort_index()
+    differences = int((expected.index != actual.index).sum()) if len(expected) == len(actual) else abs(len(expected) - len(actual))
+    if not differences:
+        differences = sum(
+            expected.at[ticker, column] != actual.at[ticker, column]
+            for ticker in expected.index for column in ['priceHistory', 'dividendHistory']
+        )
+    return {'tickers': len(expected), 'differences': int(differences), 'filter_s': round(filter_s, 3), 'store_cold_s': round(store_s, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 10, 30, 60])
+    parser.add_argument('--tickers', type=int, default=50, help='companies of the parity check')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    today = datetime(2024, 1, 2)
+    with tempfile.TemporaryDirectory() as workdir:
+        report = {
+            'config': vars(args),
+            'lookups': [lookups(years, today, args.repeat, workdir) for years in args.years],
+            'parity': parity(args.tickers, 10, today, workdir)
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+'''
+Import time of every Lambda handler, the part of a cold start spent before the handler runs.
+Every handler module is imported --repeat times in a fresh interpreter with -X importtime,
+and the median of its cumulative import time is reported with its heaviest direct imports.
+Handlers whose dependencies are not installed are reported with the missing module.
+Results can be saved under benchmarks/results/ and compared with a previous result, like the suite.
+
+    python benchmarks/import_times.py --save
+    python benchmarks/import_times.py --compare benchmarks/results/<file>-imports.json
+'''
+
+import os
+import re
+import sys
+import json
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FOLDER = os.path.join(ROOT, 'benchmarks', 'results')
+# the handler modules of template.yaml, cfnresponse comes from its layer
+HANDLERS = [
+    's3_objects', 'ticker_collector', 'start_step_function', 'ticker_diff', 'shard_tickers', 'data_collector',
+    'merge_shards', 'detect_changes', 'register_partitions', 'start_crawler', 'check_crawler', 'move_file', 'compact_files', 'read_s3'
+]
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def import_profile(module):
+    '''
+    Imports the module in a fresh interpreter and returns its cumulative import time and the
+    cumulative time of each of its direct imports in microseconds, or the error of a failed import
+    '''
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'layers', 'cfnresponse', 'python')]),
+        AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')
+    )
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if completed.returncode:
+        return None, completed.stderr.strip().splitlines()[-1]
+
+    # imports are listed after the modules they import, one indentation level deeper
+    children = {}
+    for line in completed.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        if not match.group(3):
+            if match.group(4) == module:
+                return (int(match.group(2)), children), None
+            children = {}
+        elif len(match.group(3)) == 2:
+            children[match.group(4)] = int(match.group(2))
+    return (0, children), None
+
+
+def profile(module, repeat):
+    totals = []
+    heaviest = {}
+    for _ in range(repeat):
+        imports, error = import_profile(module)
+        if error:
+            return {'error': error}
+        total, children = imports
+        totals.append(total)
+        for name, cumulative in children.items():
+            heaviest.setdefault(name, []).append(cumulative)
+
+    top = sorted(((name, statistics.median(times)) for name, times in heaviest.items()), key=lambda item: -item[1])[:5]
+    return {
+        'median_ms': round(statistics.median(totals) / 1000, 1),
+        'min_ms': round(min(totals) / 1000, 1),
+        'heaviest_ms': {name: round(cumulative / 1000, 1) for name, cumulative in top}
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handlers', nargs='+', default=HANDLERS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', action='store_true', help='save the result under benchmarks/results')
+    parser.add_argument('--compare', help='result file to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    report = {
+        'commit': current_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'config': {'repeat': args.repeat},
+        'handlers': {module: profile(module, args.repeat) for module in args.handlers}
+    }
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        ratios = {
+            module: round(result['median_ms'] / baseline['handlers'][module]['median_ms'], 3)
+            for module, result in report['handlers'].items()
+            if 'median_ms' in result and baseline['handlers'].get(module, {}).get('median_ms')
+        }
+        regressions = sorted(module for module, ratio in ratios.items() if ratio > args.threshold)
+        report['comparison'] = {'baseline': baseline['commit'], 'ratios': ratios, 'regressions': regressions}
+
+    if args.save:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        path = os.path.join(RESULTS_FOLDER, f"{report['commit']}-imports.json")
+        with open(path, 'w') as result_file:
+            json.dump(report, result_file, indent=2)
+        report['saved'] = os.path.relpath(path, ROOT)
+
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+'''
+Throughput of the archive stage (move_file.py) on a local S3 stand-in with a fixed latency per
+request. The files of a run are moved one request at a time, like the previous single file
+move (copy_object + delete_object per file), and by the batched mover at every worker count.
+Every batched move is run twice to check that a retry finds nothing left to move.
+
+    python benchmarks/move_throughput.py --files 5000 --latency 0.005 --workers 1 4 16 32
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+import clients
+import move_file
+import instrumentation
+from pipeline import patched
+from stand_ins import LocalS3Client
+
+# the handler's metric log lines are built as in production but not printed
+instrumentation.log = lambda line: None
+
+BUCKET_NAME = 'move-bucket'
+SOURCE_LOCATION = 'data/raw'
+
+
+def populate(files, size, large, large_size, latency):
+    client = LocalS3Client(latency=latency)
+    body = b'x' * size
+    for file in range(files):
+        client.store(BUCKET_NAME, f'{SOURCE_LOCATION}/year={2000 + file % 20}/run-batch-{file}.parquet', body)
+    for file in range(large):
+        client.store(BUCKET_NAME, f'{SOURCE_LOCATION}/large-{file}.csv', b'y' * large_size)
+    return client
+
+
+def event(client, mode):
+    keys = client.keys(BUCKET_NAME, SOURCE_LOCATION)
+    base = {'bucket_name': BUCKET_NAME, 'archive_folder': 'archive', 'error_folder': 'error'}
+    if mode == 'prefix':
+        return dict(base, prefix=SOURCE_LOCATION + '/', taskresult={'Location': SOURCE_LOCATION, 'Validation': 'SUCCESS'})
+    return dict(base, taskresult={'Location': SOURCE_LOCATION, 'Validation': 'SUCCESS', 'Files': keys})
+
+
+def one_by_one(client):
+    for key in client.keys(BUCKET_NAME, SOURCE_LOCATION):
+        client.copy_object(Bucket=BUCKET_NAME, Key='data/archive' + key[len(SOURCE_LOCATION):], CopySource=f'{BUCKET_NAME}/{key}')
+        client.delete_object(Bucket=BUCKET_NAME, Key=key)
+
+
+def measure(client, run):
+    requests = client.requests
+    start = time.perf_counter()
+    result = run()
+    return time.perf_counter() - start, client.requests - requests, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=1024, help='bytes per file')
+    parser.add_argument('--large', type=int, default=4, help='files above the multipart threshold')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds per S3 request')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16, 32])
+    args = parser.parse_args()
+
+    # large files of 5 parts, with thresholds scaled down so they fit in memory
+    move_file.MULTIPART_THRESHOLD = 2**20
+    move_file.PART_SIZE = 2**20
+    large_size = 5 * 2**20
+    total = args.files + args.large
+
+    results = []
+    client = populate(args.files, args.size, args.large, large_size, args.latency)
+    elapsed, requests, _ = measure(client, lambda: one_by_one(client))
+    results.append({'mover': 'one_by_one', 'workers': 1, 'wall_time_s': round(elapsed, 3), 'files_per_s': round(total / elapsed, 1), 'requests': requests})
+
+    for mode in ['manifest', 'prefix']:
+        for workers in args.workers:
+            client = populate(args.files, args.size, args.large, large_size, args.latency)
+            move_file.MAX_WORKERS = workers
+            clients.clear()
+            run_event = event(client, mode)
+            with patched(boto3, 'client', lambda service, *a, **kw: client):
+                elapsed, requests, result = measure(client, lambda: move_file.lambda_handler(run_event, None))
+                retried = move_file.lambda_handler(run_event, None)
+            moved = client.keys(BUCKET_NAME, 'data/archive/')
+            results.append({
+                'mover': f'batched_{mode}',
+                'workers': workers,
+                'wall_time_s': round(elapsed, 3),
+                'files_per_s': round(total / elapsed, 1),
+                'requests': requests,
+                'moved': result['Moved'],
+                'complete': len(moved) == total and not client.keys(BUCKET_NAME, SOURCE_LOCATION + '/'),
+                'intact': all(len(client.objects[(BUCKET_NAME, key)]['Body']) in (args.size, large_size) for key in moved),
+                'retry': {'Moved': retried['Moved'], 'AlreadyMoved': retried['AlreadyMoved']}
+            })
+    clients.clear()
+
+    print(json.dumps({'config': vars(args), 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+'''
+Runs the step function flow locally for a number of consecutive business days and reports the
+wall time, S3 bytes read and written, S3 requests and peak memory of every stage:
+
+    ticker collector -> start step function -> ticker diff -> shard tickers -> data collector
+    (once per shard) -> merge shards -> change detection -> partition registration -> dividend
+    analysis -> API reads
+
+The Lambda handlers run unchanged against in-memory S3, Glue and Step Functions stand-ins, with
+Wikipedia and yfinance replaced by synthetic sources. Every day one ticker leaves the list and one
+joins it. A day the ticker collector or the change detection skips has no later stages. The shards run one after the other, the data collector stage adds them up. The dividend analysis Glue job needs Spark, so its stage runs the analysis engine
+instead (see analysis_parity.py for the comparison with the Glue job). Only the declared
+catalog mode is run, the crawlers are not emulated.
+
+    python benchmarks/pipeline.py --tickers 100 --years 20 --days 3 --output pipeline.json
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+import boto3
+import numpy as np
+import pandas as pd
+import stand_ins
+import synthetic
+import instrumentation
+
+# metric log lines of the handlers, reported with the stage that emitted them instead of printed
+emitted = []
+instrumentation.log = emitted.append
+
+BUCKET_NAME = 'pipeline-bucket'
+DATABASE = 'pipeline-database'
+FOLDERS = {
+    'ticker_folder': 'ticker',
+    'data_folder': 'data',
+    'analysis_folder': 'analysis',
+    'raw_folder': 'raw',
+    'transform_folder': 'transform',
+    'archive_folder': 'archive',
+    'error_folder': 'error'
+}
+
+
+class FakeMarketSource:
+    '''
+    Serves the rows of a synthetic dataset in the requested date range, like the yfinance source
+    '''
+
+    def __init__(self, data):
+        self.data = {ticker: rows.reset_index(drop=True) for ticker, rows in data.groupby('Ticker', sort=False)}
+        self.requests = 0
+
+    def __call__(self, tickers, start_date, end_date):
+        self.requests += len(tickers)
+        frames = []
+        for ticker in tickers:
+            rows = self.data.get(ticker)
+            if rows is None:
+                continue
+            dates = rows['Date'].to_numpy()
+            start, end = np.searchsorted(dates, np.datetime64(start_date)), np.searchsorted(dates, np.datetime64(end_date))
+            if end > start:
+                frames.append(rows.iloc[start:end])
+        if not frames:
+            return pd.DataFrame(columns=['Date', 'Ticker'])
+        return pd.concat(frames, ignore_index=True)
+
+
+class MemorySampler:
+    '''
+    Samples the resident set size of the process on a background thread, reading /proc/self/statm
+    peak is None where /proc is not available
+    '''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = None
+        self.running = False
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def rss(self):
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * self.page_size
+        except OSError:
+            return None
+
+    def sample(self):
+        while self.running:
+            rss = self.rss()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.running = False
+        self.thread.join()
+
+
+@contextlib.contextmanager
+def stage(report, name, s3_client):
+    '''
+    Records the wall time, S3 traffic and peak memory of the enclosed stage
+    '''
+    requests, bytes_read, bytes_written = s3_client.requests, s3_client.bytes_read, s3_client.bytes_written
+    del emitted[:]
+    with MemorySampler() as sampler:
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+    report[name] = {
+        'wall_time_s': round(elapsed, 4),
+        's3_requests': s3_client.requests - requests,
+        'bytes_read': s3_client.bytes_read - bytes_read,
+        'bytes_written': s3_client.bytes_written - bytes_written,
+        'peak_rss_mb': round(sampler.peak / 2**20, 1) if sampler.peak else None
+    }
+    # the step timings the handlers report, summed over their invocations
+    steps = {}
+    for line in emitted:
+        for step, value in json.loads(line).items():
+            if step.endswith('Ms') and step != 'DurationMs':
+                steps[step[:-2]] = round(steps.get(step[:-2], 0) + value, 1)
+    if steps:
+        report[name]['handler_steps_ms'] = steps
+
+
+@contextlib.contextmanager
+def patched(target, name, value):
+    original = getattr(target, name)
+    setattr(target, name, value)
+    try:
+        yield
+    finally:
+        setattr(target, name, original)
+
+
+def frozen_datetime(now):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def today(cls):
+            return cls.combine(now.date(), now.time())
+
+    return FrozenDatetime
+
+
+def read_table(s3_client, key, **kwargs):
+    body = s3_client.get_object(Bucket=BUCKET_NAME, Key=key)['Body']
+    if key.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(body).to_pandas().rename(columns={'adj_close': 'adj close'})
+    return pd.read_csv(body, **kwargs)
+
+
+def dividend_analysis(s3_client, today):
+    '''
+    Runs the analysis engine over every stored file and writes the outputs of the Glue job
+    '''
+    import analysis_engine
+    import analysis_versions
+    import analysis_rollups
+
+    data_prefix = f"{FOLDERS['data_folder']}/{FOLDERS['raw_folder']}/"
+    ticker_prefix = f"{FOLDERS['ticker_folder']}/{FOLDERS['raw_folder']}/"
+    raw_data = pd.concat([read_table(s3_client, key) for key in s3_client.keys(BUCKET_NAME, data_prefix)], ignore_index=True)
+    raw_tickers = pd.concat([read_table(s3_client, key, sep='|') for key in s3_client.keys(BUCKET_NAME, ticker_prefix)], ignore_index=True)
+
+    summary, details = analysis_engine.split_output(analysis_engine.run_analysis(raw_data, raw_tickers, today=today))
+
+    analysis_folder = FOLDERS['analysis_folder']
+    version = f'{today:%Y-%m-%d-%H-%M-%S}'
+    summary[0]['version'] = version
+    analysis_versions.publish(s3_client, BUCKET_NAME, analysis_folder, summary[0])
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=f'{analysis_folder}/rollups.json', Body=analysis_engine.to_json(analysis_rollups.rollups(summary[0])))
+    for ticker, detail in details.items():
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=f'{analysis_folder}/tickers/{ticker}.json', Body=analysis_engine.to_json(detail))
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=f'{analysis_folder}/summary.json', Body=analysis_engine.to_json(summary))
+    s3_client.put_object(
+        Bucket=BUCKET_NAME,
+        Key=f'{analysis_folder}/manifest.json',
+        Body=json.dumps({
+            'lastUpdated': summary[0]['lastUpdated'],
+            'version': version,
+            'rollups': f'{analysis_folder}/rollups.json',
+            'summary': f'{analysis_folder}/summary.json',
+            'tickers': {ticker: f'{analysis_folder}/tickers/{ticker}.json' for ticker in sorted(details)}
+        })
+    )
+    stale = [key for key in s3_client.keys(BUCKET_NAME, f'{analysis_folder}/tickers/') if key.split('/')[-1][:-len('.json')] not in details]
+    if stale:
+        s3_client.delete_objects(Bucket=BUCKET_NAME, Delete={'Objects': [{'Key': key} for key in stale]})
+    return {'Companies': len(details)}
+
+
+def api_reads(read_s3, summary):
+    companies = summary['companies']
+    events = [
+        {'headers': {'Accept-Encoding': 'gzip'}},
+        {'queryStringParameters': {'sector': companies[0]['sector']}} if companies else {},
+        {'pathParameters': {'ticker': companies[0]['ticker']}} if companies else {}
+    ]
+    return [read_s3.lambda_handler(event, None)['statusCode'] for event in events]
+
+
+def declare_data_table(glue_client, data_format):
+    location = f"s3://{BUCKET_NAME}/{FOLDERS['data_folder']}/{FOLDERS['raw_folder']}/"
+    table = {'Name': f"data-{FOLDERS['raw_folder']}", 'StorageDescriptor': {'Location': location, 'Columns': []}}
+    if data_format == 'parquet':
+        table['PartitionKeys'] = [{'Name': 'year', 'Type': 'string'}]
+    glue_client.create_table(DatabaseName=DATABASE, TableInput=table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=100)
+    parser.add_argument('--years', type=int, default=20)
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--start-date', default='2024-01-02')
+    parser.add_argument('--data-format', choices=['csv', 'parquet'], default='parquet')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    run_dates = pd.bdate_range(start=args.start_date, periods=args.days)
+    universe = args.tickers + args.days
+    companies = synthetic.generate_tickers(universe, seed=args.seed)
+    companies = companies[~companies['Symbol'].str.startswith('^')].drop(columns='updatedAt')
+    source = FakeMarketSource(synthetic.generate_market_data(universe, args.years, end_date=run_dates[-1], seed=args.seed))
+
+    s3_client = stand_ins.LocalS3Client()
+    glue_client = stand_ins.LocalGlueClient()
+    step_functions = stand_ins.LocalStepFunctionsClient()
+    clients = {'s3': s3_client, 'glue': glue_client, 'stepfunctions': step_functions}
+    declare_data_table(glue_client, args.data_format)
+
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'BUCKETNAME': BUCKET_NAME,
+        'BUCKET_NAME': BUCKET_NAME,
+        'TICKER_FOLDER': FOLDERS['ticker_folder'],
+        'DATA_FOLDER': FOLDERS['data_folder'],
+        'RAW_FOLDER': FOLDERS['raw_folder'],
+        'TRANSFORM_FOLDER': FOLDERS['transform_folder'],
+        'ANALYSIS_FOLDER': FOLDERS['analysis_folder'],
+        'ARCHIVE_FOLDER': FOLDERS['archive_folder'],
+        'ERROR_FOLDER': FOLDERS['error_folder'],
+        'STEP_FUNC_ARN': 'arn:aws:states:us-east-1:000000000000:stateMachine:pipeline',
+        'CATALOG_MODE': 'declared',
+        'DATA_FORMAT': args.data_format,
+        'GLUE_DATABASE': DATABASE,
+        'TABLE_NAME': f"data-{FOLDERS['raw_folder']}",
+        'OBJECT_KEY': f"{FOLDERS['analysis_folder']}/summary.json",
+        'TICKER_PREFIX': f"{FOLDERS['analysis_folder']}/tickers",
+        'ROLLUPS_KEY': f"{FOLDERS['analysis_folder']}/rollups.json",
+        'CACHE_TTL': '0'
+    })
+
+    days = []
+    with patched(boto3, 'client', lambda service, *a, **kw: clients[service]):
+        import ticker_collector
+        import start_step_function
+        import ticker_diff
+        import data_collector
+        import shard_tickers
+        import merge_shards
+        import detect_changes
+        import register_partitions
+        import read_s3
+
+        for day, run_date in enumerate(run_dates):
+            now = run_date.to_pydatetime()
+            listed = companies.iloc[day:day + args.tickers]
+            stages = {}
+            results = {}
+
+            with patched(ticker_collector, 'datetime', frozen_datetime(now)), patched(pd, 'read_html', lambda *a, **kw: [listed.copy()]):
+                existing = set(s3_client.keys(BUCKET_NAME))
+                with stage(stages, 'ticker_collector', s3_client):
+                    results['ticker_collector'] = json.loads(ticker_collector.lambda_handler({}, None)['body'])
+                ticker_keys = sorted(set(s3_client.keys(BUCKET_NAME)) - existing)
+            if not ticker_keys:
+                days.append({'date': f'{now:%Y-%m-%d}', 'stages': stages, 'results': results})
+                continue
+            ticker_key = ticker_keys[0]
+
+            record = {'s3': {'bucket': {'name': BUCKET_NAME, 'arn': f'arn:aws:s3:::{BUCKET_NAME}'}, 'object': {'key': ticker_key}}}
+            with stage(stages, 'start_step_function', s3_client):
+                start_step_function.lambda_handler({'Records': [record]}, None)
+            execution = json.loads(step_functions.executions[-1]['input'])
+
+            with stage(stages, 'ticker_diff', s3_client):
+                diffed = ticker_diff.lambda_handler(execution, None)
+            results['ticker_diff'] = {'New': diffed['New'], 'Old': diffed['Old'], 'Removed': len(diffed['Removed'])}
+
+            with patched(shard_tickers, 'datetime', frozen_datetime(now)):
+                with stage(stages, 'shard_tickers', s3_client):
+                    sharded = shard_tickers.lambda_handler(execution, None)
+            results['shard_tickers'] = [shard['tickers'] for shard in sharded['Shards']]
+
+            shard_results = []
+            with patched(data_collector, 'datetime', frozen_datetime(now)):
+                with stage(stages, 'data_collector', s3_client):
+                    for shard in sharded['Shards']:
+                        shard_results.append(data_collector.lambda_handler(dict(execution, shard=shard), None, source=source))
+
+            with stage(stages, 'merge_shards', s3_client):
+                collected = merge_shards.lambda_handler(dict(execution, shardresults=shard_results), None)
+            results['data_collector'] = {key: collected.get(key) for key in ('Validation', 'Tickers', 'FailedShards') if key in collected}
+            results['data_collector']['Files'] = len(collected.get('Files', []))
+
+            with stage(stages, 'detect_changes', s3_client):
+                changes = detect_changes.lambda_handler(dict(execution, tickerresult=diffed, taskresult=collected), None)
+            results['detect_changes'] = changes['Changes']
+            if not changes['Changed']:
+                days.append({'date': f'{now:%Y-%m-%d}', 'stages': stages, 'results': results})
+                continue
+
+            with stage(stages, 'register_partitions', s3_client):
+                results['register_partitions'] = register_partitions.lambda_handler(dict(execution, taskresult=collected), None)['Registered']
+
+            with stage(stages, 'dividend_analysis', s3_client):
+                results['dividend_analysis'] = dividend_analysis(s3_client, now)
+                detect_changes.lambda_handler(dict(execution, action='analyzed'), None)
+
+            summary = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=os.environ['OBJECT_KEY'])['Body'].read())[0]
+            with stage(stages, 'api_reads', s3_client):
+                results['api_reads'] = api_reads(read_s3, summary)
+
+            days.append({'date': f'{now:%Y-%m-%d}', 'stages': stages, 'results': results})
+
+    report = {
+        'config': {
+            'tickers': args.tickers,
+            'years': args.years,
+            'days': args.days,
+            'data_format': args.data_format,
+            'seed': args.seed
+        },
+        'days': days,
+        'totals': {
+            name: round(sum(day['stages'][name]['wall_time_s'] for day in days if name in day['stages']), 4)
+            for name in {name: None for day in days for name in day['stages']}
+        },
+        'stored_mb': round(sum(len(stored['Body']) for stored in s3_client.objects.values()) / 2**20, 2)
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+'''
+Latency and payload of screening views served from the precomputed rollups (/data/top and
+/data/rollups) against a scan of the summary, the client pulling every company, filtering a group
+and sorting it, on synthetic summaries of increasing size. Every top-k response is compared with
+the scan. Distinct queries are built from the rankings once, repeated ones are served from the
+response cache.
+
+    python benchmarks/screening.py --companies 500 3000 10000 --k 5 --queries 200
+'''
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.update(
+    BUCKET_NAME='screening-bucket', OBJECT_KEY='analysis/summary.json',
+    TICKER_PREFIX='analysis/tickers', ROLLUPS_KEY='analysis/rollups.json'
+)
+
+import numpy as np
+import analysis_rollups
+import read_s3
+import synthetic
+import instrumentation
+from stand_ins import LocalS3Client, use_client
+
+# the handler's metric log lines are built as in production but not printed
+instrumentation.log = lambda line: None
+
+BUCKET_NAME = os.environ['BUCKET_NAME']
+
+
+def synthetic_summary(n_companies, seed):
+    '''
+    A summary document with the fields of the analysis job and random metrics, a few of them missing
+    '''
+    rng = np.random.default_rng(seed)
+    symbols = synthetic.ticker_symbols(n_companies)
+    sectors = rng.choice(synthetic.SECTORS, n_companies)
+    industries = rng.integers(0, 120, n_companies)
+    companies = []
+    for position, symbol in enumerate(symbols):
+        company = {
+            'ticker': symbol,
+            'name': f'{symbol} Inc.',
+            'sector': str(sectors[position]),
+            'industry': f'Sub-Industry {industries[position]}',
+            'consecutiveGrowthYears': int(rng.integers(0, 40)),
+            'dividendFrequency': int(rng.choice([1, 2, 4, 12])),
+            'beta': float(rng.normal(1, 0.4)),
+            'fiveYearCAGR': float(rng.normal(0.05, 0.08)),
+            'lastDividend': float(rng.uniform(0.01, 2)),
+            'lastPrice': float(rng.uniform(5, 500)),
+            'requiredReturn': float(rng.uniform(0.04, 0.12))
+        }
+        if position % 17 == 0:
+            del company['beta']
+        companies.append(company)
+    return {'companies': companies, 'benchmarks': [], 'lastUpdated': '2024-06-28T00:00:00.000Z', 'version': '2024-06-28-00-00-00'}
+
+
+def request(resource, query=None):
+    start = time.perf_counter()
+    response = read_s3.lambda_handler({'resource': resource, 'queryStringParameters': query}, None)
+    elapsed = time.perf_counter() - start
+    body = base64.b64decode(response['body']) if response.get('isBase64Encoded') else response['body'].encode('utf-8')
+    return response['statusCode'], json.loads(body), elapsed, len(body)
+
+
+def scan(summary, group, name, metric, k):
+    '''
+    The client side screen: every company of the group with the metric, highest first
+    '''
+    members = [company for company in summary['companies'] if group == 'all' or company.get(group) == name]
+    ranked = sorted(
+        (company for company in members if analysis_rollups.value(company, metric) is not None),
+        key=lambda company: (-analysis_rollups.value(company, metric), company['ticker'])
+    )
+    return ranked[:k]
+
+
+def measure(n_companies, args):
+    summary = synthetic_summary(n_companies, args.seed)
+    client = LocalS3Client(latency=args.s3_latency)
+    summary_body = json.dumps([summary], separators=(',', ':')).encode('utf-8')
+    client.put_object(Bucket=BUCKET_NAME, Key=os.environ['OBJECT_KEY'], Body=summary_body)
+    start = time.perf_counter()
+    rollups_body = json.dumps(analysis_rollups.rollups(summary), separators=(',', ':')).encode('utf-8')
+    rollups_s = time.perf_counter() - start
+    client.put_object(Bucket=BUCKET_NAME, Key=os.environ['ROLLUPS_KEY'], Body=rollups_body)
+    use_client('s3', client)
+    read_s3.cache.clear()
+
+    # the summary is loaded first, as by any earlier request
+    request('/data')
+    rng = np.random.default_rng(args.seed)
+    groups = [('all', 'all')] + [('sector', sector) for sector in synthetic.SECTORS] + [('industry', f'Sub-Industry {i}') for i in range(120)]
+    queries = [(groups[i][0], groups[i][1], analysis_rollups.METRICS[j]) for i, j in zip(rng.integers(0, len(groups), args.queries), rng.integers(0, len(analysis_rollups.METRICS), args.queries))]
+
+    times = {'top_distinct': [], 'top_repeated': [], 'scan': []}
+    matches = True
+    top_bytes = []
+    seen = set()
+    for group, name, metric in queries:
+        query = {'metric': metric, 'k': str(args.k)}
+        if group != 'all':
+            query[group] = name
+        status, body, elapsed, size = request('/data/top', query)
+        times['top_repeated' if (group, name, metric) in seen else 'top_distinct'].append(elapsed)
+        seen.add((group, name, metric))
+        top_bytes.append(size)
+
+        start = time.perf_counter()
+        expected = scan(summary, group, name, metric, args.k)
+        times['scan'].append(time.perf_counter() - start)
+        matches &= status == 200 and body['companies'] == expected
+
+    _, rollup, rollup_s, rollup_size = request('/data/rollups', {'by': 'sector'})
+    summary_mean = statistics.mean(company['beta'] for company in summary['companies'] if 'beta' in company)
+    return {
+        'companies': n_companies,
+        'summary_kb': round(len(summary_body) / 2**10, 1),
+        'rollups_kb': round(len(rollups_body) / 2**10, 1),
+        'rollups_compute_ms': round(rollups_s * 1000, 2),
+        'top_distinct_ms': round(statistics.median(times['top_distinct']) * 1000, 3),
+        'top_repeated_ms': round(statistics.median(times['top_repeated']) * 1000, 3) if times['top_repeated'] else None,
+        'scan_ms': round(statistics.median(times['scan']) * 1000, 3),
+        'top_payload_kb': round(statistics.mean(top_bytes) / 2**10, 2),
+        'sector_rollups_kb': round(rollup_size / 2**10, 2),
+        'sector_rollups_ms': round(rollup_s * 1000, 3),
+        'matches_scan': bool(matches),
+        'market_beta_mean_matches': abs(request('/data/rollups', {'by': 'all'})[1]['groups']['all']['all']['beta']['mean'] - summary_mean) < 1e-12,
+        'sectors': len(rollup['groups']['sector'])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, nargs='+', default=[500, 3000, 10000])
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--s3-latency', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps({'config': vars(args), 'results': [measure(n, args) for n in args.companies]}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
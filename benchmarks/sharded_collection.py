@@ -0,0 +1,173 @@
+'''
+Throughput of the sharded data collection against the number of shard workers. The shard stage
+splits a universe of new and stored tickers, the shards are collected by a process pool, the local
+equivalent of the step function's Map state, and the merge stage folds the shard manifests into
+the last dates index. The processes share a directory backed S3 stand-in and a synthetic source
+with a fixed latency per ticker and per row, like yfinance. A collector Lambda has its own CPU, so
+the workers only scale locally while the run is bound by the source latency rather than the cores.
+
+Every run is checked: each ticker collected once, the merged index holds the last date of every
+ticker and the merged files are every file written.
+
+    python benchmarks/sharded_collection.py --tickers 1000 --stored 0.5 --workers 1 2 4 8
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+import clients
+import numpy as np
+import pandas as pd
+import instrumentation
+import synthetic
+from pipeline import patched, frozen_datetime
+from stand_ins import LocalS3Client, DirectoryObjects
+
+# the handlers' metric log lines are built as in production but not printed
+instrumentation.log = lambda line: None
+
+BUCKET_NAME = 'shard-bucket'
+TODAY = datetime(2024, 1, 2)
+EXECUTION = {
+    'bucket_name': BUCKET_NAME,
+    'ticker_folder': 'ticker',
+    'data_folder': 'data',
+    'raw_folder': 'raw',
+    'transform_folder': 'transform',
+    'file_name': '2024-01-02-00-00-00.csv'
+}
+
+
+class LatencySource:
+    '''
+    Business day bars from the first listed day of every ticker, after a latency per ticker and per row
+    tickers are listed 1 to YEARS years before today, so new tickers differ in history size
+    '''
+
+    YEARS = 10
+
+    def __init__(self, ticker_latency, row_latency):
+        self.ticker_latency = ticker_latency
+        self.row_latency = row_latency
+        self.days = pd.bdate_range(TODAY - timedelta(days=365 * self.YEARS), TODAY).values
+
+    def listed(self, ticker):
+        return TODAY - timedelta(days=365 * (1 + sum(map(ord, ticker)) % self.YEARS))
+
+    def __call__(self, tickers, start_date, end_date):
+        end = self.days.searchsorted(np.datetime64(end_date))
+        ranges = [self.days[self.days.searchsorted(np.datetime64(max(start_date, self.listed(ticker)))):end] for ticker in tickers]
+        data = pd.DataFrame({
+            'Date': np.concatenate(ranges),
+            'Ticker': np.repeat(tickers, [len(dates) for dates in ranges]),
+            'Adj Close': 1.0,
+            'Dividends': 0.0
+        })
+        time.sleep(self.ticker_latency * len(tickers) + self.row_latency * len(data))
+        return data
+
+
+def start_worker(root, batch_size, ticker_latency, row_latency):
+    '''
+    Sets up a shard worker process, the equivalent of a collector Lambda container
+    '''
+    global worker
+    import data_collector
+    data_collector.BATCH_SIZE = batch_size
+    data_collector.DATA_FORMAT = 'csv'
+    data_collector.HISTORY_PREFIX = None
+    data_collector.datetime = frozen_datetime(TODAY)
+    client = LocalS3Client(objects=DirectoryObjects(root))
+    boto3.client = lambda service, *a, **kw: client
+    clients.clear()
+    worker = (data_collector, LatencySource(ticker_latency, row_latency))
+
+
+def collect_shard(shard):
+    data_collector, source = worker
+    start = time.perf_counter()
+    result = data_collector.lambda_handler(dict(EXECUTION, shard=shard), None, source=source)
+    return dict(result, wall_time_s=time.perf_counter() - start)
+
+
+def populate(client, tickers, stored):
+    '''
+    Writes the ticker diff of a universe, the first `stored` tickers were last collected a week ago
+    '''
+    last_dates = {ticker: f'{TODAY - timedelta(days=7):%Y-%m-%d}' for ticker in tickers[:stored]}
+    client.put_object(Bucket=BUCKET_NAME, Key='ticker/transform/data_input.json', Body=json.dumps({
+        'New_Tickers': tickers[stored:], 'Old_Tickers': tickers[:stored], 'Removed_Tickers': []
+    }))
+    client.put_object(Bucket=BUCKET_NAME, Key='data/transform/last_dates.json', Body=json.dumps(last_dates))
+
+
+def run(args, tickers, workers, root):
+    import shard_tickers
+    import merge_shards
+
+    client = LocalS3Client(objects=DirectoryObjects(root))
+    populate(client, tickers, int(len(tickers) * args.stored))
+    # one shard per worker, the shard stage splits on expected rows alone
+    shard_tickers.MAX_SHARDS = workers
+    shard_tickers.SHARD_ROWS = 1
+
+    clients.clear()
+    start = time.perf_counter()
+    with patched(boto3, 'client', lambda service, *a, **kw: client), patched(shard_tickers, 'datetime', frozen_datetime(TODAY)):
+        sharded = shard_tickers.lambda_handler(EXECUTION, None)
+        with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(root, args.batch_size, args.ticker_latency, args.row_latency)) as executor:
+            shard_results = list(executor.map(collect_shard, sharded['Shards']))
+        merged = merge_shards.lambda_handler(dict(EXECUTION, shardresults=shard_results), None)
+    elapsed = time.perf_counter() - start
+
+    last_dates = json.loads(client.get_object(Bucket=BUCKET_NAME, Key='data/transform/last_dates.json')['Body'].read())
+    written = client.keys(BUCKET_NAME, 'data/raw/')
+    rows = [shard['rows'] for shard in sharded['Shards']]
+    times = [shard['wall_time_s'] for shard in shard_results]
+    return {
+        'workers': workers,
+        'shards': len(sharded['Shards']),
+        'wall_time_s': round(elapsed, 3),
+        'tickers_per_s': round(len(tickers) / elapsed, 1),
+        'expected_rows_imbalance': round(max(rows) / (sum(rows) / len(rows)), 3),
+        'shard_time_imbalance': round(max(times) / (sum(times) / len(times)), 3),
+        'succeeded': merged['Tickers']['Succeeded'],
+        'complete': merged['Validation'] == 'SUCCESS' and set(last_dates) == set(tickers) and min(last_dates.values()) == '2024-01-01',
+        'files_merged': sorted(merged['Files']) == written
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=1000)
+    parser.add_argument('--stored', type=float, default=0.5, help='share of the tickers with stored data')
+    parser.add_argument('--batch-size', type=int, default=25)
+    parser.add_argument('--ticker-latency', type=float, default=0.05, help='seconds per ticker request')
+    parser.add_argument('--row-latency', type=float, default=0.000002, help='seconds per downloaded row')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    tickers = synthetic.ticker_symbols(args.tickers)
+    results = []
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as root:
+            results.append(run(args, tickers, workers, root))
+    for result in results:
+        result['speedup'] = round(results[0]['wall_time_s'] / result['wall_time_s'], 2)
+
+    print(json.dumps({'config': vars(args), 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+'''
+Upstream requests and wall time of the data collector's market data sources, with and without
+the range cache, on synthetic data served with a fixed latency per ticker request.
+
+    retry - the same backfill collected twice, like a retried data collector invocation
+    extend - a backfill followed by the same tickers over a range ending days later
+    replay - a backfill from recorded files, without any upstream requests
+
+    python benchmarks/source_cache.py --tickers 200 --years 20 --latency 0.01
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+from batch_downloader import Batch, RateLimiter, collect
+from market_data import ReplaySource, CachedSource, LocalStore, S3Store
+from pipeline import FakeMarketSource
+from stand_ins import LocalS3Client
+import synthetic
+
+
+class SlowSource(FakeMarketSource):
+    '''
+    Synthetic source that takes latency seconds per ticker request, like a remote API
+    '''
+
+    def __init__(self, data, latency):
+        super().__init__(data)
+        self.latency = latency
+
+    def __call__(self, tickers, start_date, end_date):
+        time.sleep(self.latency * len(tickers))
+        return super().__call__(tickers, start_date, end_date)
+
+
+def run(source, tickers, ranges, batch_size):
+    '''
+    Collects the tickers over every range in turn and returns the wall time and rows of each
+    '''
+    runs = []
+    for start_date, end_date in ranges:
+        batches = [
+            Batch(f'batch-{batch}', tickers[batch:batch + batch_size], start_date, end_date)
+            for batch in range(0, len(tickers), batch_size)
+        ]
+        rows = []
+        start = time.perf_counter()
+        collect(
+            batches,
+            source=source,
+            save=lambda frames, name: rows.append(sum(len(frame) for frame in frames)) or [name],
+            max_workers=4,
+            limiter=RateLimiter(rate=None),
+            retries=1,
+            backoff=0
+        )
+        # like the data collector, the cache is trimmed once per invocation
+        if hasattr(source, 'evict'):
+            source.evict()
+        runs.append({'wall_time_s': round(time.perf_counter() - start, 3), 'rows': sum(rows)})
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=200)
+    parser.add_argument('--years', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per ticker request')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    today = datetime(2024, 1, 2)
+    data = synthetic.generate_market_data(args.tickers, args.years, end_date=today, seed=args.seed)
+    tickers = sorted(data['Ticker'].unique())
+    backfill = (datetime(1900, 1, 1), today - timedelta(days=7))
+    scenarios = {
+        'retry': [backfill, backfill],
+        'extend': [backfill, (backfill[0], today)]
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, ranges in scenarios.items():
+            for cache in ['none', 'tmp', 's3']:
+                upstream = SlowSource(data, args.latency)
+                s3 = LocalS3Client()
+                if cache == 'tmp':
+                    source = CachedSource(upstream, LocalStore(os.path.join(workdir, name)))
+                elif cache == 's3':
+                    source = CachedSource(upstream, S3Store(s3, 'cache-bucket', 'cache'))
+                else:
+                    source = upstream
+                runs = run(source, tickers, ranges, args.batch_size)
+                results.append({
+                    'scenario': name,
+                    'cache': cache,
+                    'runs': runs,
+                    'upstream_ticker_requests': upstream.requests,
+                    'served_from_cache': getattr(source, 'served', 0),
+                    's3_requests': s3.requests if cache == 's3' else None,
+                    'cache_mb': round(sum(len(stored['Body']) for stored in s3.objects.values()) / 2**20, 2) if cache == 's3' else None
+                })
+
+        replay_folder = os.path.join(workdir, 'replay')
+        ReplaySource.record(data, replay_folder)
+        results.append({'scenario': 'replay', 'cache': 'none', 'runs': run(ReplaySource(replay_folder), tickers, [backfill], args.batch_size), 'upstream_ticker_requests': 0})
+
+    print(json.dumps({'config': vars(args), 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+'''
+Local stand-ins for the AWS services used by the pipeline
+'''
+
+import io
+import os
+import time
+import types
+import pickle
+import hashlib
+import tempfile
+import itertools
+from datetime import datetime, timezone
+from urllib.parse import quote, unquote
+from collections.abc import MutableMapping
+
+
+class LocalS3Client:
+    '''
+    In-memory S3 client with the subset of the boto3 API used by the pipeline
+    latency - seconds added to every request, to approximate a round trip to S3
+    objects - the mapping of (bucket, key) to the stored objects, in memory by default
+    '''
+
+    def __init__(self, latency=0, objects=None):
+        self.latency = latency
+        self.objects = {} if objects is None else objects
+        self.uploads = {}
+        self.upload_ids = itertools.count(1)
+        self.requests = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def request(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def error(self, code, operation):
+        from botocore.exceptions import ClientError
+        return ClientError({'Error': {'Code': code}}, operation)
+
+    def store(self, bucket_name, key, body, metadata=None):
+        self.bytes_written += len(body)
+        self.objects[(bucket_name, key)] = {
+            'Body': body,
+            'ETag': f'"{hashlib.md5(body).hexdigest()}"',
+            'Metadata': metadata or {},
+            'LastModified': datetime.now(timezone.utc)
+        }
+        return {'ETag': self.objects[(bucket_name, key)]['ETag']}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self.request()
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        return self.store(Bucket, Key, Body.encode('utf-8') if isinstance(Body, str) else bytes(Body), Metadata)
+
+    def head_object(self, Bucket, Key):
+        self.request()
+        if (Bucket, Key) not in self.objects:
+            raise self.error('404', 'HeadObject')
+        stored = self.objects[(Bucket, Key)]
+        return {'ETag': stored['ETag'], 'ContentLength': len(stored['Body'])}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.request()
+        if (Bucket, Key) not in self.objects:
+            raise self.error('NoSuchKey', 'GetObject')
+        stored = self.objects[(Bucket, Key)]
+        if IfNoneMatch is not None and IfNoneMatch.strip('"') == stored['ETag'].strip('"'):
+            raise self.error('304', 'GetObject')
+        body = stored['Body']
+        self.bytes_read += len(body)
+        return {
+            'Body': io.BytesIO(body),
+            'ETag': stored['ETag'],
+            'ContentLength': len(body),
+            'Metadata': stored['Metadata']
+        }
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.request()
+        source = (CopySource['Bucket'], CopySource['Key']) if isinstance(CopySource, dict) else tuple(CopySource.split('/', 1))
+        if source not in self.objects:
+            raise self.error('NoSuchKey', 'CopyObject')
+        stored = self.objects[source]
+        return {'CopyObjectResult': self.store(Bucket, Key, stored['Body'], stored['Metadata'])}
+
+    def delete_object(self, Bucket, Key):
+        self.request()
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.request()
+        upload_id = str(next(self.upload_ids))
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.request()
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange):
+        self.request()
+        if (CopySource['Bucket'], CopySource['Key']) not in self.objects:
+            raise self.error('NoSuchKey', 'UploadPartCopy')
+        start, end = (int(value) for value in CopySourceRange[len('bytes='):].split('-'))
+        part = self.objects[(CopySource['Bucket'], CopySource['Key'])]['Body'][start:end + 1]
+        self.uploads[UploadId][PartNumber] = part
+        return {'CopyPartResult': {'ETag': f'"{hashlib.md5(part).hexdigest()}"'}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.request()
+        parts = self.uploads.pop(UploadId)
+        return self.store(Bucket, Key, b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts']))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.request()
+        self.uploads.pop(UploadId, None)
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        self.request()
+        contents = [
+            {'Key': key, 'Size': len(stored['Body']), 'ETag': stored['ETag'], 'LastModified': stored['LastModified']}
+            for (bucket_name, key), stored in sorted(self.objects.items())
+            if bucket_name == Bucket and key.startswith(Prefix)
+        ]
+        return {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False}
+
+    def get_paginator(self, operation):
+        # every listing fits in a single page
+        return types.SimpleNamespace(paginate=lambda **kwargs: [getattr(self, operation)(**kwargs)])
+
+    def delete_objects(self, Bucket, Delete):
+        if len(Delete['Objects']) > 1000:
+            raise self.error('MalformedXML', 'DeleteObjects')
+        self.request()
+        for obj in Delete['Objects']:
+            self.objects.pop((Bucket, obj['Key']), None)
+        return {'Deleted': Delete['Objects']}
+
+    def keys(self, bucket_name, prefix=''):
+        return [key for bucket, key in sorted(self.objects) if bucket == bucket_name and key.startswith(prefix)]
+
+
+class DirectoryObjects(MutableMapping):
+    '''
+    Stored objects of a LocalS3Client kept as files of a directory, one per object,
+    so clients of several processes share the same buckets
+    writes replace the file at once, a reader never sees a partial object
+    '''
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, bucket_key):
+        bucket_name, key = bucket_key
+        return os.path.join(self.root, bucket_name, quote(key, safe=''))
+
+    def __getitem__(self, bucket_key):
+        try:
+            with open(self.path(bucket_key), 'rb') as stored:
+                return pickle.load(stored)
+        except FileNotFoundError:
+            raise KeyError(bucket_key) from None
+
+    def __setitem__(self, bucket_key, stored):
+        path = self.path(bucket_key)
+        # objects are written next to the buckets, bucket names can not start with a dot
+        partial = os.path.join(self.root, '.partial')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.makedirs(partial, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=partial, delete=False) as temporary:
+            pickle.dump(stored, temporary)
+        os.replace(temporary.name, path)
+
+    def __delitem__(self, bucket_key):
+        try:
+            os.remove(self.path(bucket_key))
+        except FileNotFoundError:
+            raise KeyError(bucket_key) from None
+
+    def __iter__(self):
+        if not os.path.isdir(self.root):
+            return
+        for bucket_name in sorted(os.listdir(self.root)):
+            if not bucket_name.startswith('.'):
+                for name in sorted(os.listdir(os.path.join(self.root, bucket_name))):
+                    yield bucket_name, unquote(name)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class LocalGlueClient:
+    '''
+    In-memory Glue catalog with the table and partition calls used by the pipeline
+    '''
+
+    def __init__(self):
+        self.tables = {}
+        self.partitions = {}
+
+    def create_table(self, DatabaseName, TableInput):
+        self.tables[(DatabaseName, TableInput['Name'])] = dict(TableInput)
+        self.partitions[(DatabaseName, TableInput['Name'])] = {}
+
+    def get_table(self, DatabaseName, Name):
+        if (DatabaseName, Name) not in self.tables:
+            from botocore.exceptions import ClientError
+            raise ClientError({'Error': {'Code': 'EntityNotFoundException'}}, 'GetTable')
+        return {'Table': self.tables[(DatabaseName, Name)]}
+
+    def batch_get_partition(self, DatabaseName, TableName, PartitionsToGet):
+        partitions = self.partitions[(DatabaseName, TableName)]
+        return {'Partitions': [partitions[tuple(p['Values'])] for p in PartitionsToGet if tuple(p['Values']) in partitions]}
+
+    def batch_create_partition(self, DatabaseName, TableName, PartitionInputList):
+        partitions = self.partitions[(DatabaseName, TableName)]
+        errors = []
+        for partition in PartitionInputList:
+            values = tuple(partition['Values'])
+            if values in partitions:
+                errors.append({'PartitionValues': list(values), 'ErrorDetail': {'ErrorCode': 'AlreadyExistsException', 'ErrorMessage': 'exists'}})
+            else:
+                partitions[values] = dict(partition)
+        return {'Errors': errors}
+
+
+class LocalStepFunctionsClient:
+    '''
+    Records the executions started instead of running a state machine
+    '''
+
+    def __init__(self):
+        self.executions = []
+
+    def start_execution(self, stateMachineArn, input):
+        self.executions.append({'stateMachineArn': stateMachineArn, 'input': input})
+        return {'executionArn': f'{stateMachineArn}:execution-{len(self.executions)}'}
+
+
+
+def use_client(service, stand_in):
+    '''
+    Makes the handlers' shared clients.client(service) return the stand-in, until clients.clear()
+    '''
+    import boto3
+    import clients
+
+    clients.clear()
+    original = boto3.client
+    boto3.client = lambda *args, **kwargs: stand_in
+    try:
+        clients.client(service)
+    finally:
+        boto3.client = original
@@ -0,0 +1,111 @@
+'''
+Size, write and scan time of the raw data as csv versus year partitioned parquet.
+
+    python benchmarks/storage_format.py --tickers 100 --years 30
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+import pandas as pd
+import pyarrow.dataset as ds
+import raw_data
+import synthetic
+
+ANALYSIS_COLUMNS = ['ticker', 'date', 'adj_close', 'dividends']
+
+
+def measure(function, *args):
+    '''
+    Returns the result, wall time and peak traced memory of a call
+    '''
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, round(elapsed, 3), round(peak / 2**20, 1)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, round(time.perf_counter() - start, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=100)
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data = raw_data.conform(synthetic.generate_market_data(args.tickers, args.years, seed=args.seed))
+    five_year_start = data['Date'].max() - timedelta(days=365 * 5)
+
+    csv_content, csv_write, csv_memory = measure(raw_data.to_csv, data)
+    partitions, parquet_write, parquet_memory = measure(raw_data.to_parquet_partitions, data)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, 'batch.csv')
+        with open(csv_path, 'w') as csv_file:
+            csv_file.write(csv_content)
+
+        parquet_path = os.path.join(workdir, 'parquet')
+        for partition, content in partitions.items():
+            os.makedirs(os.path.join(parquet_path, partition))
+            with open(os.path.join(parquet_path, partition, 'batch.parquet'), 'wb') as parquet_file:
+                parquet_file.write(content)
+
+        dataset = ds.dataset(parquet_path, format='parquet', partitioning='hive')
+
+        def read_csv_five_years():
+            frame = pd.read_csv(csv_path, usecols=['Date', 'Ticker', 'Adj Close', 'Dividends'], parse_dates=['Date'])
+            return frame[frame['Date'] >= five_year_start]
+
+        _, csv_full_scan = timed(lambda: pd.read_csv(csv_path, parse_dates=['Date']))
+        _, csv_five_year_scan = timed(read_csv_five_years)
+        _, parquet_full_scan = timed(lambda: dataset.to_table().to_pandas())
+        five_year_rows, parquet_five_year_scan = timed(lambda: dataset.to_table(
+            columns=ANALYSIS_COLUMNS,
+            filter=(ds.field(raw_data.PARTITION_COLUMN) >= five_year_start.year) & (ds.field('date') >= five_year_start)
+        ).num_rows)
+
+    print(json.dumps({
+        'tickers': args.tickers,
+        'years': args.years,
+        'rows': len(data),
+        'five_year_rows': five_year_rows,
+        'csv': {
+            'files': 1,
+            'size_mb': round(len(csv_content.encode('utf-8')) / 2**20, 2),
+            'write_s': csv_write,
+            'write_peak_mb': csv_memory,
+            'full_scan_s': csv_full_scan,
+            'five_year_scan_s': csv_five_year_scan
+        },
+        'parquet': {
+            'files': len(partitions),
+            'size_mb': round(sum(len(content) for content in partitions.values()) / 2**20, 2),
+            'write_s': parquet_write,
+            'write_peak_mb': parquet_memory,
+            'full_scan_s': parquet_full_scan,
+            'five_year_scan_s': parquet_five_year_scan
+        }
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+'''
+Benchmark suite of the analysis and collection paths on synthetic data. Every case runs
+--repeat times and reports the median and minimum wall time. Results can be saved under
+benchmarks/results/ (named after the current commit and scale) and compared with a
+previous result, failing when a case got slower than the threshold.
+
+    python benchmarks/suite.py --tickers 500 --years 30 --save
+    python benchmarks/suite.py --tickers 500 --years 30 --compare benchmarks/results/<file>.json
+'''
+
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'benchmarks')]
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.update(BUCKET_NAME='suite-bucket', OBJECT_KEY='analysis/summary.json', TICKER_PREFIX='analysis/tickers')
+
+import pandas as pd
+import analysis_engine
+import raw_data
+import synthetic
+import valuation
+import instrumentation
+from stand_ins import LocalS3Client, use_client
+
+# the handlers' metric log lines are built as in production but not printed
+instrumentation.log = lambda line: None
+
+RESULTS_FOLDER = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+class NullSink:
+    '''
+    Binary sink that only counts the bytes written
+    '''
+
+    def __init__(self):
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+
+def ticker_diff_case(n_tickers, snapshots, seed):
+    '''
+    Diff of a new ticker file against the snapshot, with snapshots daily ticker files stored
+    '''
+    import boto3
+    import clients
+    import ticker_diff
+    from pipeline import patched
+
+    client = LocalS3Client()
+    event = {'bucket_name': 'suite-bucket', 'ticker_folder': 'ticker', 'transform_folder': 'transform'}
+    for day in range(snapshots):
+        tickers = synthetic.generate_tickers(n_tickers + snapshots, updated_at=datetime(2024, 1, 2) + timedelta(days=day), seed=seed)
+        event['key_name'] = f'ticker/raw/{day:05d}.csv'
+        client.put_object(Bucket=event['bucket_name'], Key=event['key_name'], Body=tickers.iloc[day:day + n_tickers].to_csv(index=False, sep='|'))
+
+    def run():
+        # the handler's cached client may belong to another case
+        clients.clear()
+        with patched(boto3, 'client', lambda service, *args, **kwargs: client):
+            ticker_diff.lambda_handler(event, None)
+
+    return run
+
+
+def api_case(summary, details, query=None, ticker=None, headers=None, resource=None):
+    import read_s3
+
+    client = LocalS3Client()
+    client.put_object(Bucket=os.environ['BUCKET_NAME'], Key=os.environ['OBJECT_KEY'], Body=analysis_engine.to_json(summary))
+    for symbol, detail in details.items():
+        client.put_object(Bucket=os.environ['BUCKET_NAME'], Key=f"{os.environ['TICKER_PREFIX']}/{symbol}.json", Body=analysis_engine.to_json(detail))
+    event = {'queryStringParameters': query, 'headers': headers, 'pathParameters': {'ticker': ticker} if ticker else None, 'resource': resource}
+
+    def run():
+        # every run starts cold and ends warm, the median is dominated by the warm requests
+        use_client('s3', client)
+        read_s3.cache.clear()
+        for _ in range(20):
+            read_s3.lambda_handler(event, None)
+
+    return run
+
+
+def build_cases(args):
+    today = datetime(2024, 1, 2)
+    data = synthetic.generate_market_data(args.tickers, args.years, end_date=today, seed=args.seed, staggered=True)
+    tickers = synthetic.generate_tickers(args.tickers, updated_at=today, seed=args.seed)
+
+    transformed = analysis_engine.transform_data(data)
+    company_data = transformed[~transformed['ticker'].isin(analysis_engine.BENCHMARK_TICKERS)].reset_index(drop=True)
+    annual = analysis_engine.annual_dividends(company_data)
+    five_year_start = today - timedelta(days=365 * 5)
+    five_year_data = company_data[company_data['date'] >= five_year_start].reset_index(drop=True)
+    market_data = transformed[(transformed['ticker'] == '^GSPC') & (transformed['date'] >= five_year_start)]
+    lookbacks = [analysis_engine.parse_lookback(lookback) for lookback in ['5y-daily', '3y-daily', '1y-daily', '5y-monthly']]
+
+    document = analysis_engine.run_analysis(data, tickers, today=today)
+    summary, details = analysis_engine.split_output(document)
+    frames = [frame for _, frame in data.groupby('Ticker', sort=False)]
+    first_company = summary[0]['companies'][0] if summary[0]['companies'] else {}
+    # 10 growth x 7 risk free x 5 market return scenarios
+    scenarios = {'growth': '0.00:0.09:0.01', 'risk_free': '0.02:0.05:0.005', 'market_return': '0.06:0.10:0.01'}
+    grids = {name: valuation.parse_grid(value) for name, value in scenarios.items()}
+
+    def write_parquet():
+        with raw_data.ParquetPartitionWriter(lambda partition: NullSink()) as writer:
+            for frame in frames:
+                writer.write(frame)
+
+    cases = {
+        'ticker_diff': ticker_diff_case(args.tickers, args.snapshots, args.seed),
+        'transform_data': lambda: analysis_engine.transform_data(data),
+        'annual_dividends': lambda: analysis_engine.annual_dividends(company_data),
+        'streak_cagr': lambda: analysis_engine.dividend_calculations(annual, today.year - 1),
+        'beta': lambda: analysis_engine.beta_result(five_year_data, market_data),
+        'beta_lookbacks': lambda: analysis_engine.beta_table(company_data, transformed, today, ['^GSPC', '^TNX'], lookbacks),
+        'histories': lambda: analysis_engine.historical_prices(company_data, today),
+        'full_analysis': lambda: analysis_engine.run_analysis(data, tickers, today=today),
+        'serialize_output': lambda: [analysis_engine.to_json(part) for part in [summary, *details.values()]],
+        'compress_summary': lambda: gzip.compress(analysis_engine.to_json(summary).encode('utf-8')),
+        'collect_csv': lambda: raw_data.write_csv(frames, NullSink()),
+        'collect_parquet': write_parquet,
+        'api_summary': api_case(summary, details, headers={'Accept-Encoding': 'gzip'}),
+        'api_filter': api_case(summary, details, query={'sector': first_company.get('sector', ''), 'max_beta': '1'}),
+        'api_ticker': api_case(summary, details, ticker=first_company.get('ticker', 'BA')),
+        'valuation_sweep': lambda: valuation.sweep(summary[0]['companies'], summary[0]['benchmarks'], grids['growth'], grids['risk_free'], grids['market_return']),
+        'api_valuation': api_case(summary, details, query=scenarios, resource='/data/valuation')
+    }
+    return {name: case for name, case in cases.items() if not args.cases or name in args.cases}, len(data)
+
+
+def run(cases, repeat):
+    results = {}
+    for name, case in cases.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            case()
+            times.append(time.perf_counter() - start)
+        results[name] = {'median_s': round(statistics.median(times), 5), 'min_s': round(min(times), 5)}
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline, threshold):
+    '''
+    Returns the ratio of every case to the baseline and the cases slower than the threshold
+    '''
+    ratios = {}
+    for name, result in results.items():
+        if name in baseline['cases'] and baseline['cases'][name]['median_s'] > 0:
+            ratios[name] = round(result['median_s'] / baseline['cases'][name]['median_s'], 3)
+    regressions = sorted(name for name, ratio in ratios.items() if ratio > threshold)
+    return ratios, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=500, help='50 to 5000 companies')
+    parser.add_argument('--years', type=int, default=30, help='1 to 60 years of history')
+    parser.add_argument('--snapshots', type=int, default=250, help='daily ticker files stored for the ticker diff')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cases', nargs='+', help='only run these cases')
+    parser.add_argument('--save', action='store_true', help='save the result under benchmarks/results')
+    parser.add_argument('--compare', help='result file to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    cases, rows = build_cases(args)
+    report = {
+        'commit': current_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'config': {'tickers': args.tickers, 'years': args.years, 'snapshots': args.snapshots, 'repeat': args.repeat, 'seed': args.seed},
+        'rows': rows,
+        'cases': run(cases, args.repeat)
+    }
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['config'] != report['config']:
+            print(f"warning: baseline config {baseline['config']} differs from {report['config']}", file=sys.stderr)
+        ratios, regressions = compare(report['cases'], baseline, args.threshold)
+        report['comparison'] = {'baseline': baseline['commit'], 'ratios': ratios, 'regressions': regressions}
+
+    if args.save:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        path = os.path.join(RESULTS_FOLDER, f"{report['commit']}-{args.tickers}x{args.years}.json")
+        with open(path, 'w') as result_file:
+            json.dump(report, result_file, indent=2)
+        report['saved'] = os.path.relpath(path, ROOT)
+
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
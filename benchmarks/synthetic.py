@@ -0,0 +1,155 @@
+'''
+Deterministic synthetic market data shaped like the collector output and the ticker files
+'''
+
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+SECTORS = [
+    'Communication Services', 'Consumer Discretionary', 'Consumer Staples', 'Energy', 'Financials',
+    'Health Care', 'Industrials', 'Information Technology', 'Materials', 'Real Estate', 'Utilities'
+]
+
+
+def ticker_symbols(n_tickers):
+    symbols = []
+    for i in range(n_tickers):
+        symbol = ''
+        i += 26
+        while i:
+            i, remainder = divmod(i, 26)
+            symbol = chr(ord('A') + remainder) + symbol
+        symbols.append(symbol)
+    return symbols
+
+
+def generate_tickers(n_tickers, updated_at=None, seed=0):
+    '''
+    Ticker snapshot shaped like the ticker collector csv (the S&P 500 table of Wikipedia),
+    including the benchmark rows
+    '''
+    rng = np.random.default_rng(seed)
+    symbols = ticker_symbols(n_tickers)
+    companies = pd.DataFrame({
+        'Symbol': symbols,
+        'Security': [f'{symbol} Inc.' for symbol in symbols],
+        'GICS Sector': rng.choice(SECTORS, n_tickers),
+        'GICS Sub-Industry': [f'Sub-Industry {i}' for i in rng.integers(0, 60, n_tickers)],
+        'Headquarters Location': [f'City {i}, State {i % 50}' for i in rng.integers(0, 400, n_tickers)],
+        'Date added': (pd.Timestamp('1957-03-04') + pd.to_timedelta(rng.integers(0, 24000, n_tickers), unit='D')).strftime('%Y-%m-%d'),
+        'CIK': rng.integers(1000, 2000000, n_tickers),
+        'Founded': rng.integers(1800, 2015, n_tickers).astype(str)
+    })
+    benchmarks = pd.DataFrame({
+        'Symbol': ['^TNX', '^GSPC'],
+        'Security': ['10 Year Treasury Note', 'S&P 500']
+    })
+    tickers = pd.concat([companies, benchmarks], ignore_index=True)
+    tickers['updatedAt'] = updated_at or datetime(2024, 1, 2)
+    return tickers
+
+
+def bars(symbols, dates, prices, dividends, volume, splits, first_days):
+    '''
+    Long frame of one row per symbol and day, starting at the first listed day of each symbol
+    '''
+    n_days = len(dates)
+    listed = (np.arange(n_days)[None, :] >= first_days[:, None]).ravel()
+    close = prices.ravel()
+    noise = 1 + (volume.ravel() % 2000 - 1000) / 1e5
+    return pd.DataFrame({
+        'Date': np.tile(dates.to_numpy(), len(symbols)),
+        'Ticker': np.repeat(symbols, n_days),
+        'Open': close * noise,
+        'High': close * np.maximum(noise, 1) * 1.01,
+        'Low': close * np.minimum(noise, 1) * 0.99,
+        'Close': close,
+        'Adj Close': close,
+        'Volume': volume.ravel(),
+        'Dividends': dividends.ravel(),
+        'Stock Splits': splits.ravel()
+    })[listed].reset_index(drop=True)
+
+
+def iter_market_data(n_tickers, years, end_date=None, seed=0, chunk_tickers=500, staggered=False):
+    '''
+    Daily bars shaped like the yfinance source output, yielded chunk_tickers companies at a time
+    followed by ^GSPC and ^TNX, so datasets larger than memory can be streamed
+    companies follow a one factor model on the S&P 500 so beta is meaningful, most of them pay
+    quarterly dividends that grow every year and a few split their stock once
+    staggered - list a third of the companies at a random day instead of the first day
+    '''
+    rng = np.random.default_rng(seed)
+    end_date = pd.Timestamp(end_date or datetime(2024, 1, 2)).normalize()
+    dates = pd.bdate_range(end=end_date, periods=max(int(years * 252), 1))
+    n_days = len(dates)
+    market_returns = rng.normal(0.0003, 0.01, n_days)
+
+    quarters = dates.to_period('Q').asi8
+    quarter_starts = np.flatnonzero(np.r_[True, quarters[1:] != quarters[:-1]])
+    years_elapsed = (dates.year - dates.year[0]).to_numpy()
+    symbols = ticker_symbols(n_tickers)
+
+    for start in range(0, n_tickers, chunk_tickers):
+        chunk_rng = np.random.default_rng([seed, start])
+        n = min(chunk_tickers, n_tickers - start)
+
+        betas = chunk_rng.uniform(0.3, 1.8, n)
+        company_returns = betas[:, None] * market_returns[None, :] + chunk_rng.normal(0, 0.015, (n, n_days))
+        prices = chunk_rng.uniform(10, 300, n)[:, None] * np.exp(np.cumsum(company_returns, axis=1))
+
+        dividends = np.zeros((n, n_days))
+        payers = chunk_rng.random(n) < 0.8
+        growth = chunk_rng.uniform(-0.02, 0.1, n)
+        first_dividend = chunk_rng.uniform(0.05, 1.0, n)
+        offsets = chunk_rng.integers(0, 40, n)
+        for i in np.flatnonzero(payers):
+            paid_days = quarter_starts + offsets[i]
+            paid_days = paid_days[paid_days < n_days]
+            dividends[i, paid_days] = np.round(first_dividend[i] * (1 + growth[i]) ** years_elapsed[paid_days], 4)
+
+        splits = np.zeros((n, n_days))
+        splitters = np.flatnonzero(chunk_rng.random(n) < 0.1)
+        splits[splitters, chunk_rng.integers(0, n_days, len(splitters))] = 2.0
+
+        first_days = np.zeros(n, dtype=int)
+        if staggered:
+            late = chunk_rng.random(n) < 1 / 3
+            first_days[late] = chunk_rng.integers(0, n_days, late.sum())
+
+        volume = chunk_rng.integers(1e5, 1e7, (n, n_days)).astype('float64')
+        yield bars(symbols[start:start + n], dates, prices, dividends, volume, splits, first_days)
+
+    benchmark_prices = np.vstack([
+        1000 * np.exp(np.cumsum(market_returns)),
+        np.clip(4 + np.cumsum(rng.normal(0, 0.03, n_days)), 0.5, 15)
+    ])
+    yield bars(
+        ['^GSPC', '^TNX'], dates, benchmark_prices, np.zeros((2, n_days)),
+        rng.integers(1e5, 1e7, (2, n_days)).astype('float64'), np.zeros((2, n_days)), np.zeros(2, dtype=int)
+    )
+
+
+def generate_market_data(n_tickers, years, end_date=None, seed=0, staggered=False):
+    '''
+    All the bars of iter_market_data in a single frame
+    '''
+    return pd.concat(list(iter_market_data(n_tickers, years, end_date, seed, staggered=staggered)), ignore_index=True)
+
+
+def thin_history(raw_data, ticker, start):
+    '''
+    Leaves the ticker a single trading session from start on, its last one, and moves its other
+    dividend days to the Saturday of their week, so its dividends are kept but its returns share
+    a single period with the benchmarks
+    '''
+    window = (raw_data['Ticker'] == ticker) & (raw_data['Date'] >= start)
+    last = window & (raw_data['Date'] == raw_data.loc[window, 'Date'].max())
+    paid = window & ~last & (raw_data['Dividends'] > 0)
+    thinned = raw_data[~window | last | paid].copy()
+    dates = thinned.loc[paid[paid].index, 'Date']
+    saturdays = dates + pd.to_timedelta(5 - dates.dt.weekday, unit='D')
+    # the Saturday before when the one after is in the next year, so the dividend stays in its year
+    thinned.loc[dates.index, 'Date'] = saturdays.where(saturdays.dt.year == dates.dt.year, saturdays - pd.Timedelta(days=7))
+    return thinned.reset_index(drop=True)
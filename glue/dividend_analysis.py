@@ -1,181 +1,447 @@
+import re
 import sys
+import json
 import boto3
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
 from pyspark.sql import functions as F
 from pyspark.sql.window import Window
+from pyspark.sql.types import StructType, StructField, ArrayType, MapType, StringType, LongType, IntegerType, DoubleType, TimestampType
 from datetime import datetime, timedelta
+# shipped with --extra-py-files, the same modules the Lambdas use
+from instrumentation import Metrics
+from analysis_versions import publish
+from analysis_rollups import rollups
 
 # set up Spark and GlueContext
-args = getResolvedOptions(sys.argv, ['JOB_NAME'])
+args = getResolvedOptions(sys.argv, ['JOB_NAME', 'analysis_mode', 'beta_benchmarks', 'beta_lookbacks'])
 
 sc = SparkContext()
 glueContext = GlueContext(sc)
 spark = glueContext.spark_session
 job = Job(glueContext)
 job.init(args['JOB_NAME'], args)
+metrics = Metrics('dividend_analysis')
 
 s3_client = boto3.client('s3')
 
+bucket_name = "${pS3BucketName}"
+analysis_folder = '${pAnalysisFolder}'
+metadata_prefix = '${pAnalysisFolder}/metadata'
+metadata_pointer_key = f'{metadata_prefix}/latest.json'
+summary_key = '${pAnalysisFolder}/summary.json'
+manifest_key = '${pAnalysisFolder}/manifest.json'
+rollups_key = '${pAnalysisFolder}/rollups.json'
+metrics_key = '${pAnalysisFolder}/metrics.json'
+ticker_prefix = '${pAnalysisFolder}/tickers'
+summary_columns = [
+    'ticker', 'name', 'sector', 'industry', 'consecutiveGrowthYears', 'dividendFrequency',
+    'beta', 'fiveYearCAGR', 'lastDividend', 'lastPrice', 'requiredReturn', 'fairValue'
+]
+five_year_start = datetime.today() - timedelta(days=(365*5))
+# the S&P 500 CAGR and the risk free rate of the summary
+market_tickers = ['^GSPC', '^TNX']
+
+
+def parse_lookback(lookback):
+    '''
+    Parses a beta lookback like 3y-monthly into its name, years and return frequency
+    the metadata keeps five years of daily rows, so lookbacks go up to 5y
+    '''
+    years, _, frequency = lookback.strip().partition('-')
+    if not (years[:-1].isdigit() and years.endswith('y') and 1 <= int(years[:-1]) <= 5 and frequency in ('daily', 'monthly')):
+        raise ValueError(f'Invalid beta lookback {lookback}, expected 1y to 5y and daily or monthly, e.g. 3y-monthly')
+    return lookback.strip(), int(years[:-1]), frequency
+
+
+# beta is computed against every benchmark for every lookback
+# the first benchmark and lookback give the beta column, all of them the betas of the detail documents
+beta_benchmarks = [benchmark.strip() for benchmark in args['beta_benchmarks'].split(',') if benchmark.strip()]
+beta_lookbacks = [parse_lookback(lookback) for lookback in args['beta_lookbacks'].split(',') if lookback.strip()]
+benchmark_tickers = sorted(set(market_tickers + beta_benchmarks))
+# lookback starts in epoch seconds, the unit of the date keys
+lookback_starts = {
+    years: int((datetime.today() - timedelta(days=365 * years) - datetime(1970, 1, 1)).total_seconds())
+    for _, years, _ in beta_lookbacks
+}
+
+
+def count_exchanges(name, df):
+    '''
+    Counts the shuffles (Exchange nodes) and broadcasts in the physical plan of a frame,
+    they are emitted with the other metrics of the job
+    '''
+    plan = df._jdf.queryExecution().executedPlan().toString()
+    metrics.count(f'{name}Shuffles', len(re.findall(r'\bExchange\b', plan)))
+    metrics.count(f'{name}Broadcasts', plan.count('BroadcastExchange'))
+
+
+def read_metadata_pointer():
+    '''
+    Returns the pointer to the latest per-ticker metadata snapshot, or None if there is none
+    '''
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=metadata_pointer_key)
+        return json.loads(response['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise
+
+
+def read_state(version, name):
+    return (
+        spark.read.parquet(f"s3://{bucket_name}/{metadata_prefix}/{version}/{name}")
+        .withColumnRenamed('adj_close', 'adj close')
+    )
+
+
+def write_state(df, version, name):
+    # parquet does not allow spaces in column names
+    (
+        df
+        .withColumnRenamed('adj close', 'adj_close')
+        .write
+        .mode('overwrite')
+        .parquet(f"s3://{bucket_name}/{metadata_prefix}/{version}/{name}")
+    )
+
+
+def delete_state(version):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{metadata_prefix}/{version}/"):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3_client.delete_objects(Bucket=bucket_name, Delete={'Objects': keys})
+
+
+def delete_stale_shards(tickers):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{ticker_prefix}/"):
+        keys = [
+            {'Key': obj['Key']} for obj in page.get('Contents', [])
+            if obj['Key'][len(ticker_prefix) + 1:-len('.json')] not in tickers
+        ]
+        if keys:
+            s3_client.delete_objects(Bucket=bucket_name, Delete={'Objects': keys})
+
+
 # load raw data
-raw_data = glueContext.create_dynamic_frame.from_catalog(database="${GlueDB}", table_name="data-${pRawFolder}").toDF()
+# the bookmarked read only returns files added since the last committed run
+delta_frame = glueContext.create_dynamic_frame.from_catalog(database="${GlueDB}", table_name="data-${pRawFolder}", transformation_ctx="raw_data")
 raw_tickers = glueContext.create_dynamic_frame.from_catalog(database="${GlueDB}", table_name="ticker-${pRawFolder}").toDF()
 
+pointer = read_metadata_pointer()
+metadata = pointer if args['analysis_mode'] == 'incremental' else None
+
+delta_data = delta_frame.toDF()
+if metadata is None:
+    # no snapshot to fold into, rebuild the metadata from the whole table
+    # the bookmarked rows are read as well, so the bookmark moves past every file of a full run and the
+    # next incremental run does not fold them in again, their duplicates are dropped with the others below
+    raw_data = glueContext.create_dynamic_frame.from_catalog(database="${GlueDB}", table_name="data-${pRawFolder}").toDF()
+    if 'ticker' in delta_data.columns:
+        raw_data = raw_data.unionByName(delta_data, allowMissingColumns=True)
+else:
+    raw_data = delta_data
+
 # transform ticker columns
+# only the symbols of the latest ticker file are analyzed, a company removed from the universes
+# keeps its rows of older files but leaves the summary and its detail file is deleted
+latest_update = raw_tickers.agg(F.max('updatedAt')).first()[0]
 transformed_tickers = (
     raw_tickers
+    .filter(F.col('updatedAt') == latest_update)
     .withColumn("row_num", F.row_number().over(Window.partitionBy("symbol").orderBy(F.col("updatedAt").desc())))
     .filter(F.col("row_num") == 1)
     .select(
-        F.col('symbol').alias('ticker'), 
-        F.col('security').alias('name'), 
-        F.col('gics sector').alias('sector'), 
+        F.col('symbol').alias('ticker'),
+        F.col('security').alias('name'),
+        F.col('gics sector').alias('sector'),
         F.col('gics sub-industry').alias('industry')
     )
 )
 
 # transform data columns
-transformed_data = (
-    raw_data
+# an empty bookmarked read has no columns, so only the new rows with a schema are folded in
+# csv files name the adjusted close 'adj close', parquet files 'adj_close'
+if 'ticker' in raw_data.columns:
+    adj_close = 'adj close' if 'adj close' in raw_data.columns else 'adj_close'
+    new_data = (
+        raw_data
+        .dropDuplicates(['ticker', 'date'])
+        .select(
+            F.col('ticker'),
+            F.col('date').cast('timestamp').alias('date'),
+            F.col(adj_close).cast('double').alias('adj close'),
+            F.col('dividends').cast('double').alias('dividends')
+        )
+    )
+else:
+    new_data = spark.createDataFrame([], 'ticker string, date timestamp, `adj close` double, dividends double')
+
+# fold the new rows into the per-ticker metadata
+# daily - every row of the last five years, used for beta, histories and the S&P 500 CAGR
+# dividends - every dividend payment ever, used for annual dividends and the last dividend
+# ticker_years - every year a ticker has data, so years without dividends still break a streak
+# latest - the most recent row of each ticker, used for the last price and risk free rate
+new_daily = new_data.filter(F.col('date') >= five_year_start)
+new_dividends = new_data.filter(F.col('dividends') > 0).select('ticker', 'date', 'dividends')
+new_ticker_years = new_data.select('ticker', F.year('date').alias('year')).distinct()
+new_latest = new_data.select('ticker', 'date', 'adj close')
+
+if metadata is not None:
+    new_daily = new_daily.unionByName(read_state(metadata['version'], 'daily'))
+    new_dividends = new_dividends.unionByName(read_state(metadata['version'], 'dividends'))
+    new_ticker_years = new_ticker_years.unionByName(read_state(metadata['version'], 'ticker_years'))
+    new_latest = new_latest.unionByName(read_state(metadata['version'], 'latest'))
+
+daily_data = (
+    new_daily
     .dropDuplicates(['ticker', 'date'])
-    .withColumn('date', F.col('date').cast('timestamp'))
+    .filter(F.col('date') >= five_year_start)
     .withColumn('year', F.year('date'))
     .withColumn('month', F.month('date'))
+    .cache()
+)
+dividend_events = new_dividends.dropDuplicates(['ticker', 'date']).cache()
+ticker_years = new_ticker_years.distinct().cache()
+latest_rows = (
+    new_latest
+    .withColumn('row_num', F.row_number().over(Window.partitionBy('ticker').orderBy(F.col('date').desc())))
+    .filter(F.col('row_num') == 1)
+    .drop('row_num')
+    .cache()
 )
 
-# Remove S&P and Treasury data
-company_data = transformed_data.filter(~F.col('ticker').isin(['^GSPC', '^TNX']))
+def period_returns(keys, prices, frequency):
+    '''
+    Log returns of a price series sorted by its date keys (epoch seconds)
+    monthly returns are taken between the last prices of every month and keyed by month
+    '''
+    if frequency == 'monthly':
+        keys = keys.astype('datetime64[s]').astype('datetime64[M]').astype('int64')
+        month_ends = np.ones(len(keys), dtype=bool)
+        month_ends[:-1] = keys[1:] != keys[:-1]
+        keys, prices = keys[month_ends], prices[month_ends]
+    returns = np.full(len(prices), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = np.log(prices[1:] / prices[:-1])
+    return keys, returns
 
-# annual dividends
-annual_dividends = (
-    company_data
-    .groupBy('ticker', 'year')
-    .agg(
-        F.sum('dividends').alias('annual_dividend'),
-        F.count(F.when(F.col('dividends') > 0, F.col('dividends'))).alias('dividendFrequency')
+
+def aligned_beta(keys, returns, market_keys, market_returns):
+    '''
+    Population covariance of the returns and the benchmark returns of the same periods,
+    over the variance of the benchmark returns
+    returns whether any period matched and the beta, which is None when it is undefined,
+    i.e. with fewer than two pairs of returns, whose covariance is 0 by construction
+    '''
+    if not len(market_keys):
+        return False, None
+    found = np.minimum(np.searchsorted(market_keys, keys), len(market_keys) - 1)
+    matched = market_keys[found] == keys
+    if not matched.any():
+        return False, None
+    returns = returns[matched]
+    market_returns = market_returns[found[matched]]
+    pairs = ~np.isnan(returns) & ~np.isnan(market_returns)
+    traded = market_returns[~np.isnan(market_returns)]
+    if pairs.sum() < 2 or traded.var() == 0:
+        return True, None
+    covar = np.mean((returns[pairs] - returns[pairs].mean()) * (market_returns[pairs] - market_returns[pairs].mean()))
+    return True, float(covar / traded.var())
+
+
+# the benchmark series are extracted once and every return series the betas need is
+# broadcast, so beta is a map-side lookup per ticker instead of a join on date
+with metrics.step('benchmarks'):
+    benchmark_rows = (
+        daily_data
+        .filter(F.col('ticker').isin(benchmark_tickers))
+        .select('ticker', F.col('date').cast('long').alias('date_key'), 'adj close')
+        .orderBy('ticker', 'date_key')
+        .collect()
     )
-)
+benchmark_data = pd.DataFrame([tuple(row) for row in benchmark_rows], columns=['ticker', 'date_key', 'adj close'])
 
-# consecutive dividend growth years and 5 year CAGR
-annual_window = Window.partitionBy('ticker').orderBy('year')
-five_year_window = Window.partitionBy('ticker').orderBy('year').rowsBetween(-4, 0)
-dividend_calculations = (
-    annual_dividends
-    .withColumn('dividend_increase', F.col('annual_dividend') - F.lag('annual_dividend').over(annual_window))
-    .withColumn('flag', F.when(F.col('dividend_increase') > 0, 1).otherwise(0))
-    .withColumn('grp', F.row_number().over(annual_window) - F.row_number().over(Window.partitionBy('ticker', 'flag').orderBy('flag')))
-    .withColumn('consecutiveGrowthYears', F.when(F.col('flag') == 0, 0).otherwise(F.row_number().over(Window.partitionBy('ticker', 'flag', 'grp').orderBy('year'))))
-    .where(F.col('consecutiveGrowthYears') >= 5)
-    .withColumn('fiveYearCAGR',F.pow(F.last('annual_dividend').over(five_year_window) / F.first('annual_dividend').over(five_year_window), 1/5) - 1)
-    .where(F.col('year') == (datetime.today().year - 1))
-    .select(['ticker', 'dividendFrequency', 'consecutiveGrowthYears', 'fiveYearCAGR'])
-)
+benchmark_returns = {}
+for benchmark in beta_benchmarks:
+    series = benchmark_data[benchmark_data['ticker'] == benchmark]
+    for name, years, frequency in beta_lookbacks:
+        window = series[series['date_key'] >= lookback_starts[years]]
+        benchmark_returns[(benchmark, name)] = period_returns(
+            window['date_key'].to_numpy(dtype='int64'), window['adj close'].to_numpy(dtype='float64'), frequency
+        )
+benchmark_returns = sc.broadcast(benchmark_returns)
 
-# 5 year monthly beta calculation
-group_window = Window.partitionBy('ticker', 'year', 'month').orderBy(F.desc('date'))
-five_year_data = (
-    company_data
-    .filter(F.col('date') >= (datetime.today() - timedelta(days=(365*5))))
-    .withColumn('returns', F.log(F.col('adj close') / F.lag('adj close').over(Window.partitionBy('ticker').orderBy('date')).cast('double')))
-)
+report_year = datetime.today().year - 1
+year_ago = datetime.today() - timedelta(days=365)
+month_ago = datetime.today() - timedelta(days=30)
 
-market_data = (
-    transformed_data
-    .where(F.col('ticker') == '^GSPC')
-    .filter(F.col('date') >= (datetime.today() - timedelta(days=(365*5))))
-    .withColumn('sp500_returns', F.log(F.col('adj close') / F.lag('adj close').over(Window.orderBy('date')).cast('double')))
-    .select('date', 'sp500_returns')
-)
+price_history_type = ArrayType(StructType([StructField('date', TimestampType()), StructField('adj close', DoubleType())]))
+dividend_history_type = ArrayType(StructType([StructField('date', TimestampType()), StructField('dividends', DoubleType())]))
+betas_type = MapType(StringType(), MapType(StringType(), DoubleType()))
+metrics_schema = StructType([
+    StructField('ticker', StringType()),
+    StructField('dividendFrequency', LongType()),
+    StructField('consecutiveGrowthYears', IntegerType()),
+    StructField('fiveYearCAGR', DoubleType()),
+    StructField('beta', DoubleType()),
+    StructField('betas', StringType()),
+    StructField('lastDividend', DoubleType()),
+    StructField('lastPrice', DoubleType()),
+    # pandas udfs cannot return maps or arrays of structs, the betas and histories come back as json
+    StructField('priceHistory', StringType()),
+    StructField('dividendHistory', StringType())
+])
 
-beta_result = (
-    five_year_data
-    .join(market_data, 'date')
-    .groupBy('ticker')
-    .agg(
-        F.covar_pop('returns', 'sp500_returns').alias('covar'),
-        F.var_pop('sp500_returns').alias('variance_sp500')
-    )
-    .withColumn('beta', F.col('covar') / F.col('variance_sp500'))
-    .select('ticker', 'beta')
-)
 
-# latest price and dividend
-latest_data = (
-    company_data
-    .orderBy('date') 
-    .groupBy('ticker')
-    .agg(
-        F.last('adj close').alias('lastPrice'),
-        F.last(F.when(F.col('dividends') > 0, F.col('dividends')), ignorenulls=True).alias('lastDividend')
-    )
-)
+def history_json(rows, column):
+    rows = rows.sort_values(['date', column])
+    return json.dumps([
+        {'date': date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z', column: value}
+        for date, value in zip(rows['date'], rows[column].tolist())
+    ])
 
-# historical data
-historical_prices = (
-    company_data
-    .filter(F.col('date') >= (datetime.today() - timedelta(days=365)))
-    .groupBy('ticker')
-    .agg(
-        F.collect_list(F.when(F.col('date') >= (datetime.today() - timedelta(days=30)), F.struct('date', 'adj close'))).alias('priceHistory'),
-        F.collect_list(F.when((F.col('dividends') > 0) & (F.col('date') >= (datetime.today() - timedelta(days=365))), F.struct('date', 'dividends'))).alias('dividendHistory')
-    )
-    .withColumn('priceHistory', F.expr('sort_array(priceHistory, true)'))
-    .withColumn('dividendHistory', F.expr('sort_array(dividendHistory, true)'))
-)
 
-# join all results
-result = (
-    dividend_calculations
-    .join(beta_result, 'ticker')
-    .join(latest_data, 'ticker')
-    .join(transformed_tickers, 'ticker')
-    .join(historical_prices, 'ticker')
-    .groupBy()
-    .agg(
-        F.collect_list(
-            F.struct(
-                F.col('ticker'),
-                F.col('name'),
-                F.col('sector'),
-                F.col('industry'),
-                F.col('consecutiveGrowthYears'),
-                F.col('dividendFrequency'),
-                F.col('beta'),
-                F.col('fiveYearCAGR'),
-                F.col('lastDividend'),
-                F.col('lastPrice'),
-                F.col('priceHistory'),
-                F.col('dividendHistory')
-            )
-        ).alias('companies')
-    )
-)
+def ticker_metrics(rows):
+    '''
+    Every metric of one company in a single pass over its rows, which are tagged by kind
+    daily - prices of the last five years, dividend - dividend payments, year - years with data,
+    latest - the most recent row
+    returns no row when a metric the output needs is missing, as the joins of the metrics did
+    '''
+    empty = pd.DataFrame(columns=metrics_schema.fieldNames())
+    ticker = rows['ticker'].iloc[0]
+    dividends = rows[rows['kind'] == 'dividend'].sort_values('date')
 
-# latest market data
-sp500_cagr = (
-    transformed_data
-    .filter((F.col('ticker') == '^GSPC') & (F.col('date') >= (datetime.today() - timedelta(days=365 * 5))))
-    .orderBy('date')
-    .groupBy('ticker')
-    .agg(
-        (F.pow(F.last('adj close') / F.first('adj close'), 1 / 5) - 1).alias('rate')
+    # consecutive dividend growth years and 5 year CAGR
+    # years without dividends count as zero, so they break a streak
+    years = np.sort(rows.loc[rows['kind'] == 'year', 'year'].astype('int64').unique())
+    annual = dividends.groupby(dividends['date'].dt.year)['dividends'].agg(['sum', 'count']).reindex(years, fill_value=0)
+    amounts = annual['sum'].to_numpy(dtype='float64')
+    flag = np.zeros(len(amounts), dtype=bool)
+    flag[1:] = amounts[1:] > amounts[:-1]
+    index = np.arange(len(flag))
+    streak = np.where(flag, index - np.maximum.accumulate(np.where(flag, -1, index)), 0)
+
+    # the CAGR window covers the last five years with at least five growth years
+    qualified = np.flatnonzero(streak >= 5)
+    position = np.flatnonzero(years[qualified] == report_year)
+    if not len(position):
+        return empty
+    row = qualified[position[0]]
+    first = qualified[max(position[0] - 4, 0)]
+
+    # betas against every benchmark and lookback, from the broadcast benchmark returns
+    # companies without a period in common with the first benchmark and lookback are left out
+    daily = rows[rows['kind'] == 'daily'].sort_values('date')
+    keys = daily['date_key'].to_numpy(dtype='int64')
+    prices = daily['adj_close'].to_numpy(dtype='float64')
+    market = benchmark_returns.value
+    betas = {}
+    for name, lookback_years, frequency in beta_lookbacks:
+        window = keys >= lookback_starts[lookback_years]
+        period_keys, returns = period_returns(keys[window], prices[window], frequency)
+        for benchmark in beta_benchmarks:
+            matched, beta = aligned_beta(period_keys, returns, *market[(benchmark, name)])
+            if not betas and not matched:
+                return empty
+            betas.setdefault(benchmark, {})[name] = beta
+
+    # latest price and dividend
+    latest = rows[rows['kind'] == 'latest']
+    if latest.empty:
+        return empty
+
+    # historical data
+    recent = daily[daily['date'] >= year_ago]
+    if recent.empty:
+        return empty
+
+    return pd.DataFrame([{
+        'ticker': ticker,
+        'dividendFrequency': int(annual['count'].iloc[row]),
+        'consecutiveGrowthYears': int(streak[row]),
+        'fiveYearCAGR': float((amounts[row] / amounts[first]) ** (1 / 5) - 1),
+        'beta': betas[beta_benchmarks[0]][beta_lookbacks[0][0]],
+        'betas': json.dumps({
+            benchmark: {name: beta for name, beta in lookbacks.items() if beta is not None}
+            for benchmark, lookbacks in betas.items()
+        }),
+        'lastDividend': float(dividends['dividends'].iloc[-1]) if len(dividends) else None,
+        'lastPrice': float(latest['adj_close'].iloc[0]),
+        'priceHistory': history_json(recent[recent['date'] >= month_ago].rename(columns={'adj_close': 'adj close'}), 'adj close'),
+        'dividendHistory': history_json(recent[recent['dividends'] > 0], 'dividends')
+    }])
+
+
+# every row a company's metrics need, tagged by kind, so the rows are shuffled by ticker once
+benchmark = F.col('ticker').isin(benchmark_tickers)
+company_rows = (
+    daily_data
+    .filter(~benchmark)
+    .select('ticker', F.lit('daily').alias('kind'), 'date', F.col('adj close').alias('adj_close'), 'dividends', F.lit(None).cast('int').alias('year'))
+    .unionByName(
+        dividend_events
+        .filter(~benchmark)
+        .select('ticker', F.lit('dividend').alias('kind'), 'date', F.lit(None).cast('double').alias('adj_close'), 'dividends', F.lit(None).cast('int').alias('year'))
+    )
+    .unionByName(
+        ticker_years
+        .filter(~benchmark)
+        .select('ticker', F.lit('year').alias('kind'), F.lit(None).cast('timestamp').alias('date'), F.lit(None).cast('double').alias('adj_close'), F.lit(None).cast('double').alias('dividends'), F.col('year').cast('int'))
     )
+    .unionByName(
+        latest_rows
+        .filter(~benchmark)
+        .select('ticker', F.lit('latest').alias('kind'), 'date', F.col('adj close').alias('adj_close'), F.lit(None).cast('double').alias('dividends'), F.lit(None).cast('int').alias('year'))
+    )
+    .withColumn('date_key', F.col('date').cast('long'))
 )
 
-latest_risk_free = (
-    transformed_data
-    .filter(F.col('ticker') == '^TNX')
+# join all results, the ticker table is small enough to broadcast
+companies = (
+    company_rows
     .groupBy('ticker')
-    .agg(
-        (F.last(F.col('adj close')) / 100).alias('rate')
-    )
+    .applyInPandas(ticker_metrics, schema=metrics_schema)
+    .join(F.broadcast(transformed_tickers), 'ticker')
+    .withColumn('betas', F.from_json('betas', betas_type))
+    .withColumn('priceHistory', F.from_json('priceHistory', price_history_type))
+    .withColumn('dividendHistory', F.from_json('dividendHistory', dividend_history_type))
+    .cache()
 )
+count_exchanges('companies', companies)
+
+# latest market data, from the benchmark series already on the driver
+market_rates = []
+sp500_prices = benchmark_data.loc[benchmark_data['ticker'] == '^GSPC', 'adj close'].to_numpy(dtype='float64')
+if len(sp500_prices):
+    market_rates.append(('^GSPC', float((sp500_prices[-1] / sp500_prices[0]) ** (1 / 5) - 1)))
+treasury_yields = benchmark_data.loc[benchmark_data['ticker'] == '^TNX', 'adj close'].to_numpy(dtype='float64')
+if len(treasury_yields):
+    market_rates.append(('^TNX', float(treasury_yields[-1] / 100)))
+
+# CAPM required return and Gordon Growth Model fair value of every company, under the default
+# assumptions of the summary (^TNX risk free rate, ^GSPC market return, the company's CAGR)
+rates = dict(market_rates)
+if '^TNX' in rates and '^GSPC' in rates:
+    required_return = F.lit(rates['^TNX']) + F.col('beta') * F.lit(rates['^GSPC'] - rates['^TNX'])
+    annual_dividend = F.col('lastDividend') * F.col('dividendFrequency')
+    spread = required_return - F.col('fiveYearCAGR')
+    fair_value = F.when((spread > 0) & (annual_dividend > 0), annual_dividend * (1 + F.col('fiveYearCAGR')) / spread)
+else:
+    required_return = fair_value = F.lit(None).cast('double')
+companies = companies.withColumn('requiredReturn', required_return).withColumn('fairValue', fair_value)
 
 latest_market = (
-    sp500_cagr
-    .union(latest_risk_free)
+    spark.createDataFrame(market_rates, 'ticker string, rate double')
     .groupBy()
     .agg(
         F.collect_list(
@@ -187,16 +453,89 @@ latest_market = (
     )
 )
 
-combined_df = (
-    result
+# summary document - metrics of every company, without the histories
+summary = (
+    companies
+    .groupBy()
+    .agg(F.collect_list(F.struct(*[F.col(column) for column in summary_columns])).alias('companies'))
     .join(latest_market)
     .withColumn('lastUpdated', F.lit(F.current_timestamp()))
 )
 
-json_content = combined_df.toJSON().collect()
-json_data = '[' + ','.join(json_content) + ']'
+# detail documents - one per company with its histories, written to S3 by the executors
+details = companies.select(
+    'ticker',
+    F.to_json(F.struct(*[F.col(column) for column in summary_columns + ['betas', 'priceHistory', 'dividendHistory']])).alias('detail')
+)
+
+
+def write_ticker_shards(rows):
+    client = boto3.client('s3')
+    for row in rows:
+        client.put_object(Body=row['detail'], Bucket=bucket_name, Key=f"{ticker_prefix}/{row['ticker']}.json")
+
+
+with metrics.step('shards'):
+    details.foreachPartition(write_ticker_shards)
+
+# the version of this run's summary and metadata
+version = datetime.today().strftime('%Y-%m-%d-%H-%M-%S')
+
+# only the single summary row is brought back to the driver
+with metrics.step('summary'):
+    summary_json = summary.toJSON().first()
+
+# the summary is kept as a new version, with the changed fields of every company against the previous one
+summary_document = json.loads(summary_json)
+summary_document['version'] = version
+with metrics.step('versions'):
+    published = publish(s3_client, bucket_name, analysis_folder, summary_document)
+summary_body = json.dumps([summary_document], separators=(',', ':'))
+# the sector and industry statistics and rankings, written first so a new summary finds its rollups
+with metrics.step('rollups'):
+    rollups_body = json.dumps(rollups(summary_document), separators=(',', ':'))
+with metrics.step('upload'):
+    s3_client.put_object(Body=rollups_body, Bucket=bucket_name, Key=rollups_key)
+    s3_client.put_object(Body=summary_body, Bucket=bucket_name, Key=summary_key)
+
+tickers = sorted(company['ticker'] for company in summary_document['companies'])
+metrics.count('Companies', len(tickers))
+metrics.count('SummaryBytes', len(summary_body))
+metrics.count('RollupsBytes', len(rollups_body))
+metrics.count('ChangedCompanies', published.get('changed', len(tickers)))
+s3_client.put_object(
+    Body=json.dumps({
+        'lastUpdated': summary_document['lastUpdated'],
+        'version': version,
+        'summary': summary_key,
+        'rollups': rollups_key,
+        'tickers': {ticker: f'{ticker_prefix}/{ticker}.json' for ticker in tickers}
+    }),
+    Bucket=bucket_name,
+    Key=manifest_key
+)
+
+# remove the shards of companies that dropped out of the analysis
+delete_stale_shards(set(tickers))
+
+# persist the metadata for the next run under the same version, then swap the pointer
+with metrics.step('metadata'):
+    write_state(daily_data.drop('year', 'month'), version, 'daily')
+    write_state(dividend_events, version, 'dividends')
+    write_state(ticker_years, version, 'ticker_years')
+    write_state(latest_rows, version, 'latest')
+
+s3_client.put_object(
+    Body=json.dumps({'version': version, 'previous': pointer['version'] if pointer else None}),
+    Bucket=bucket_name,
+    Key=metadata_pointer_key
+)
+
+# keep the snapshot that was just read in case this run is rolled back
+if pointer and pointer.get('previous'):
+    delete_state(pointer['previous'])
 
-object_key = '${pAnalysisFolder}/output.json'
-s3_client.put_object(Body=json_data, Bucket="${pS3BucketName}", Key=object_key)
+# the step function only waits for the job, its metrics are stored next to the manifest
+s3_client.put_object(Body=json.dumps(metrics.finish({})['Metrics']), Bucket=bucket_name, Key=metrics_key)
 
 job.commit()
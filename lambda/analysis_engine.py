@@ -0,0 +1,371 @@
+'''
+Pure pandas/NumPy version of the dividend analysis Glue job (glue/dividend_analysis.py).
+It produces the same output document without a Spark cluster, so it can run in a Lambda or locally.
+'''
+
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from valuation import default_valuation
+
+BENCHMARK_TICKERS = ['^GSPC', '^TNX']
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# fields of the summary document, the detail documents add the histories
+SUMMARY_COLUMNS = [
+    'ticker', 'name', 'sector', 'industry', 'consecutiveGrowthYears', 'dividendFrequency',
+    'beta', 'fiveYearCAGR', 'lastDividend', 'lastPrice', 'requiredReturn', 'fairValue'
+]
+DETAIL_COLUMNS = SUMMARY_COLUMNS + ['betas', 'priceHistory', 'dividendHistory']
+# defaults of the job's --beta_benchmarks and --beta_lookbacks arguments
+BETA_BENCHMARKS = ['^GSPC']
+BETA_LOOKBACKS = ['5y-daily']
+
+
+def format_timestamp(value):
+    # same rendering as Spark's toJSON in a UTC session
+    return value.strftime(TIMESTAMP_FORMAT)[:-3] + 'Z'
+
+
+def transform_tickers(raw_tickers):
+    '''
+    Keeps the symbols of the latest ticker file, with the columns used by the analysis
+    '''
+    tickers = raw_tickers.rename(columns=str.lower)
+    tickers = (
+        tickers[tickers['updatedat'] == tickers['updatedat'].max()]
+        .sort_values('updatedat', ascending=False, kind='mergesort')
+        .drop_duplicates('symbol')
+        .rename(columns={
+            'symbol': 'ticker',
+            'security': 'name',
+            'gics sector': 'sector',
+            'gics sub-industry': 'industry'
+        })
+    )
+    return tickers[['ticker', 'name', 'sector', 'industry']].reset_index(drop=True)
+
+
+def transform_data(raw_data):
+    '''
+    Deduplicates the raw data and sorts it by ticker and date
+    accepts both the catalog (lower case) and yfinance (title case) column names
+    '''
+    data = raw_data.rename(columns=str.lower)[['ticker', 'date', 'adj close', 'dividends']]
+    data = data.drop_duplicates(['ticker', 'date'])
+    dates = pd.to_datetime(data['date'])
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+    data = data.assign(
+        date=dates,
+        **{'adj close': data['adj close'].astype('float64'), 'dividends': data['dividends'].astype('float64')}
+    )
+    return data.sort_values(['ticker', 'date'], kind='mergesort').reset_index(drop=True)
+
+
+def group_starts(keys):
+    '''
+    Returns a boolean mask of the first row of every run of equal keys
+    '''
+    keys = np.asarray(keys)
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = keys[1:] != keys[:-1]
+    return starts
+
+
+def annual_dividends(company_data):
+    paid = company_data['dividends'].where(company_data['dividends'] > 0)
+    return (
+        pd.DataFrame({
+            'ticker': company_data['ticker'].to_numpy(),
+            'year': company_data['date'].dt.year.to_numpy(),
+            'dividends': company_data['dividends'].to_numpy(),
+            'paid': paid.to_numpy()
+        })
+        .groupby(['ticker', 'year'], sort=True)
+        .agg(annual_dividend=('dividends', 'sum'), dividendFrequency=('paid', 'count'))
+        .reset_index()
+    )
+
+
+def dividend_calculations(annual, year):
+    '''
+    Consecutive dividend growth years and 5 year CAGR of the given year
+    the CAGR window covers the last five rows with at least five growth years, as in the Glue job
+    '''
+    tickers = annual['ticker'].to_numpy()
+    dividends = annual['annual_dividend'].to_numpy(dtype='float64')
+    starts = group_starts(tickers)
+
+    increase = np.empty(len(dividends))
+    increase[0:1] = np.nan
+    increase[1:] = dividends[1:] - dividends[:-1]
+    increase[starts] = np.nan
+    flag = increase > 0
+
+    # length of the current run of growth years, every row without growth resets it
+    index = np.arange(len(flag))
+    last_reset = np.maximum.accumulate(np.where(flag, -1, index))
+    streak = np.where(flag, index - last_reset, 0)
+
+    keep = streak >= 5
+    qualified = annual.loc[keep, ['ticker', 'year', 'dividendFrequency']].reset_index(drop=True)
+    qualified['consecutiveGrowthYears'] = streak[keep]
+    kept_dividends = dividends[keep]
+
+    position = qualified.groupby('ticker', sort=False).cumcount().to_numpy()
+    first = np.arange(len(qualified)) - np.minimum(position, 4)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        qualified['fiveYearCAGR'] = np.power(kept_dividends / kept_dividends[first], 1 / 5) - 1
+
+    return (
+        qualified[qualified['year'] == year]
+        [['ticker', 'dividendFrequency', 'consecutiveGrowthYears', 'fiveYearCAGR']]
+        .reset_index(drop=True)
+    )
+
+
+def log_returns(data):
+    '''
+    Daily log returns within every ticker, the first row of each ticker has no return
+    '''
+    prices = data['adj close'].to_numpy(dtype='float64')
+    returns = np.full(len(prices), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = np.log(prices[1:] / prices[:-1])
+    returns[group_starts(data['ticker'])] = np.nan
+    return returns
+
+
+def beta_result(five_year_data, market_data):
+    '''
+    Population covariance of company and S&P 500 returns over the S&P 500 variance
+    '''
+    market = pd.DataFrame({'date': market_data['date'].to_numpy(), 'sp500_returns': log_returns(market_data)})
+    joined = pd.DataFrame({
+        'ticker': five_year_data['ticker'].to_numpy(),
+        'date': five_year_data['date'].to_numpy(),
+        'returns': log_returns(five_year_data)
+    }).merge(market, on='date')
+
+    pairs = joined.dropna(subset=['returns', 'sp500_returns'])
+    pair_groups = pairs.groupby('ticker', sort=True)
+    x = pairs['returns'] - pair_groups['returns'].transform('mean')
+    y = pairs['sp500_returns'] - pair_groups['sp500_returns'].transform('mean')
+    covar = (x * y).groupby(pairs['ticker']).mean()
+    # the covariance of a single pair is 0 by construction, so a beta needs two pairs, as in the Glue job
+    covar = covar[pair_groups.size() >= 2]
+
+    market_returns = joined.dropna(subset=['sp500_returns'])
+    centered = market_returns['sp500_returns'] - market_returns.groupby('ticker')['sp500_returns'].transform('mean')
+    variance = (centered ** 2).groupby(market_returns['ticker']).mean()
+
+    # a ticker with a date in common with the S&P 500 but fewer than two pairs of returns keeps an undefined beta
+    tickers = np.sort(joined['ticker'].unique())
+    beta = covar.reindex(tickers) / variance.reindex(tickers).replace(0, np.nan)
+    return beta.rename('beta').rename_axis('ticker').reset_index()
+
+
+def parse_lookback(lookback):
+    '''
+    Parses a beta lookback like 3y-monthly into its name, years and return frequency
+    '''
+    years, _, frequency = lookback.strip().partition('-')
+    if not (years[:-1].isdigit() and years.endswith('y') and 1 <= int(years[:-1]) <= 5 and frequency in ('daily', 'monthly')):
+        raise ValueError(f'Invalid beta lookback {lookback}, expected 1y to 5y and daily or monthly, e.g. 3y-monthly')
+    return lookback.strip(), int(years[:-1]), frequency
+
+
+def period_data(data, frequency):
+    '''
+    The daily rows, or the last row of every month dated to the start of the month
+    '''
+    if frequency == 'daily':
+        return data
+    monthly = data.assign(date=data['date'].dt.to_period('M').dt.to_timestamp())
+    return monthly[~monthly.duplicated(['ticker', 'date'], keep='last')].reset_index(drop=True)
+
+
+def beta_table(company_data, transformed_data, today, benchmarks, lookbacks):
+    '''
+    Beta of every company against every benchmark for every lookback
+    the first benchmark and lookback give the beta column, and only the companies that have it
+    '''
+    results = []
+    for name, years, frequency in lookbacks:
+        start = today - timedelta(days=365 * years)
+        window = period_data(company_data[company_data['date'] >= start].reset_index(drop=True), frequency)
+        for benchmark in benchmarks:
+            market = transformed_data[(transformed_data['ticker'] == benchmark) & (transformed_data['date'] >= start)]
+            results.append((benchmark, name, beta_result(window, period_data(market, frequency)).set_index('ticker')['beta']))
+
+    primary = results[0][2]
+    betas = {ticker: {benchmark: {} for benchmark in benchmarks} for ticker in primary.index}
+    for benchmark, name, beta in results:
+        # undefined betas are kept in the beta column and left out of the betas, as in the Glue job
+        for ticker, value in beta.dropna().items():
+            if ticker in betas:
+                betas[ticker][benchmark][name] = float(value)
+
+    return pd.DataFrame({'ticker': primary.index, 'beta': primary.to_numpy(), 'betas': [betas[ticker] for ticker in primary.index]})
+
+
+def latest_data(company_data):
+    last_rows = group_starts(company_data['ticker'].to_numpy()[::-1])[::-1]
+    latest = pd.DataFrame({
+        'ticker': company_data['ticker'].to_numpy()[last_rows],
+        'lastPrice': company_data['adj close'].to_numpy()[last_rows]
+    })
+    paid = company_data[company_data['dividends'] > 0]
+    last_dividends = paid.groupby('ticker', sort=False)['dividends'].last().rename('lastDividend')
+    return latest.join(last_dividends, on='ticker')
+
+
+def history(data, column):
+    return [
+        {'date': format_timestamp(date), column: value}
+        for date, value in zip(data['date'], data[column].tolist())
+    ]
+
+
+def historical_prices(company_data, today):
+    recent = company_data[company_data['date'] >= today - timedelta(days=365)]
+    prices = recent[recent['date'] >= today - timedelta(days=30)]
+    dividends = recent[recent['dividends'] > 0]
+
+    price_groups = {ticker: group for ticker, group in prices.groupby('ticker', sort=False)}
+    dividend_groups = {ticker: group for ticker, group in dividends.groupby('ticker', sort=False)}
+    empty = company_data.iloc[0:0]
+
+    return pd.DataFrame([
+        {
+            'ticker': ticker,
+            'priceHistory': history(price_groups.get(ticker, empty), 'adj close'),
+            'dividendHistory': history(dividend_groups.get(ticker, empty), 'dividends')
+        }
+        for ticker in recent['ticker'].unique()
+    ], columns=['ticker', 'priceHistory', 'dividendHistory'])
+
+
+def first_day(moment):
+    # first midnight at or after the moment, the first day a date mask starting at it keeps
+    day = np.datetime64(moment, 'D')
+    return day if np.datetime64(moment, 'us') == day else day + 1
+
+
+def store_histories(store, tickers, today):
+    '''
+    Same histories as historical_prices, read from the per-ticker history store
+    each ticker is a range lookup over its last 365 days, whatever the length of its history
+    '''
+    rows = []
+    for ticker in tickers:
+        recent = store.range(ticker, first_day(today - timedelta(days=365)))
+        if not len(recent):
+            continue
+        prices = recent[recent['date'] >= first_day(today - timedelta(days=30))]
+        dividends = recent[recent['dividends'] > 0]
+        rows.append({
+            'ticker': ticker,
+            'priceHistory': [
+                {'date': format_timestamp(pd.Timestamp(date)), 'adj close': value}
+                for date, value in zip(prices['date'], prices['adj close'].tolist())
+            ],
+            'dividendHistory': [
+                {'date': format_timestamp(pd.Timestamp(date)), 'dividends': value}
+                for date, value in zip(dividends['date'], dividends['dividends'].tolist())
+            ]
+        })
+    return pd.DataFrame(rows, columns=['ticker', 'priceHistory', 'dividendHistory'])
+
+
+def latest_market(transformed_data, today):
+    benchmarks = []
+
+    sp500 = transformed_data[(transformed_data['ticker'] == '^GSPC') & (transformed_data['date'] >= today - timedelta(days=365 * 5))]
+    if not sp500.empty:
+        prices = sp500['adj close'].to_numpy()
+        benchmarks.append({'ticker': '^GSPC', 'rate': float((prices[-1] / prices[0]) ** (1 / 5) - 1)})
+
+    treasury = transformed_data[transformed_data['ticker'] == '^TNX']
+    if not treasury.empty:
+        benchmarks.append({'ticker': '^TNX', 'rate': float(treasury['adj close'].iloc[-1] / 100)})
+
+    return benchmarks
+
+
+def clean_record(record):
+    # Spark's toJSON leaves out null fields
+    cleaned = {}
+    for key, value in record.items():
+        if isinstance(value, (float, np.floating)) and np.isnan(value):
+            continue
+        if isinstance(value, np.integer):
+            value = int(value)
+        elif isinstance(value, np.floating):
+            value = float(value)
+        cleaned[key] = value
+    return cleaned
+
+
+def run_analysis(raw_data, raw_tickers, today=None, benchmarks=None, lookbacks=None, store=None):
+    '''
+    Runs the dividend analysis and returns the output document of the Glue job
+    benchmarks and lookbacks are the job's --beta_benchmarks and --beta_lookbacks
+    store - history store the price and dividend histories are read from, instead of the raw data
+    '''
+    today = today or datetime.today()
+    benchmarks = list(benchmarks or BETA_BENCHMARKS)
+    lookbacks = [parse_lookback(lookback) for lookback in (lookbacks or BETA_LOOKBACKS)]
+
+    transformed_tickers = transform_tickers(raw_tickers)
+    transformed_data = transform_data(raw_data)
+    company_data = transformed_data[~transformed_data['ticker'].isin(BENCHMARK_TICKERS + benchmarks)].reset_index(drop=True)
+
+    dividends = dividend_calculations(annual_dividends(company_data), today.year - 1)
+    beta = beta_table(company_data, transformed_data, today, benchmarks, lookbacks)
+    if store is None:
+        histories = historical_prices(company_data, today)
+    else:
+        histories = store_histories(store, company_data['ticker'].unique(), today)
+
+    companies = (
+        dividends
+        .merge(beta, on='ticker')
+        .merge(latest_data(company_data), on='ticker')
+        .merge(transformed_tickers, on='ticker')
+        .merge(histories, on='ticker')
+        .sort_values('ticker')
+    )
+    market = latest_market(transformed_data, today)
+    required, value = default_valuation(
+        (companies['lastDividend'] * companies['dividendFrequency']).to_numpy(dtype='float64'),
+        companies['fiveYearCAGR'].to_numpy(dtype='float64'),
+        companies['beta'].to_numpy(dtype='float64'),
+        market
+    )
+    companies = companies.assign(requiredReturn=required, fairValue=value)
+
+    return [{
+        'companies': [clean_record(record) for record in companies[DETAIL_COLUMNS].to_dict('records')],
+        'benchmarks': market,
+        'lastUpdated': format_timestamp(datetime.utcnow())
+    }]
+
+
+def split_output(document):
+    '''
+    Splits the output document like the Glue job writes it
+    returns the summary document and the detail document of each ticker
+    '''
+    summary = dict(document[0])
+    summary['companies'] = [
+        {field: company[field] for field in SUMMARY_COLUMNS if field in company}
+        for company in document[0]['companies']
+    ]
+    details = {company['ticker']: company for company in document[0]['companies']}
+    return [summary], details
+
+
+def to_json(document):
+    return json.dumps(document, separators=(',', ':'))
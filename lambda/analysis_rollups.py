@@ -0,0 +1,107 @@
+'''
+Sector and industry rollups of the analysis summary and the companies ranked by each metric
+'''
+
+import math
+
+# stored next to the summary of every version, so the API serves a group's statistics or its top
+# companies without scanning the summary
+#     groups - per group (every company, each sector, each industry) the count and the mean, min,
+#              percentiles and max of every metric
+#     top - per group and metric the tickers of the TOP_K highest and lowest companies, in order
+# a company without a value of a metric is left out of that metric's statistics and ranking
+
+METRICS = ['beta', 'fiveYearCAGR', 'dividendYield', 'consecutiveGrowthYears']
+GROUPS = ['sector', 'industry']
+# companies kept in each ranking, highest and lowest first
+TOP_K = 25
+
+
+def dividend_yield(company):
+    '''
+    Forward dividend yield, the next year of dividends at the last dividend over the last price
+    '''
+    if not company.get('lastPrice') or company.get('lastDividend') is None or company.get('dividendFrequency') is None:
+        return None
+    return company['lastDividend'] * company['dividendFrequency'] / company['lastPrice']
+
+
+def value(company, metric):
+    result = dividend_yield(company) if metric == 'dividendYield' else company.get(metric)
+    if result is None or (isinstance(result, float) and math.isnan(result)):
+        return None
+    return result
+
+
+def percentile(values, q):
+    '''
+    Percentile of sorted values, interpolated linearly between the closest ranks
+    '''
+    position = (len(values) - 1) * q
+    lower = math.floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def describe(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'min': values[0],
+        'p25': percentile(values, 0.25),
+        'median': percentile(values, 0.5),
+        'p75': percentile(values, 0.75),
+        'max': values[-1]
+    }
+
+
+def rank(pairs, top_k):
+    '''
+    The tickers of the (value, ticker) pairs, highest value first with ties by ticker, keeping the
+    highest and the lowest top_k
+    '''
+    ranked = sorted(pairs, key=lambda pair: (-pair[0], pair[1]))
+    return {
+        'highest': [ticker for _, ticker in ranked[:top_k]],
+        'lowest': [ticker for _, ticker in ranked[::-1][:top_k]]
+    }
+
+
+def rollups(summary, top_k=TOP_K):
+    '''
+    Rollups of the summary, the first element of the summary document
+    '''
+    companies = summary.get('companies', [])
+    # the (value, ticker) pairs of every metric of every company, without the missing values
+    pairs = [
+        {metric: (value(company, metric), company['ticker']) for metric in METRICS if value(company, metric) is not None}
+        for company in companies
+    ]
+    members = {'all': {'all': list(range(len(companies)))}}
+    for group in GROUPS:
+        members[group] = {}
+        for position, company in enumerate(companies):
+            if company.get(group) is not None:
+                members[group].setdefault(company[group], []).append(position)
+
+    groups = {}
+    top = {}
+    for group, names in members.items():
+        groups[group] = {}
+        top[group] = {}
+        for name, positions in sorted(names.items()):
+            metric_pairs = {metric: [pairs[position][metric] for position in positions if metric in pairs[position]] for metric in METRICS}
+            groups[group][name] = dict({'count': len(positions)}, **{metric: describe([pair[0] for pair in metric_pairs[metric]]) for metric in METRICS})
+            top[group][name] = {metric: rank(metric_pairs[metric], top_k) for metric in METRICS}
+
+    return {
+        'version': summary.get('version'),
+        'lastUpdated': summary.get('lastUpdated'),
+        'metrics': METRICS,
+        'topK': top_k,
+        'groups': groups,
+        'top': top
+    }
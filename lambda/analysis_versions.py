@@ -0,0 +1,148 @@
+'''
+Versioned snapshots of the analysis summary and the deltas between them
+'''
+
+import json
+from botocore.exceptions import ClientError
+
+# every analysis run keeps its summary under a new version, with the changed fields of every company
+# against the previous one, so a client that has a version only downloads what changed since
+#     versions/<version>.json - the summary of a version, as served at /data
+#     deltas/<version>.json - the companies that left (removed) and joined (added) the summary, the
+#                             changed fields of the others (changed, a null removes a field) and the
+#                             benchmarks when they changed
+#     versions.json - the retained versions, oldest first, each linked to its previous version
+
+# versions kept, a client further behind gets the full summary
+MAX_VERSIONS = 30
+
+
+def read_document(s3, bucket_name, key):
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+    return json.loads(response['Body'].read())
+
+
+def keys(analysis_folder):
+    return {
+        'index': f'{analysis_folder}/versions.json',
+        'snapshot': f'{analysis_folder}/versions/' + '{version}.json',
+        'delta': f'{analysis_folder}/deltas/' + '{version}.json'
+    }
+
+
+def diff(previous, latest):
+    '''
+    Changes from the previous summary to the latest one, both the first element of a summary document
+    a field missing from a company, which is how a null is written, is compared as None
+    '''
+    before = {company['ticker']: company for company in previous.get('companies', [])}
+    after = {company['ticker']: company for company in latest.get('companies', [])}
+
+    changed = {}
+    for ticker in sorted(before.keys() & after.keys()):
+        fields = {
+            field: after[ticker].get(field)
+            for field in sorted(before[ticker].keys() | after[ticker].keys())
+            if before[ticker].get(field) != after[ticker].get(field)
+        }
+        if fields:
+            changed[ticker] = fields
+
+    delta = {
+        'version': latest.get('version'),
+        'previous': previous.get('version'),
+        'lastUpdated': latest.get('lastUpdated'),
+        'changed': changed,
+        'added': {ticker: after[ticker] for ticker in sorted(after.keys() - before.keys())},
+        'removed': sorted(before.keys() - after.keys())
+    }
+    if previous.get('benchmarks') != latest.get('benchmarks'):
+        delta['benchmarks'] = latest.get('benchmarks')
+    return delta
+
+
+def compose(deltas):
+    '''
+    Folds consecutive deltas, oldest first, into one delta from the previous version of the first
+    to the version of the last
+    '''
+    composed = {'version': None, 'previous': deltas[0]['previous'] if deltas else None, 'lastUpdated': None, 'changed': {}, 'added': {}, 'removed': set()}
+    for delta in deltas:
+        for ticker in delta['removed']:
+            composed['changed'].pop(ticker, None)
+            # a company that joined within the composed versions was never known to the client
+            if composed['added'].pop(ticker, None) is None:
+                composed['removed'].add(ticker)
+        for ticker, company in delta['added'].items():
+            composed['removed'].discard(ticker)
+            composed['changed'].pop(ticker, None)
+            composed['added'][ticker] = dict(company)
+        for ticker, fields in delta['changed'].items():
+            if ticker in composed['added']:
+                company = composed['added'][ticker]
+                for field, value in fields.items():
+                    if value is None:
+                        company.pop(field, None)
+                    else:
+                        company[field] = value
+            else:
+                composed['changed'].setdefault(ticker, {}).update(fields)
+        if 'benchmarks' in delta:
+            composed['benchmarks'] = delta['benchmarks']
+        composed['version'] = delta['version']
+        composed['lastUpdated'] = delta['lastUpdated']
+    composed['removed'] = sorted(composed['removed'])
+    return composed
+
+
+def chain(index, since, latest, limit=MAX_VERSIONS):
+    '''
+    The versions after `since` up to `latest`, oldest first, following the previous version of each
+    None when `since` is not one of the at most `limit` versions before `latest`
+    '''
+    previous = {entry['version']: entry['previous'] for entry in index.get('versions', [])}
+    versions = []
+    version = latest
+    while version != since:
+        if version not in previous or len(versions) == limit:
+            return None
+        versions.append(version)
+        version = previous[version]
+    return versions[::-1]
+
+
+def publish(s3, bucket_name, analysis_folder, summary, keep=MAX_VERSIONS):
+    '''
+    Stores the summary, the first element of the summary document with its version, as a new version
+    and its delta against the summary it replaces, call before the summary itself is written
+    the versions beyond `keep` are deleted, returns the new index entry
+    '''
+    paths = keys(analysis_folder)
+    current = read_document(s3, bucket_name, f'{analysis_folder}/summary.json')
+    index = read_document(s3, bucket_name, paths['index']) or {'versions': []}
+
+    version = summary['version']
+    previous = current[0] if current and current[0].get('version') else None
+    entry = {'version': version, 'previous': previous['version'] if previous else None, 'companies': len(summary.get('companies', []))}
+
+    s3.put_object(Bucket=bucket_name, Key=paths['snapshot'].format(version=version), Body=json.dumps([summary], separators=(',', ':')))
+    if previous:
+        delta = diff(previous, summary)
+        s3.put_object(Bucket=bucket_name, Key=paths['delta'].format(version=version), Body=json.dumps(delta, separators=(',', ':')))
+        entry['changed'] = len(delta['changed']) + len(delta['added']) + len(delta['removed'])
+
+    # a retried run replaces its own entry
+    versions = [existing for existing in index['versions'] if existing['version'] != version] + [entry]
+    expired, versions = versions[:-keep], versions[-keep:]
+    s3.put_object(Bucket=bucket_name, Key=paths['index'], Body=json.dumps({'latest': version, 'versions': versions}))
+
+    if expired:
+        s3.delete_objects(Bucket=bucket_name, Delete={'Objects': [
+            {'Key': paths[kind].format(version=existing['version'])} for existing in expired for kind in ('snapshot', 'delta')
+        ]})
+    return entry
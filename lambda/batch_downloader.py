@@ -0,0 +1,104 @@
+'''
+Concurrent, fault isolated batch downloads for the data collector.
+
+A source is any callable source(tickers, start_date, end_date) returning a frame with a
+Ticker column, so the scheduler can run against yfinance or a fake source offline.
+'''
+
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# allow_empty - tickers without data in the range are expected (e.g. a holiday) and not retried
+Batch = namedtuple('Batch', ['name', 'tickers', 'start_date', 'end_date', 'allow_empty'], defaults=[False])
+
+
+class RateLimiter:
+    '''
+    Spaces out calls to a source to at most `rate` per second across all threads
+    '''
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.next_call = 0
+
+    def wait(self):
+        with self.lock:
+            now = self.clock()
+            call_at = max(now, self.next_call)
+            self.next_call = call_at + self.interval
+        if call_at > now:
+            self.sleep(call_at - now)
+
+
+def download_batch(source, batch, limiter, retries=3, backoff=1, sleep=time.sleep):
+    '''
+    Downloads a batch of tickers, retrying the tickers without data with exponential backoff
+    returns the downloaded frames, a dict of failed ticker to reason and the tickers without data
+    '''
+    frames = []
+    errors = {}
+    pending = list(batch.tickers)
+
+    for attempt in range(retries + 1):
+
+        if attempt:
+            sleep(backoff * 2 ** (attempt - 1))
+
+        limiter.wait()
+        try:
+            data = source(pending, batch.start_date, batch.end_date)
+        except Exception as e:
+            errors.update({ticker: str(e) for ticker in pending})
+            continue
+
+        received = set(data['Ticker'].unique()) if len(data) else set()
+        if received:
+            frames.append(data[data['Ticker'].isin(received)])
+        pending = [ticker for ticker in pending if ticker not in received]
+        errors.update({ticker: 'No data returned' for ticker in pending})
+
+        if not pending:
+            break
+        if batch.allow_empty:
+            return frames, {}, pending
+
+    return frames, {ticker: errors[ticker] for ticker in pending}, []
+
+
+def collect(batches, source, save, max_workers=4, limiter=None, retries=3, backoff=1, sleep=time.sleep):
+    '''
+    Downloads batches concurrently and saves each one as soon as it completes
+    batches - list of Batch
+    save - callable save(frames, name) returning the keys of the written files
+    returns a report with the succeeded, failed and empty tickers and the written files
+    '''
+    limiter = limiter or RateLimiter(rate=None)
+    report = {'Succeeded': [], 'Failed': {}, 'Empty': [], 'Files': []}
+
+    def run(batch):
+        frames, failed, empty = download_batch(source, batch, limiter, retries, backoff, sleep)
+        # frames are handed over as downloaded so the writer can stream them
+        keys = save(frames, batch.name) if frames else []
+        succeeded = [ticker for ticker in batch.tickers if ticker not in failed and ticker not in empty]
+        return succeeded, failed, empty, keys
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                succeeded, failed, empty, keys = future.result()
+            except Exception as e:
+                # the download succeeded but the batch could not be saved
+                succeeded, failed, empty, keys = [], {ticker: str(e) for ticker in batch.tickers}, [], []
+            report['Succeeded'].extend(succeeded)
+            report['Failed'].update(failed)
+            report['Empty'].extend(empty)
+            report['Files'].extend(keys)
+
+    return report
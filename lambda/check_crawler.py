@@ -1,5 +1,6 @@
 import os
-import boto3
+from clients import client
+from instrumentation import Metrics
 
 
 def lambda_handler(event, context):
@@ -9,13 +10,13 @@ def lambda_handler(event, context):
     '''
 
     result = {}
-
-    client = boto3.client('glue')
+    metrics = Metrics('check_crawler')
 
     crawler_name = event['taskresult']['crawler_name']
     cnt = int(event['taskresult']['cnt']) + 1
     
-    response = client.get_crawler(Name = crawler_name)
+    with metrics.step('read'):
+        response = client('glue').get_crawler(Name = crawler_name)
     
     # check last state
     last_state = "INITIAL"
@@ -54,4 +55,4 @@ def lambda_handler(event, context):
 
     result['Location'] = location
 
-    return result
\ No newline at end of file
+    return metrics.finish(result)
\ No newline at end of file
@@ -0,0 +1,26 @@
+'''
+AWS clients shared by every invocation of a Lambda container
+a client is created on first use, so a handler only pays for the services it calls
+'''
+
+import threading
+import boto3
+
+_clients = {}
+# boto3's default session is not thread safe, the clients it creates are
+_lock = threading.Lock()
+
+
+def client(service):
+    with _lock:
+        if service not in _clients:
+            _clients[service] = boto3.client(service)
+        return _clients[service]
+
+
+def clear():
+    '''
+    Drops the cached clients, the next call of client creates new ones
+    '''
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,317 @@
+'''
+Compaction of the small files the pipeline adds every weekday under the data and ticker raw folders
+
+every run adds a file per batch to the current year partition of the data table (or one csv per batch)
+and a timestamped ticker csv, so the crawlers and the analysis job list and open hundreds of small files
+compaction merges the files of a period (a year) into one file, without duplicates and sorted by
+ticker and date (or symbol), keeping the row of the latest file where files overlap:
+
+    data, parquet - every year=YYYY partition with MIN_FILES files or more
+    data, csv - the files smaller than SMALL_FILE_MB, merged with the compacted file of their years
+    ticker - the ticker files of every year with MIN_FILES files or more, the latest row of every symbol
+
+the swap is committed through a manifest under the data transform folder,
+
+    pending - the sources and targets are recorded before any target is written
+    committed - every target is written, from here on the sources are archived
+    (deleted) - every source is archived
+
+a run first finishes the manifests left by a failed run, it deletes the targets of a pending one and
+archives the sources of a committed one, so a period is never lost or stored twice for good
+between the commit and the archive readers see both copies, which the analysis job removes with
+dropDuplicates(['ticker', 'date']) and the latest ticker row per symbol
+files written in the last MIN_AGE_HOURS are left alone, they may belong to a running execution
+'''
+
+import os
+import json
+import gzip
+from io import BytesIO
+from datetime import datetime, timedelta, timezone
+from clients import client
+from instrumentation import Metrics
+from move_file import move
+
+DATA_FORMAT = os.environ.get('DATA_FORMAT', 'csv')
+# a period is compacted once it holds this many files
+MIN_FILES = int(os.environ.get('MIN_FILES', 2))
+# csv data files from this size on are left as they are, e.g. the full history of a new batch
+SMALL_FILE_BYTES = int(os.environ.get('SMALL_FILE_MB', 64)) * 2**20
+# periods above this size are skipped, their rows are held in memory while merged
+MAX_PERIOD_BYTES = int(os.environ.get('MAX_PERIOD_MB', 1024)) * 2**20
+MIN_AGE = timedelta(hours=float(os.environ.get('MIN_AGE_HOURS', 12)))
+
+
+def list_objects(s3, bucket_name, prefix):
+    objects = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket = bucket_name, Prefix = prefix):
+        for obj in page.get('Contents', []):
+            objects[obj['Key']] = obj
+    return objects
+
+
+def read_body(s3, bucket_name, key):
+    return s3.get_object(Bucket = bucket_name, Key = key)['Body'].read()
+
+
+def compacted_name(sources, period=None):
+    '''
+    Names a compacted file after the run of its latest source, the collectors name their files after
+    the run time, so sorting the files of a period by name still puts the latest rows last, e.g. a file
+    too recent to be compacted with the others
+    '''
+    name = max(key.rsplit('/', 1)[-1][:len('YYYY-MM-DD-HH-MM-SS')] for key in sources) + '-compacted'
+    return f"{name}-{period}" if period else name
+
+
+def period_of(key):
+    '''
+    Year of a compacted csv file, e.g. 2024 of 2025-01-02-00-00-00-compacted-2024.csv
+    '''
+    return int(key.rsplit('-', 1)[1].split('.')[0])
+
+
+def settled(objects, now):
+    '''
+    Returns the objects written before the minimum age, by key
+    '''
+    return {
+        key: obj for key, obj in objects.items()
+        if 'LastModified' not in obj or obj['LastModified'] <= now - MIN_AGE
+    }
+
+
+def merge_rows(frames, keys):
+    '''
+    Concatenates the frames of the files of a period in file order, keeping the last row of every
+    ticker and date, sorted by ticker and date
+    '''
+    import pandas as pd
+    from raw_data import conform
+
+    data = pd.concat([conform(frame) for frame in frames], ignore_index=True)
+    data = data.drop_duplicates(subset = keys, keep = 'last')
+    return data.sort_values(keys, kind = 'mergesort').reset_index(drop = True)
+
+
+def write_parquet(s3, bucket_name, key, data):
+    from raw_data import ParquetPartitionWriter
+    from s3_stream import S3MultipartWriter
+
+    # the rows of a period fall in a single partition, so every partition opens the same file
+    with S3MultipartWriter(s3, bucket_name, key) as sink:
+        with ParquetPartitionWriter(lambda partition: sink) as writer:
+            writer.write(data)
+
+
+def data_parquet_jobs(s3, bucket_name, location, objects):
+    '''
+    One job per year partition with at least MIN_FILES files
+    '''
+    from raw_data import PARQUET_COLUMNS
+
+    partitions = {}
+    for key, obj in objects.items():
+        if key.endswith('.parquet') and '/year=' in key:
+            partitions.setdefault(key[len(location) + 1:].split('/')[0], {})[key] = obj['Size']
+
+    def job(partition, sources):
+        def merge():
+            import pyarrow.parquet as pq
+
+            columns = {column: name for name, column in PARQUET_COLUMNS.items()}
+            frames = [
+                pq.read_table(BytesIO(read_body(s3, bucket_name, key))).to_pandas().rename(columns = columns)
+                for key in sorted(sources)
+            ]
+            merged = merge_rows(frames, ['Ticker', 'Date'])
+            key = f"{location}/{partition}/{compacted_name(sources)}.parquet"
+            return {key: lambda: write_parquet(s3, bucket_name, key, merged)}, len(merged)
+        return partition, sources, merge
+
+    return [job(partition, sources) for partition, sources in sorted(partitions.items()) if len(sources) >= MIN_FILES]
+
+
+def data_csv_jobs(s3, bucket_name, location, objects):
+    '''
+    A single job of the small csv files, merged with the compacted files of the years they hold
+    '''
+    import pandas as pd
+    from raw_data import save_df_to_s3
+
+    files = {key: obj['Size'] for key, obj in objects.items() if key.endswith('.csv') and '/' not in key[len(location) + 1:]}
+    compacted = {key: size for key, size in files.items() if '-compacted-' in key}
+    sources = {key: size for key, size in files.items() if key not in compacted and size < SMALL_FILE_BYTES}
+    if len(sources) < MIN_FILES:
+        return []
+
+    def read(key):
+        return pd.read_csv(BytesIO(read_body(s3, bucket_name, key)))
+
+    def merge():
+        frames = {key: read(key) for key in sources}
+        years = set()
+        for frame in frames.values():
+            years.update(pd.to_datetime(frame['Date']).dt.year.unique().tolist())
+        # the compacted file of a year is merged again, so a year stays in a single compacted file
+        for key in compacted:
+            if period_of(key) in years:
+                frames[key] = read(key)
+                sources[key] = compacted[key]
+        merged = merge_rows([frames[key] for key in sorted(frames)], ['Ticker', 'Date'])
+        writes = {}
+        for year, rows in merged.groupby(merged['Date'].dt.year):
+            key = f"{location}/{compacted_name(sources, year)}.csv"
+            writes[key] = lambda key=key, rows=rows: save_df_to_s3(s3, [rows], bucket_name, key)
+        return writes, len(merged)
+
+    return [('csv', sources, merge)]
+
+
+def ticker_jobs(s3, bucket_name, location, objects):
+    '''
+    One job per year of ticker files with at least MIN_FILES files
+    compacted ticker files are gzipped, the bucket notification only starts the step function for .csv keys
+    '''
+    import pandas as pd
+    from raw_data import TICKER_COLUMNS
+
+    years = {}
+    for key, obj in objects.items():
+        name = key[len(location) + 1:]
+        if '/' not in name and (name.endswith('.csv') or name.endswith('.csv.gz')):
+            year = str(period_of(name)) if '-compacted-' in name else name[:4]
+            years.setdefault(year, {})[key] = obj['Size']
+
+    def job(year, sources):
+        def merge():
+            frames = [
+                pd.read_csv(BytesIO(read_body(s3, bucket_name, key)), sep = '|', dtype = str, keep_default_na = False,
+                            compression = 'gzip' if key.endswith('.gz') else None)
+                for key in sorted(sources)
+            ]
+            tickers = pd.concat(frames, ignore_index = True).reindex(columns = TICKER_COLUMNS)
+            tickers = tickers.drop_duplicates(subset = 'Symbol', keep = 'last').sort_values('Symbol', kind = 'mergesort')
+            key = f"{location}/{compacted_name(sources, year)}.csv.gz"
+            body = gzip.compress(tickers.to_csv(index = False, sep = '|').encode('utf-8'))
+            return {key: lambda: s3.put_object(Bucket = bucket_name, Key = key, Body = body)}, len(tickers)
+        return year, sources, merge
+
+    return [job(year, sources) for year, sources in sorted(years.items()) if len(sources) >= MIN_FILES]
+
+
+def archive(s3, bucket_name, sources, raw_location, archive_location, metrics):
+    '''
+    Moves the sources to the archive folder, keeping their path below the raw folder
+    '''
+    moves = {key: archive_location + key[len(raw_location):] for key in sources}
+    moved, missing, failed = move(s3, bucket_name, moves, {}, metrics)
+    if failed:
+        raise RuntimeError(f"{len(failed)} files could not be archived, e.g. {next(iter(failed.items()))}")
+    return len(moved) + len(missing)
+
+
+def recover(s3, bucket_name, manifest_prefix, metrics):
+    '''
+    Finishes the manifests of a failed run
+    returns the number of pending and committed manifests
+    '''
+    recovered = {'pending': 0, 'committed': 0}
+    for key in sorted(list_objects(s3, bucket_name, manifest_prefix + '/')):
+        manifest = json.loads(read_body(s3, bucket_name, key))
+        if manifest['state'] == 'committed':
+            archive(s3, bucket_name, manifest['sources'], manifest['raw_location'], manifest['archive_location'], metrics)
+        else:
+            # the sources were never replaced, a partially written target is dropped
+            s3.delete_objects(Bucket = bucket_name, Delete = {'Objects': [{'Key': target} for target in manifest['targets']], 'Quiet': True})
+        recovered[manifest['state']] += 1
+        s3.delete_object(Bucket = bucket_name, Key = key)
+    return recovered
+
+
+def compact(s3, bucket_name, job, raw_location, archive_location, manifest_key, metrics):
+    '''
+    Merges the sources of a job and swaps the targets in for them through the manifest
+    '''
+    period, sources, merge = job
+    with metrics.step('merge'):
+        writes, rows = merge()
+    if set(writes) & set(sources):
+        # a target would replace one of its own sources before it is archived
+        return None
+
+    manifest = {
+        'state': 'pending',
+        'period': period,
+        'sources': sorted(sources),
+        'targets': sorted(writes),
+        'raw_location': raw_location,
+        'archive_location': archive_location
+    }
+    s3.put_object(Bucket = bucket_name, Key = manifest_key, Body = json.dumps(manifest, indent = 1))
+    with metrics.step('write'):
+        for write in writes.values():
+            write()
+    manifest['state'] = 'committed'
+    s3.put_object(Bucket = bucket_name, Key = manifest_key, Body = json.dumps(manifest, indent = 1))
+
+    with metrics.step('archive'):
+        archived = archive(s3, bucket_name, manifest['sources'], raw_location, archive_location, metrics)
+    s3.delete_object(Bucket = bucket_name, Key = manifest_key)
+    return {'Period': period, 'Sources': archived, 'Targets': len(writes), 'Rows': rows}
+
+
+def lambda_handler(event, context):
+
+    '''
+    This function compacts the small files of the data and ticker raw folders, run on a schedule
+    event may name the datasets to compact, data and ticker by default
+    '''
+
+    result = {}
+    metrics = Metrics('compact_files')
+
+    s3 = client('s3')
+    bucket_name = os.environ['BUCKETNAME']
+    raw_folder = os.environ['RAW_FOLDER']
+    archive_folder = os.environ['ARCHIVE_FOLDER']
+    manifest_prefix = f"{os.environ['DATA_FOLDER']}/{os.environ['TRANSFORM_FOLDER']}/compaction"
+    now = datetime.now(timezone.utc)
+
+    with metrics.step('recover'):
+        result['Recovered'] = recover(s3, bucket_name, manifest_prefix, metrics)
+
+    result['Compacted'] = []
+    result['Skipped'] = []
+    for dataset in event.get('datasets', ['data', 'ticker']):
+        folder = os.environ['DATA_FOLDER'] if dataset == 'data' else os.environ['TICKER_FOLDER']
+        raw_location = f"{folder}/{raw_folder}"
+        with metrics.step('list'):
+            objects = settled(list_objects(s3, bucket_name, raw_location + '/'), now)
+        metrics.count('ListedFiles', len(objects))
+
+        if dataset == 'ticker':
+            jobs = ticker_jobs(s3, bucket_name, raw_location, objects)
+        elif DATA_FORMAT == 'parquet':
+            jobs = data_parquet_jobs(s3, bucket_name, raw_location, objects)
+        else:
+            jobs = data_csv_jobs(s3, bucket_name, raw_location, objects)
+
+        for job in jobs:
+            period, sources, _ = job
+            if sum(sources.values()) > MAX_PERIOD_BYTES:
+                result['Skipped'].append({'Dataset': dataset, 'Period': period, 'Reason': f"{sum(sources.values())} bytes"})
+                continue
+            compacted = compact(
+                s3, bucket_name, job, raw_location, f"{folder}/{archive_folder}",
+                f"{manifest_prefix}/{dataset}-{period}.json", metrics
+            )
+            if compacted is None:
+                result['Skipped'].append({'Dataset': dataset, 'Period': period, 'Reason': 'target is a source'})
+                continue
+            metrics.count('CompactedFiles', compacted['Sources'])
+            metrics.count('WrittenFiles', compacted['Targets'])
+            result['Compacted'].append(dict(compacted, Dataset = dataset))
+
+    result['Validation'] = 'SUCCESS'
+    return(metrics.finish(result))
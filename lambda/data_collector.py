@@ -1,36 +1,159 @@
-import yfinance as yf
-from io import StringIO
-import boto3
 import json
+import os
+import threading
 from datetime import datetime, timedelta
+from batch_downloader import Batch, RateLimiter, collect
+from s3_stream import S3MultipartWriter, bound_buffers
+from market_data import YFinanceSource, ReplaySource, CachedSource, LocalStore, S3Store
+from history_store import HistoryStore, to_records
+from last_dates import read_last_dates
+from instrumentation import Metrics
+from clients import client
 
-def get_yfinance_data(tickers, start_date, end_date):
-    data = yf.download(
-        tickers,
-        start_date,
-        end_date, 
-        group_by="Ticker",
-        actions=True
-    )
-    data = data.stack(level=0).rename_axis(['Date', 'Ticker']).reset_index()
-    return data
-
-def save_df_to_s3(data, bucket_name, key):
-    csv_buffer = StringIO()
-    data.to_csv(csv_buffer, index=False)
-    s3_resource = boto3.resource('s3')
-    s3_resource.Object(bucket_name, key).put(Body=csv_buffer.getvalue())
-
-def lambda_handler(event, context):
+# yfinance, pandas and pyarrow (through market_data and raw_data) are imported by the functions that use them,
+# a run with nothing to download does not load them
+
+DATA_FORMAT = os.environ.get('DATA_FORMAT', 'csv')
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 100))
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 4))
+REQUESTS_PER_SECOND = float(os.environ.get('REQUESTS_PER_SECOND', 10))
+RETRIES = int(os.environ.get('RETRIES', 3))
+# upper bound of the data buffered per upload before it is sent to S3
+MAX_BUFFER_BYTES = int(os.environ.get('MAX_BUFFER_MB', 8)) * 2**20
+# yfinance, or replay:<directory> to replay recorded data
+SOURCE = os.environ.get('SOURCE', 'yfinance')
+# none, tmp (per container) or s3 (shared, under the data transform folder)
+SOURCE_CACHE = os.environ.get('SOURCE_CACHE', 'tmp')
+SOURCE_CACHE_BYTES = int(os.environ.get('SOURCE_CACHE_MB', 256)) * 2**20
+SOURCE_CACHE_AGE = int(os.environ.get('SOURCE_CACHE_HOURS', 24)) * 3600
+# prefix of the per-ticker history store, not written when unset
+HISTORY_PREFIX = os.environ.get('HISTORY_PREFIX')
+# start of the full history of a ticker
+HISTORY_START = datetime(1900, 1, 1)
+
+# one limiter per container, shared by every download thread
+# yfinance is limited per request rather than per batch
+yfinance_limiter = RateLimiter(rate=REQUESTS_PER_SECOND)
+
+def market_source(s3, bucket_name, cache_prefix):
+    '''
+    Builds the configured market data source, behind the configured cache
+    '''
+    if SOURCE.startswith('replay:'):
+        source = ReplaySource(SOURCE[len('replay:'):])
+    else:
+        source = YFinanceSource(yfinance_limiter)
+
+    if SOURCE_CACHE == 'tmp':
+        store = LocalStore('/tmp/market-data')
+    elif SOURCE_CACHE == 's3':
+        store = S3Store(s3, bucket_name, cache_prefix)
+    else:
+        return source
+    return CachedSource(source, store, max_bytes = SOURCE_CACHE_BYTES, max_age = SOURCE_CACHE_AGE)
+
+def save_df_to_s3_parquet(s3, frames, bucket_name, location, name):
+    '''
+    Streams the frames to parquet files partitioned by year, a row group per frame and partition
+    partitions that stay below a part are spilled to /tmp once they hold more than the buffer together
+    returns the keys of the written files and their total size
+    '''
+    from raw_data import ParquetPartitionWriter
+
+    sinks = []
+
+    def open_sink(partition):
+        sinks.append(S3MultipartWriter(s3, bucket_name, f"{location}/{partition}/{name}.parquet", part_size=MAX_BUFFER_BYTES))
+        return sinks[-1]
+
+    try:
+        with ParquetPartitionWriter(open_sink) as writer:
+            for frame in frames:
+                writer.write(frame)
+                bound_buffers(sinks, MAX_BUFFER_BYTES)
+    except Exception:
+        for sink in sinks:
+            sink.abort()
+        raise
+
+    for sink in sinks:
+        sink.close()
+    return [sink.key for sink in sinks], sum(sink.tell() for sink in sinks)
+
+def save_data(s3, frames, bucket_name, location, name):
+    '''
+    Writes the frames in the configured format and returns the keys of the written files and their total size
+    '''
+    if DATA_FORMAT == 'parquet':
+        return save_df_to_s3_parquet(s3, frames, bucket_name, location, name)
+    from raw_data import save_df_to_s3
+
+    key = f"{location}/{name}.csv"
+    return [key], save_df_to_s3(s3, frames, bucket_name, key, part_size=MAX_BUFFER_BYTES)
+
+def batches(tickers, name, start_date, end_date, allow_empty=False):
+    return [
+        Batch(f"{name}-batch-{batch}", tickers[batch:batch + BATCH_SIZE], start_date, end_date, allow_empty)
+        for batch in range(0, len(tickers), BATCH_SIZE)
+    ]
+
+def plan_batches(new_tickers, old_tickers, last_dates, file_name, today):
+    '''
+    Requests only the missing range of every ticker, tickers missing the same range share batches
+    old tickers without a stored date fall back to the previous day
+    '''
+    today = datetime(today.year, today.month, today.day)
+    # a returning ticker already has stored data and only needs its missing range
+    returning = [ticker for ticker in new_tickers if ticker in last_dates]
+    new_tickers = [ticker for ticker in new_tickers if ticker not in last_dates]
+
+    ranges = {}
+    for ticker in old_tickers + returning:
+        if ticker in last_dates:
+            start_date = datetime.strptime(last_dates[ticker], '%Y-%m-%d') + timedelta(days=1)
+        else:
+            start_date = today - timedelta(days=1)
+        ranges.setdefault(start_date, []).append(ticker)
+
+    planned = batches(new_tickers, f"{file_name}-historical", HISTORY_START, today)
+    for start_date, tickers in sorted(ranges.items()):
+        # skip ranges without a weekday, there is nothing to download
+        if not any((start_date + timedelta(days=day)).weekday() < 5 for day in range((today - start_date).days)):
+            continue
+        planned += batches(tickers, f"{file_name}-from-{start_date:%Y-%m-%d}", start_date, today, allow_empty=True)
+    return planned
+
+def write_manifest(s3, event, result, stored_dates):
+    '''
+    Writes the files and last dates of a shard to its manifest, which the merge function combines
+    the files leave the result, so the results of every shard stay small in the step function state
+    '''
+    key = f"{event['data_folder']}/{event['transform_folder']}/shards/{event['file_name'].split('.')[0]}/shard-{event['shard']['index']}.json"
+    s3.put_object(Bucket = event['bucket_name'], Key = key, Body = json.dumps({
+        'Files': result.pop('Files'),
+        'LastDates': stored_dates
+    }, sort_keys = True))
+    result['Shard'] = event['shard']['index']
+    result['Manifest'] = key
+
+def lambda_handler(event, context, source=None):
 
     result = {}
+    metrics = Metrics('data_collector')
+    # a shard of a sharded run reads its own input, written by the shard function
+    shard = event.get('shard')
+    stored_dates = {}
+    # rows stored by the run, which tell the change detection that the data changed
+    stored = {'Rows': 0}
 
     try:
 
-        s3 = boto3.client('s3')
+        s3 = client('s3')
 
-        response = s3.get_object(Bucket = event['bucket_name'], Key = f"{event['ticker_folder']}/{event['transform_folder']}/data_input.json")
-        content = response['Body'].read().decode('utf-8')
+        input_key = shard['key'] if shard else f"{event['ticker_folder']}/{event['transform_folder']}/data_input.json"
+        with metrics.step('read'):
+            response = s3.get_object(Bucket = event['bucket_name'], Key = input_key)
+            content = response['Body'].read().decode('utf-8')
 
         json_data = json.loads(content)
         new_tickers = json_data.get('New_Tickers', [])
@@ -38,34 +161,100 @@ def lambda_handler(event, context):
 
         today = datetime.today()
         file_name = event['file_name'].split('.')[0]
+        if shard:
+            file_name = f"{file_name}-shard-{shard['index']}"
+        location = f"{event['data_folder']}/{event['raw_folder']}"
+        # the files written so far are reported even if the run fails, so they can be moved to the error folder
+        result['Location'] = location
+        result['Files'] = []
+
+        last_dates_key = f"{event['data_folder']}/{event['transform_folder']}/last_dates.json"
+        source = source or market_source(s3, event['bucket_name'], f"{event['data_folder']}/{event['transform_folder']}/cache")
+        with metrics.step('read'):
+            last_dates = read_last_dates(s3, event['bucket_name'], last_dates_key)
+        last_dates_lock = threading.Lock()
+        history = HistoryStore(s3, event['bucket_name'], HISTORY_PREFIX) if HISTORY_PREFIX else None
+        # a replaced history is fetched past the range cache, whose entries can predate the adjustment
+        upstream = getattr(source, 'source', source)
+
+        def download(tickers, start_date, end_date):
+            with metrics.step('download'):
+                data = source(tickers, start_date, end_date)
+            metrics.count('DownloadedRows', len(data))
+            return data
+
+        def save(frames, name):
+            from raw_data import conform
+
+            with metrics.step('upload'):
+                keys, size = save_data(s3, frames, event['bucket_name'], location, name)
+            metrics.count('StoredRows', sum(len(frame) for frame in frames))
+            metrics.count('StoredBytes', size)
+            metrics.count('StoredFiles', len(keys))
+            with last_dates_lock:
+                result['Files'].extend(keys)
+                stored['Rows'] += sum(len(frame) for frame in frames)
+            # batches do not share tickers, so the histories of a batch are only appended by its thread
+            if history:
+                with metrics.step('history'):
+                    for frame in frames:
+                        for ticker, rows in conform(frame).groupby('Ticker'):
+                            with last_dates_lock:
+                                stored_before = ticker in last_dates
+                            # a dividend or a split adjusts every earlier close of a stored history
+                            if stored_before and ((rows['Dividends'] > 0) | ~rows['Stock Splits'].fillna(0).isin([0, 1])).any():
+                                full = upstream([ticker], HISTORY_START, datetime(today.year, today.month, today.day))
+                                if len(full):
+                                    history.replace(ticker, to_records(conform(full)))
+                                    metrics.count('ReplacedHistories', 1)
+                                    continue
+                            history.append(ticker, to_records(rows))
+            # only advance the index once the data is stored
+            with last_dates_lock:
+                for frame in frames:
+                    dates = conform(frame[['Date', 'Ticker']]).groupby('Ticker')['Date'].max().dt.strftime('%Y-%m-%d')
+                    for ticker, date in dates.items():
+                        last_dates[ticker] = max(date, last_dates.get(ticker, date))
+                        stored_dates[ticker] = last_dates[ticker]
+            return keys
+
+        report = collect(
+            batches = plan_batches(new_tickers, old_tickers, last_dates, file_name, today),
+            source = download,
+            save = save,
+            max_workers = MAX_WORKERS,
+            retries = RETRIES
+        )
 
-        if old_tickers:
+        # the range cache is trimmed once per run rather than after every batch
+        if hasattr(source, 'evict'):
+            with metrics.step('evict'):
+                source.evict()
 
-            daily_data = get_yfinance_data(tickers = old_tickers,
-                                           start_date = today - timedelta(days=1),
-                                           end_date = today)
-            save_df_to_s3(data = daily_data,
-                          bucket_name = event['bucket_name'],
-                          key = f"{event['data_folder']}/{event['raw_folder']}/{file_name}-daily.csv")
+        # shards run at the same time, so the index is written by the merge function from the shard manifests
+        if not shard:
+            with metrics.step('index'):
+                s3.put_object(Bucket = event['bucket_name'], Key = last_dates_key, Body = json.dumps(last_dates, sort_keys = True))
 
-        if new_tickers:
+        result['Files'] = report['Files']
+        result['Tickers'] = {'Succeeded': len(report['Succeeded']), 'Failed': report['Failed'], 'Empty': len(report['Empty'])}
+        result['Rows'] = stored['Rows']
 
-            batch_size = 100
-            for batch in range(0, len(new_tickers), batch_size):
+        # a run only fails when every requested ticker failed
+        requested = len(set(new_tickers + old_tickers))
+        result['Requested'] = requested
+        result['Validation'] = 'FAILURE' if requested and len(report['Failed']) == requested else 'SUCCESS'
 
-                historical_data = get_yfinance_data(tickers = new_tickers[batch:batch + batch_size],
-                                                    start_date = datetime(1900, 1, 1),
-                                                    end_date = today)
-                save_df_to_s3(data = historical_data,
-                              bucket_name = event['bucket_name'],
-                              key = f"{event['data_folder']}/{event['raw_folder']}/{file_name}-historical-batch-{batch}.csv")
+        if shard:
+            with metrics.step('index'):
+                write_manifest(s3, event, result, stored_dates)
+        return(metrics.finish(result))
 
-        result['Location'] = f"{event['data_folder']}/{event['raw_folder']}"
-        result['Validation'] = 'SUCCESS'
-        
-        return(result)
-    
     except Exception as e:
         result['Validation'] = 'FAILURE'
         result['Message'] = str(e)
-        return(result)
+        # the rows stored before the error still change the data of a sharded run
+        result['Rows'] = stored['Rows']
+        if shard and 'Location' in result:
+            write_manifest(s3, event, result, stored_dates)
+        return(metrics.finish(result))
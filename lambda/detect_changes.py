@@ -0,0 +1,121 @@
+'''
+Change detection of the inputs of the analysis, so a day that changes nothing skips the crawlers and the Glue job
+
+    tickers - a hash of the ticker file without its update time, computed by the ticker diff
+    data - the rows stored by the data collector, every stored row has a date the last analysis did not see
+
+the ticker hash of the last analysis is kept in changes.json under the data transform folder
+a day is only skipped when no previous run is still pending, i.e. collected data that was never analyzed,
+and in that case the lastUpdated time of the analysis files is still refreshed
+'''
+
+import os
+import json
+import hashlib
+from datetime import datetime
+from botocore.exceptions import ClientError
+from clients import client
+from instrumentation import Metrics
+
+
+def ticker_hash(rows, ignore=('updatedAt',)):
+    '''
+    Hash of the rows of a ticker file, independent of their order and of the ignored columns
+    '''
+    lines = sorted('|'.join(value or '' for column, value in sorted(row.items()) if column not in ignore) for row in rows)
+    return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+def format_timestamp(value):
+    # same rendering as Spark's toJSON in a UTC session, like the analysis job's lastUpdated
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def read_json(s3, bucket_name, key):
+    try:
+        response = s3.get_object(Bucket = bucket_name, Key = key)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise
+    return json.loads(response['Body'].read())
+
+
+def refresh_last_updated(s3, bucket_name, analysis_folder, now=None):
+    '''
+    Sets the lastUpdated time of the summary, the rollups and the manifest of the analysis, without running it
+    returns the new time, or None before the first analysis
+    '''
+    summary_key = f"{analysis_folder}/summary.json"
+    rollups_key = f"{analysis_folder}/rollups.json"
+    manifest_key = f"{analysis_folder}/manifest.json"
+    summary = read_json(s3, bucket_name, summary_key)
+    if not summary:
+        return None
+
+    last_updated = format_timestamp(now or datetime.utcnow())
+    summary[0]['lastUpdated'] = last_updated
+    s3.put_object(Bucket = bucket_name, Key = summary_key, Body = json.dumps(summary, separators = (',', ':')))
+    rollups = read_json(s3, bucket_name, rollups_key)
+    if rollups:
+        rollups['lastUpdated'] = last_updated
+        s3.put_object(Bucket = bucket_name, Key = rollups_key, Body = json.dumps(rollups, separators = (',', ':')))
+    manifest = read_json(s3, bucket_name, manifest_key)
+    if manifest:
+        manifest['lastUpdated'] = last_updated
+        s3.put_object(Bucket = bucket_name, Key = manifest_key, Body = json.dumps(manifest))
+    return last_updated
+
+
+def lambda_handler(event, context):
+
+    '''
+    This function compares the ticker hash of a run with the last analysis and checks whether it stored rows
+    with action analyzed, called after the analysis job, it marks the pending inputs as analyzed
+    '''
+
+    result = {}
+    metrics = Metrics('detect_changes')
+
+    s3 = client('s3')
+    bucket_name = event['bucket_name']
+    state_key = f"{event['data_folder']}/{event['transform_folder']}/changes.json"
+
+    with metrics.step('read'):
+        state = read_json(s3, bucket_name, state_key) or {}
+
+    if event.get('action') == 'analyzed':
+        state['pending'] = False
+        state['analyzedAt'] = format_timestamp(datetime.utcnow())
+        with metrics.step('write'):
+            s3.put_object(Bucket = bucket_name, Key = state_key, Body = json.dumps(state))
+        result['Validation'] = 'SUCCESS'
+        return(metrics.finish(result))
+
+    tickers = event['tickerresult']['Hash']
+    rows = event['taskresult'].get('Rows', 0)
+
+    changes = []
+    if state.get('pending'):
+        # a previous run collected data, but its analysis did not finish
+        changes.append('pending')
+    if tickers != state.get('tickers'):
+        changes.append('tickers')
+    # stored rows are always new, the collector only requests the dates after the last stored one
+    if rows:
+        changes.append('data')
+
+    if changes:
+        state.update({'tickers': tickers, 'pending': True})
+        with metrics.step('write'):
+            s3.put_object(Bucket = bucket_name, Key = state_key, Body = json.dumps(state))
+    else:
+        with metrics.step('refresh'):
+            result['LastUpdated'] = refresh_last_updated(s3, bucket_name, os.environ['ANALYSIS_FOLDER'])
+
+    metrics.count('CollectedRows', rows)
+    result['Changed'] = bool(changes)
+    result['Changes'] = changes
+    result['Validation'] = 'SUCCESS'
+
+    return(metrics.finish(result))
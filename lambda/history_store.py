@@ -0,0 +1,220 @@
+'''
+Per-ticker store of daily adjusted close prices and dividends, as date-sorted NumPy record arrays
+every ticker has two .npy objects under the store prefix:
+
+    <ticker>/base.npy - the bulk of the history, only rewritten when the tail is merged into it
+    <ticker>/tail.npy - the rows appended since, rewritten by every collection
+
+appends only keep rows after the last stored date, kept in the tail's metadata
+a dividend or a split changes every earlier adjusted close, so the collector replaces the whole
+history of a ticker with an action instead of appending to it
+the tail is written before the base is advanced, a tail row dated up to the last row of the base
+is already in the base and is dropped on load
+readers download each object once per version and memory-map it from a local directory, a range
+lookup is a binary search on the dates and returns views of the mapped arrays, the least recently
+used mapped files are deleted beyond max_bytes
+'''
+
+import os
+import io
+import time
+import threading
+
+# rows of the tail merged into the base once exceeded
+TAIL_ROWS = 256
+RECORD = [('date', 'datetime64[D]'), ('adj close', 'float64'), ('dividends', 'float64')]
+
+
+def to_records(frame):
+    '''
+    Returns the Date, Adj Close and Dividends of a single ticker frame as a date-sorted record array
+    '''
+    import numpy as np
+
+    frame = frame.sort_values('Date', kind='mergesort').drop_duplicates('Date', keep='last')
+    records = np.empty(len(frame), dtype=RECORD)
+    records['date'] = frame['Date'].to_numpy(dtype='datetime64[D]')
+    records['adj close'] = frame['Adj Close'].to_numpy(dtype='float64')
+    records['dividends'] = frame['Dividends'].to_numpy(dtype='float64')
+    return records
+
+
+def date_range(records, start=None, end=None):
+    '''
+    Returns the view of the records dated in [start, end)
+    '''
+    import numpy as np
+
+    dates = records['date']
+    first = 0 if start is None else np.searchsorted(dates, np.datetime64(start, 'D'), side='left')
+    last = len(records) if end is None else np.searchsorted(dates, np.datetime64(end, 'D'), side='left')
+    return records[first:last]
+
+
+def after(tail, base):
+    '''
+    Returns the view of the tail records dated after the last base record
+    '''
+    import numpy as np
+
+    if not len(base):
+        return tail
+    return tail[np.searchsorted(tail['date'], base['date'][-1], side='right'):]
+
+
+def to_bytes(records):
+    import numpy as np
+
+    buffer = io.BytesIO()
+    np.save(buffer, records)
+    return buffer.getvalue()
+
+
+def from_bytes(body):
+    import numpy as np
+    return np.load(io.BytesIO(body))
+
+
+class HistoryStore:
+    '''
+    Reads and appends the histories of the tickers under an S3 prefix
+    cache_dir - local directory the objects are memory-mapped from
+    ttl - seconds a mapped object is served before its ETag is revalidated with S3
+    max_bytes - upper bound of the mapped files kept in cache_dir
+    '''
+
+    def __init__(self, s3, bucket_name, prefix, cache_dir='/tmp/history', ttl=60, max_bytes=256 * 2**20):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # (ticker, part) -> etag, time of the last check and use, mapped array, its file and size
+        self.mapped = {}
+
+    def key(self, ticker, part):
+        return f'{self.prefix}/{ticker}/{part}.npy'
+
+    def get(self, ticker, part, etag=None):
+        '''
+        Returns the body and object of a part, or None when it does not exist or still has the etag
+        '''
+        from botocore.exceptions import ClientError
+
+        try:
+            if etag:
+                response = self.s3.get_object(Bucket=self.bucket_name, Key=self.key(ticker, part), IfNoneMatch=etag)
+            else:
+                response = self.s3.get_object(Bucket=self.bucket_name, Key=self.key(ticker, part))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '304', 'NotModified'):
+                return None, None
+            raise
+        return response['Body'].read(), response
+
+    def put(self, ticker, part, records, last_date):
+        self.s3.put_object(
+            Bucket=self.bucket_name,
+            Key=self.key(ticker, part),
+            Body=to_bytes(records),
+            Metadata={'last-date': str(last_date)}
+        )
+
+    def append(self, ticker, records):
+        '''
+        Appends the records dated after the last stored date of the ticker
+        returns the number of rows appended
+        '''
+        import numpy as np
+
+        body, response = self.get(ticker, 'tail')
+        if body is None:
+            tail = np.empty(0, dtype=RECORD)
+            last_date = None
+        else:
+            tail = from_bytes(body)
+            last_date = response.get('Metadata', {}).get('last-date')
+
+        if last_date:
+            records = records[records['date'] > np.datetime64(last_date, 'D')]
+        if not len(records):
+            return 0
+
+        tail = np.concatenate([tail, records])
+        last_date = records['date'][-1]
+        self.put(ticker, 'tail', tail, last_date)
+        if len(tail) > TAIL_ROWS:
+            body, _ = self.get(ticker, 'base')
+            base = np.empty(0, dtype=RECORD) if body is None else from_bytes(body)
+            # a failure before the tail is emptied leaves its rows in both, they are dropped from the tail
+            self.put(ticker, 'base', np.concatenate([base, after(tail, base)]), last_date)
+            self.put(ticker, 'tail', tail[:0], last_date)
+        return len(records)
+
+    def replace(self, ticker, records):
+        '''
+        Replaces the whole history of the ticker, e.g. with one refetched after a dividend or a split
+        '''
+        last_date = records['date'][-1] if len(records) else None
+        self.put(ticker, 'base', records, last_date)
+        # the rows of a tail left by a failure here are all dated up to the last base row
+        self.put(ticker, 'tail', records[:0], last_date)
+
+    def part(self, ticker, part):
+        '''
+        Returns the memory-mapped records of a part, downloaded once per version
+        '''
+        import numpy as np
+
+        cached = self.mapped.get((ticker, part))
+        if cached and time.monotonic() - cached['checked_at'] < self.ttl:
+            cached['used'] = time.monotonic()
+            return cached['records']
+
+        body, response = self.get(ticker, part, cached['etag'] if cached else None)
+        if body is None:
+            if cached:
+                cached['checked_at'] = cached['used'] = time.monotonic()
+                return cached['records']
+            return np.empty(0, dtype=RECORD)
+
+        etag = response['ETag'].strip('"')
+        path = os.path.join(self.cache_dir, ticker, f'{part}-{etag}.npy')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.part', 'wb') as mapped_file:
+            mapped_file.write(body)
+        os.replace(path + '.part', path)
+        records = np.load(path, mmap_mode='r')
+
+        now = time.monotonic()
+        with self.lock:
+            previous = self.mapped.get((ticker, part))
+            self.mapped[(ticker, part)] = {'etag': etag, 'checked_at': now, 'used': now, 'records': records, 'path': path, 'size': len(body)}
+            # a removed version stays readable through its mapping until it is released
+            removed = [previous] if previous and previous['path'] != path else []
+            size = sum(entry['size'] for entry in self.mapped.values())
+            for key, entry in sorted(self.mapped.items(), key=lambda item: item[1]['used']):
+                if size <= self.max_bytes or key == (ticker, part):
+                    break
+                removed.append(self.mapped.pop(key))
+                size -= entry['size']
+        for entry in removed:
+            if os.path.exists(entry['path']):
+                os.remove(entry['path'])
+        return records
+
+    def range(self, ticker, start=None, end=None):
+        '''
+        Returns the records of the ticker dated in [start, end)
+        a range within one part is a view of its mapped array, only a range spanning both is copied
+        '''
+        import numpy as np
+
+        base = self.part(ticker, 'base')
+        parts = [date_range(records, start, end) for records in (base, after(self.part(ticker, 'tail'), base))]
+        parts = [records for records in parts if len(records)]
+        if not parts:
+            return np.empty(0, dtype=RECORD)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
@@ -0,0 +1,110 @@
+'''
+Timings, counts and peak memory of the named steps of a handler or Glue job
+'''
+
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+NAMESPACE = 'PipelineStages'
+# writes a metric log line, Lambda and Glue send stdout to CloudWatch
+log = print
+
+
+def peak_rss_mb():
+    '''
+    Peak resident memory of the process, None where getrusage is not available
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+
+class Metrics:
+    '''
+    Metrics of one invocation of a stage
+    a handler wraps its sub-steps in metrics.step(name) and adds what it touched with metrics.count,
+    finish() attaches the report to the result and logs it in the CloudWatch embedded metric format
+    steps run on several threads add up their durations, so a step can take longer than the stage
+    '''
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = time.perf_counter()
+        self.steps = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                step = self.steps.setdefault(name, {'ms': 0.0, 'calls': 0})
+                step['ms'] += elapsed * 1000
+                step['calls'] += 1
+
+    def count(self, name, value):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def report(self):
+        with self.lock:
+            return {
+                'Stage': self.stage,
+                'DurationMs': round((time.perf_counter() - self.started) * 1000, 1),
+                'Steps': {name: {'ms': round(step['ms'], 1), 'calls': step['calls']} for name, step in self.steps.items()},
+                'Counts': dict(self.counts),
+                'PeakRssMb': peak_rss_mb()
+            }
+
+    def emit(self, report=None):
+        '''
+        Prints the report as a single embedded metric format log line
+        '''
+        report = report or self.report()
+        values = {'DurationMs': report['DurationMs']}
+        units = {'DurationMs': 'Milliseconds'}
+        for name, step in report['Steps'].items():
+            values[f'{name}Ms'] = step['ms']
+            units[f'{name}Ms'] = 'Milliseconds'
+        for name, value in report['Counts'].items():
+            values[name] = value
+            units[name] = 'Bytes' if name.lower().endswith('bytes') else 'Count'
+        if report['PeakRssMb'] is not None:
+            values['PeakRssMb'] = report['PeakRssMb']
+            units['PeakRssMb'] = 'Megabytes'
+
+        log(json.dumps(dict({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['Stage']],
+                    'Metrics': [{'Name': name, 'Unit': units[name]} for name in values]
+                }]
+            },
+            'Stage': self.stage
+        }, **values)))
+
+    def finish(self, result=None):
+        '''
+        Emits the report and attaches it to the result under Metrics
+        '''
+        report = self.report()
+        self.emit(report)
+        if result is not None:
+            result['Metrics'] = report
+        return result
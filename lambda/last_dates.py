@@ -0,0 +1,19 @@
+'''
+Index of the last stored date of every ticker, written by the data collector and the shard merge
+'''
+
+import json
+from botocore.exceptions import ClientError
+
+
+def read_last_dates(s3, bucket_name, key):
+    '''
+    Reads the index of the last stored date of every ticker
+    '''
+    try:
+        response = s3.get_object(Bucket = bucket_name, Key = key)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return {}
+        raise
+    return json.loads(response['Body'].read())
@@ -0,0 +1,87 @@
+'''
+NYSE trading days, from the exchange's holiday rules
+a holiday on a Saturday is observed on the Friday before and one on a Sunday on the Monday after,
+except New Year's Day, which is not observed when it falls on a Saturday
+special closures (e.g. national days of mourning) are not included, a run on one finds no data
+'''
+
+from datetime import date, datetime, timedelta
+
+def nth_weekday(year, month, weekday, n):
+    '''
+    The nth weekday (Monday 0) of a month, the last one when n is -1
+    '''
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def easter(year):
+    '''
+    Gregorian Easter Sunday (anonymous Gregorian algorithm)
+    '''
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 19 * l) // 433
+    month = (h + l - 7 * m + 90) // 25
+    return date(year, month, (h + l - 7 * m + 33 * month + 19) % 32)
+
+
+def observed(day):
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def holidays(year):
+    '''
+    The NYSE full day holidays of a year
+    '''
+    days = {
+        nth_weekday(year, 1, 0, 3),        # Martin Luther King Jr. Day
+        nth_weekday(year, 2, 0, 3),        # Washington's Birthday
+        easter(year) - timedelta(days=2),  # Good Friday
+        nth_weekday(year, 5, 0, -1),       # Memorial Day
+        observed(date(year, 7, 4)),        # Independence Day
+        nth_weekday(year, 9, 0, 1),        # Labor Day
+        nth_weekday(year, 11, 3, 4),       # Thanksgiving Day
+        observed(date(year, 12, 25))       # Christmas Day
+    }
+    if date(year, 1, 1).weekday() != 5:
+        days.add(observed(date(year, 1, 1)))
+    if year >= 2022:
+        days.add(observed(date(year, 6, 19)))  # Juneteenth
+    return days
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def sessions(after, until):
+    '''
+    The trading days after `after` up to and including `until`
+    '''
+    days = []
+    day = after + timedelta(days=1)
+    while day <= until:
+        if is_trading_day(day):
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def session_date(now=None):
+    '''
+    Last day whose data a run collects, the data collector downloads up to the day of the run, excluded
+    so the run at 00:00 UTC collects the session that closed a few hours before
+    '''
+    return (now or datetime.utcnow()).date() - timedelta(days=1)
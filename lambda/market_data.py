@@ -0,0 +1,349 @@
+'''
+Sources of daily market data for the data collector
+a source is called with a list of tickers and a [start_date, end_date) range and returns a single
+frame with Date and Ticker columns, leaving out the tickers it has no data for (the batch
+downloader retries them)
+'''
+
+import io
+import os
+import zlib
+import time
+import hashlib
+import threading
+from datetime import datetime
+
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume', 'Dividends', 'Stock Splits']
+DATE_FORMAT = '%Y-%m-%d'
+# concurrent listings of the cached entries of a batch
+LIST_WORKERS = 16
+
+
+def empty_frame():
+    import pandas as pd
+    return pd.DataFrame(columns=['Date', 'Ticker'])
+
+
+def concat(frames):
+    import pandas as pd
+    frames = [frame for frame in frames if len(frame)]
+    return pd.concat(frames, ignore_index=True) if frames else empty_frame()
+
+
+class YFinanceSource:
+    '''
+    Daily bars and actions from yfinance
+    every ticker is one request, made right after the limiter lets it through, and the batch
+    downloader threads request at the same time, so the limiter alone sets the request rate
+    yf.download kept module level state that is not safe to share between threads, so the
+    tickers go through their own yf.Ticker, which yf.download itself does per ticker
+    '''
+
+    fields = FIELDS
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def __call__(self, tickers, start_date, end_date):
+        import yfinance as yf
+
+        frames = []
+        for ticker in tickers:
+            self.limiter.wait()
+            try:
+                rows = yf.Ticker(ticker).history(start=start_date, end=end_date, actions=True, auto_adjust=False)
+            except Exception:
+                # a ticker that failed is left out of the result so the batch downloader retries it
+                continue
+            # dates without their exchange time zone, as yf.download returns them
+            if len(rows) and rows.index.tz is not None:
+                rows.index = rows.index.tz_localize(None)
+            prices = [field for field in FIELDS[:6] if field in rows.columns]
+            rows = rows.dropna(how='all', subset=prices)
+            if len(rows):
+                frames.append(rows.rename_axis('Date').reset_index().assign(Ticker=ticker))
+        return concat(frames)
+
+
+class ReplaySource:
+    '''
+    Replays recorded data from a directory of <ticker>.csv files, written by ReplaySource.record
+    runs are reproducible offline and without rate limits
+    '''
+
+    fields = FIELDS
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def read(self, ticker):
+        import pandas as pd
+
+        with self.lock:
+            if ticker not in self.data:
+                path = os.path.join(self.directory, f'{ticker}.csv')
+                self.data[ticker] = pd.read_csv(path, parse_dates=['Date']) if os.path.exists(path) else None
+            return self.data[ticker]
+
+    def __call__(self, tickers, start_date, end_date):
+        frames = []
+        for ticker in tickers:
+            data = self.read(ticker)
+            if data is not None:
+                frames.append(data[(data['Date'] >= start_date) & (data['Date'] < end_date)])
+        return concat(frames)
+
+    @staticmethod
+    def record(data, directory):
+        '''
+        Merges a collected frame into the replay files of its tickers
+        '''
+        import pandas as pd
+        from raw_data import conform
+
+        os.makedirs(directory, exist_ok=True)
+        for ticker, rows in conform(data).groupby('Ticker'):
+            path = os.path.join(directory, f'{ticker}.csv')
+            if os.path.exists(path):
+                rows = pd.concat([pd.read_csv(path, parse_dates=['Date']), rows])
+            rows.drop_duplicates('Date', keep='last').sort_values('Date').to_csv(path, index=False)
+
+
+class LocalStore:
+    '''
+    Cache store in a local directory, e.g. the /tmp of a Lambda container
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self, name):
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as stored:
+            return stored.read()
+
+    def put(self, name, body):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as stored:
+            stored.write(body)
+
+    def delete(self, names):
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def list(self, prefix):
+        '''
+        Returns the name, size and modification time (epoch seconds) of the stored files under prefix
+        '''
+        listed = []
+        for root, _, files in os.walk(os.path.join(self.directory, prefix)):
+            for file_name in files:
+                stat = os.stat(os.path.join(root, file_name))
+                name = os.path.relpath(os.path.join(root, file_name), self.directory).replace(os.sep, '/')
+                listed.append({'name': name, 'size': stat.st_size, 'modified': stat.st_mtime})
+        return listed
+
+
+class S3Store:
+    '''
+    Cache store under an S3 prefix, shared by every container
+    '''
+
+    def __init__(self, s3, bucket_name, prefix):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def get(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.s3.get_object(Bucket=self.bucket_name, Key=f'{self.prefix}/{name}')['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            raise
+
+    def put(self, name, body):
+        self.s3.put_object(Bucket=self.bucket_name, Key=f'{self.prefix}/{name}', Body=body)
+
+    def delete(self, names):
+        names = list(names)
+        for start in range(0, len(names), 1000):
+            self.s3.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': f'{self.prefix}/{name}'} for name in names[start:start + 1000]]}
+            )
+
+    def list(self, prefix):
+        '''
+        Returns the name, size and modification time (epoch seconds) of the stored objects under prefix
+        '''
+        listed = []
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=f'{self.prefix}/{prefix}'):
+            for obj in page.get('Contents', []):
+                listed.append({'name': obj['Key'][len(self.prefix) + 1:], 'size': obj['Size'], 'modified': obj['LastModified'].timestamp()})
+        return listed
+
+
+def uncovered(entries, start, end):
+    '''
+    Returns the sub-ranges of [start, end) that none of the cached entries cover
+    '''
+    gaps = []
+    cursor = start
+    for entry in sorted(entries, key=lambda entry: entry['start']):
+        if entry['start'] > cursor:
+            gaps.append((cursor, min(entry['start'], end)))
+        cursor = max(cursor, entry['end'])
+        if cursor >= end:
+            break
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+class CachedSource:
+    '''
+    Serves requests from cached ranges and only fetches the uncovered sub-ranges from the source
+    every entry is an object of its own, entries/<ticker>/<start>_<end>_<fields>, so the collectors
+    of concurrent shards never write the same object, and a call only lists the prefixes of its tickers
+    entries older than max_age seconds are not served, since adjusted prices change with every
+    dividend, and evict() removes them and the least recently used entries beyond max_bytes once
+    per invocation
+    '''
+
+    def __init__(self, source, store, max_bytes=256 * 2**20, max_age=24 * 3600):
+        self.source = source
+        self.store = store
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fields = hashlib.sha256(','.join(getattr(source, 'fields', FIELDS)).encode('utf-8')).hexdigest()[:12]
+        self.lock = threading.Lock()
+        # the entries this instance served or wrote, with the time they were used
+        self.used = {}
+        # ticker ranges fetched from the source and served from the cache
+        self.fetched = 0
+        self.served = 0
+
+    def load(self, tickers=None):
+        '''
+        Returns the stored entries of the tickers, or of every ticker, read from the names of the entry objects
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+
+        entries = []
+        prefixes = ['entries/'] if tickers is None else [f'entries/{ticker}/' for ticker in tickers]
+        # a listing per ticker costs the same however large the cache grows, they are made together
+        with ThreadPoolExecutor(max_workers=min(LIST_WORKERS, len(prefixes) or 1)) as executor:
+            listings = list(executor.map(self.store.list, prefixes))
+        for stored in (stored for listing in listings for stored in listing):
+            ticker, _, name = stored['name'][len('entries/'):].rpartition('/')
+            start, end, fields = name.split('_')
+            entries.append({
+                'name': stored['name'], 'ticker': ticker, 'start': start, 'end': end, 'fields': fields,
+                'size': stored['size'], 'created': stored['modified']
+            })
+        return entries
+
+    def evict(self, now=None):
+        '''
+        Deletes the expired entries and the least recently used ones beyond max_bytes
+        the entries this instance served or wrote were used then, the others when they were written
+        an entry deleted by another collector while it reads it is fetched again
+        '''
+        now = now or time.time()
+        entries = self.load()
+        expired = [entry for entry in entries if now - entry['created'] > self.max_age]
+        kept = sorted(
+            (entry for entry in entries if now - entry['created'] <= self.max_age),
+            key=lambda entry: self.used.get(entry['name'], entry['created'])
+        )
+        size = sum(entry['size'] for entry in kept)
+        while kept and size > self.max_bytes:
+            expired.append(kept.pop(0))
+            size -= expired[-1]['size']
+        if expired:
+            self.store.delete(entry['name'] for entry in expired)
+
+    def put(self, ticker, start, end, rows):
+        import numpy as np
+
+        # the rows of one ticker as a single record array
+        records = np.empty(len(rows), dtype=[('Date', 'int64')] + [(field, 'float64') for field in FIELDS])
+        records['Date'] = rows['Date'].to_numpy(dtype='datetime64[ns]').astype('int64')
+        for field in FIELDS:
+            records[field] = rows[field].to_numpy(dtype='float64')
+        buffer = io.BytesIO()
+        np.save(buffer, records)
+        name = f'entries/{ticker}/{start}_{end}_{self.fields}'
+        self.store.put(name, zlib.compress(buffer.getvalue(), 1))
+        with self.lock:
+            self.used[name] = time.time()
+
+    def read(self, entry):
+        import numpy as np
+        import pandas as pd
+
+        body = self.store.get(entry['name'])
+        if body is None:
+            return None
+        records = np.load(io.BytesIO(zlib.decompress(body)))
+        return pd.DataFrame({
+            'Date': records['Date'].astype('datetime64[ns]'),
+            'Ticker': entry['ticker'],
+            **{field: records[field] for field in FIELDS}
+        })
+
+    def __call__(self, tickers, start_date, end_date):
+        from raw_data import conform
+
+        start, end = f'{start_date:{DATE_FORMAT}}', f'{end_date:{DATE_FORMAT}}'
+        now = time.time()
+        requested = set(tickers)
+
+        # the cached rows of the range, an entry that can not be read does not cover its range
+        frames = []
+        covered = {ticker: [] for ticker in tickers}
+        for entry in self.load(sorted(requested)):
+            if (entry['fields'] == self.fields
+                    and entry['start'] < end and entry['end'] > start and now - entry['created'] <= self.max_age):
+                rows = self.read(entry)
+                if rows is not None:
+                    frames.append(rows[(rows['Date'] >= start_date) & (rows['Date'] < end_date)])
+                    covered[entry['ticker']].append(entry)
+                    with self.lock:
+                        self.used[entry['name']] = now
+
+        # tickers missing the same sub-range are fetched together
+        plan = {}
+        for ticker, entries in covered.items():
+            for gap in uncovered(entries, start, end):
+                plan.setdefault(gap, []).append(ticker)
+
+        for (gap_start, gap_end), gap_tickers in sorted(plan.items()):
+            data = self.source(gap_tickers, datetime.strptime(gap_start, DATE_FORMAT), datetime.strptime(gap_end, DATE_FORMAT))
+            if not len(data):
+                continue
+            data = conform(data)
+            frames.append(data)
+            # tickers left out of the result failed and stay uncovered
+            for ticker, rows in data.groupby('Ticker'):
+                self.put(ticker, gap_start, gap_end, rows)
+
+        with self.lock:
+            self.fetched += sum(len(gap_tickers) for gap_tickers in plan.values())
+            self.served += sum(len(entries) for entries in covered.values())
+
+        data = concat(frames)
+        if not len(data):
+            return data
+        return conform(data).drop_duplicates(['Ticker', 'Date']).sort_values(['Ticker', 'Date'], kind='mergesort').reset_index(drop=True)
@@ -0,0 +1,77 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from clients import client
+from instrumentation import Metrics
+from last_dates import read_last_dates
+
+# manifests read at the same time
+MAX_WORKERS = 16
+
+def merge(shard_results, manifests):
+    '''
+    Combines the results and manifests of the shard collectors into the result of a single collector run
+    a shard that failed outright, e.g. on a timeout, has no Requested count and reports its error as Message
+    '''
+    merged = {'Files': [], 'Rows': 0, 'Tickers': {'Succeeded': 0, 'Failed': {}, 'Empty': 0}}
+    requested = 0
+    failed_shards = {}
+    for shard in shard_results:
+        if 'Location' in shard:
+            merged['Location'] = shard['Location']
+        tickers = shard.get('Tickers')
+        if tickers:
+            merged['Tickers']['Succeeded'] += tickers['Succeeded']
+            merged['Tickers']['Empty'] += tickers['Empty']
+            merged['Tickers']['Failed'].update(tickers['Failed'])
+        if 'Message' in shard:
+            failed_shards[str(shard.get('Shard'))] = shard['Message']
+        requested += shard.get('Requested', 0)
+        merged['Rows'] += shard.get('Rows', 0)
+    for manifest in manifests:
+        merged['Files'].extend(manifest['Files'])
+
+    # a run only fails when every requested ticker failed, as a single collector, or no shard finished
+    every_ticker_failed = requested and len(merged['Tickers']['Failed']) == requested
+    no_shard_finished = shard_results and len(failed_shards) == len(shard_results)
+    merged['Validation'] = 'FAILURE' if every_ticker_failed or no_shard_finished else 'SUCCESS'
+    if failed_shards:
+        merged['FailedShards'] = failed_shards
+    return merged
+
+def lambda_handler(event, context):
+
+    '''
+    This function merges the results of the shard collectors of a run
+    the files of every shard are reported together, so the next states see the result of a single collector,
+    and the last dates of every shard are folded into the last dates index
+    a retried merge reads the same manifests and writes the same index
+    '''
+
+    metrics = Metrics('merge_shards')
+
+    s3 = client('s3')
+    bucket_name = event['bucket_name']
+    last_dates_key = f"{event['data_folder']}/{event['transform_folder']}/last_dates.json"
+    keys = [shard['Manifest'] for shard in event['shardresults'] if 'Manifest' in shard]
+
+    def read_manifest(key):
+        return json.loads(s3.get_object(Bucket = bucket_name, Key = key)['Body'].read())
+
+    with metrics.step('read'):
+        last_dates = read_last_dates(s3, bucket_name, last_dates_key)
+        with ThreadPoolExecutor(max_workers = MAX_WORKERS) as executor:
+            manifests = list(executor.map(read_manifest, keys))
+
+    with metrics.step('merge'):
+        result = merge(event['shardresults'], manifests)
+        for manifest in manifests:
+            for ticker, date in manifest['LastDates'].items():
+                last_dates[ticker] = max(date, last_dates.get(ticker, date))
+
+    with metrics.step('index'):
+        s3.put_object(Bucket = bucket_name, Key = last_dates_key, Body = json.dumps(last_dates, sort_keys = True))
+
+    metrics.count('Shards', len(event['shardresults']))
+    metrics.count('StoredFiles', len(result['Files']))
+
+    return(metrics.finish(result))
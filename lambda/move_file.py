@@ -1,41 +1,159 @@
-import boto3
+import os
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from clients import client
+from instrumentation import Metrics
 
-def lambda_handler(event, context):  
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 16))
+# objects above the threshold are copied in parts, a single copy_object is limited to 5 GB
+MULTIPART_THRESHOLD = int(os.environ.get('MULTIPART_THRESHOLD_MB', 1024)) * 2**20
+PART_SIZE = int(os.environ.get('PART_SIZE_MB', 512)) * 2**20
+# keys per delete_objects request, the S3 maximum
+DELETE_BATCH = 1000
 
+def source_objects(s3, bucket_name, event):
     '''
-    This function Moves the source dataset to archive or error folder
+    Returns the keys to move with their size when known, from the first of
+    keys - a manifest of keys, Files - the files written by the data collector,
+    prefix - every object under a prefix, file_name - a single file of the source location
     '''
-    
+    taskresult = event.get('taskresult', {})
+    if 'keys' in event:
+        return {key: None for key in event['keys']}
+    if 'Files' in taskresult:
+        return {key: None for key in taskresult['Files']}
+    if 'prefix' in event:
+        objects = {}
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket = bucket_name, Prefix = event['prefix']):
+            for obj in page.get('Contents', []):
+                objects[obj['Key']] = obj['Size']
+        return objects
+    return {taskresult['Location'] + "/" + event['file_name']: None}
+
+def copy(s3, bucket_name, key, target, size):
+    '''
+    Copies an object, in parts above the multipart threshold
+    returns False when the source no longer exists, e.g. it was moved by a previous attempt
+    '''
+    if size is None:
+        try:
+            size = s3.head_object(Bucket = bucket_name, Key = key)['ContentLength']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    source = {'Bucket': bucket_name, 'Key': key}
+    if size <= MULTIPART_THRESHOLD:
+        try:
+            s3.copy_object(Bucket = bucket_name, Key = target, CopySource = source)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return False
+            raise
+        return True
+
+    upload_id = s3.create_multipart_upload(Bucket = bucket_name, Key = target)['UploadId']
+    try:
+        parts = []
+        for number, start in enumerate(range(0, size, PART_SIZE), 1):
+            response = s3.upload_part_copy(
+                Bucket = bucket_name,
+                Key = target,
+                UploadId = upload_id,
+                PartNumber = number,
+                CopySource = source,
+                CopySourceRange = f'bytes={start}-{min(start + PART_SIZE, size) - 1}'
+            )
+            parts.append({'PartNumber': number, 'ETag': response['CopyPartResult']['ETag']})
+        s3.complete_multipart_upload(Bucket = bucket_name, Key = target, UploadId = upload_id, MultipartUpload = {'Parts': parts})
+    except Exception:
+        s3.abort_multipart_upload(Bucket = bucket_name, Key = target, UploadId = upload_id)
+        raise
+    return True
+
+def move(s3, bucket_name, moves, sizes, metrics):
+    '''
+    Copies the objects concurrently, then deletes the copied sources in batches
+    moves maps every source key to its target key
+    returns the moved, already moved and failed source keys
+    '''
+    def attempt(key):
+        try:
+            return key, copy(s3, bucket_name, key, moves[key], sizes.get(key)), None
+        except ClientError as e:
+            return key, False, str(e)
+
+    with metrics.step('copy'), ThreadPoolExecutor(max_workers = MAX_WORKERS) as executor:
+        outcomes = list(executor.map(attempt, moves))
+
+    copied = [key for key, done, _ in outcomes if done]
+    missing = [key for key, done, error in outcomes if not done and error is None]
+    failed = {key: error for key, _, error in outcomes if error is not None}
+
+    for start in range(0, len(copied), DELETE_BATCH):
+        with metrics.step('delete'):
+            response = s3.delete_objects(
+                Bucket = bucket_name,
+                Delete = {'Objects': [{'Key': key} for key in copied[start:start + DELETE_BATCH]], 'Quiet': True}
+            )
+        for error in response.get('Errors', []):
+            failed[error['Key']] = error.get('Message', error.get('Code'))
+
+    return [key for key in copied if key not in failed], missing, failed
+
+def lambda_handler(event, context):
+
+    '''
+    This function moves the source datasets to the archive or error folder
+    keys keep their path below the source location, so partitions are kept
+    a retried move skips the sources that were already moved
+    '''
+
     result = {}
+    metrics = Metrics('move_file')
 
-    s3_resource = boto3.resource('s3')
+    s3 = client('s3')
     bucket_name = event['bucket_name']
 
-    source_location = event['taskresult']['Location']
-    base_folder = source_location.split("/")[0]
-
     # check for failure
     if "error-info" in event:
         status = "FAILURE"
+    elif "status" in event:
+        status = event['status']
     else:
         status = event['taskresult']['Validation']
 
-    file_name = event['file_name']
-    key_name = source_location + "/" + file_name
-
     # move to error if failure and archive for success
     if status == "FAILURE":
         end_folder = event['error_folder']
     elif status == "SUCCESS":
         end_folder = event['archive_folder']
 
-    source_file_name_to_copy = bucket_name + "/" + source_location + "/" + file_name
-    move_file_name = base_folder + "/" + end_folder + "/" + file_name
-    
-    s3_resource.Object(bucket_name, move_file_name).copy_from(CopySource = source_file_name_to_copy)
-    s3_resource.Object(bucket_name, key_name).delete()
-    
+    source_location = event.get('source_location') or event.get('taskresult', {}).get('Location')
+    if not source_location:
+        # the run failed before writing any file
+        result['Status'] = status
+        result['Moved'] = 0
+        result['msg'] = "No files to move"
+        return(metrics.finish(result))
+    base_folder = source_location.split("/")[0]
+
+    target_location = base_folder + "/" + end_folder
+    with metrics.step('list'):
+        sizes = source_objects(s3, bucket_name, event)
+    outside = [key for key in sizes if not key.startswith(source_location + "/")]
+    if outside:
+        raise ValueError(f"{len(outside)} keys are outside of {source_location}, e.g. {outside[0]}")
+    moves = {key: target_location + key[len(source_location):] for key in sizes}
+
+    moved, missing, failed = move(s3, bucket_name, moves, sizes, metrics)
+    metrics.count('MovedFiles', len(moved))
+
     result['Status'] = status
-    result['msg'] = f"File moved to {move_file_name}"
+    result['Moved'] = len(moved)
+    result['AlreadyMoved'] = len(missing)
+    result['Failed'] = failed
+    result['msg'] = f"{len(moved)} files moved to {target_location}"
 
-    return(result)
\ No newline at end of file
+    return(metrics.finish(result))
@@ -0,0 +1,131 @@
+'''
+Schema and serialization of the raw ticker, price and dividend data written by the collectors
+'''
+
+from io import BytesIO, StringIO
+import pandas as pd
+from s3_stream import S3MultipartWriter, MIN_PART_SIZE
+
+RAW_DATA_COLUMNS = ['Date', 'Ticker', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume', 'Dividends', 'Stock Splits']
+
+# parquet column names match the Glue catalog, which lower cases them, without spaces
+PARQUET_COLUMNS = {column: column.lower().replace(' ', '_') for column in RAW_DATA_COLUMNS}
+
+PARTITION_COLUMN = 'year'
+
+# the ticker file always has these columns in this order, matching the declared ticker table
+TICKER_COLUMNS = [
+    'Symbol', 'Security', 'GICS Sector', 'GICS Sub-Industry', 'Headquarters Location',
+    'Date added', 'CIK', 'Founded', 'updatedAt'
+]
+
+
+def conform(data):
+    '''
+    Orders and types the columns of a yfinance frame to the raw data schema
+    '''
+    data = data.reindex(columns=RAW_DATA_COLUMNS)
+    dates = pd.to_datetime(data['Date'])
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    return data.assign(
+        Date=dates,
+        Ticker=data['Ticker'].astype(str),
+        **{column: data[column].astype('float64') for column in RAW_DATA_COLUMNS[2:]}
+    )
+
+
+def to_csv(data):
+    csv_buffer = StringIO()
+    data.to_csv(csv_buffer, index=False)
+    return csv_buffer.getvalue()
+
+
+def write_csv(frames, sink, chunk_rows=50000):
+    '''
+    Streams frames to a binary sink as a single csv, chunk_rows rows at a time
+    '''
+    header = True
+    for frame in frames:
+        frame = conform(frame)
+        for start in range(0, len(frame), chunk_rows):
+            sink.write(frame.iloc[start:start + chunk_rows].to_csv(index=False, header=header).encode('utf-8'))
+            header = False
+    if header:
+        sink.write((','.join(RAW_DATA_COLUMNS) + '\n').encode('utf-8'))
+
+
+def save_df_to_s3(s3, frames, bucket_name, key, part_size=MIN_PART_SIZE):
+    '''
+    Streams the frames to a single csv file through a multipart upload
+    returns the size of the file
+    '''
+    with S3MultipartWriter(s3, bucket_name, key, part_size=part_size) as sink:
+        write_csv(frames, sink)
+    return sink.tell()
+
+
+def parquet_schema():
+    '''
+    Dates are stored in microseconds, Spark 3.1 (Glue 3.0) can not read nanosecond timestamps
+    '''
+    import pyarrow as pa
+
+    return pa.schema(
+        [(PARQUET_COLUMNS['Date'], pa.timestamp('us')), (PARQUET_COLUMNS['Ticker'], pa.string())]
+        + [(PARQUET_COLUMNS[column], pa.float64()) for column in RAW_DATA_COLUMNS[2:]]
+    )
+
+
+class ParquetPartitionWriter:
+    '''
+    Streams frames into one parquet file per year partition
+    the rows of a frame in a partition are written at once as a row group (split beyond
+    row_group_rows), nothing is buffered between frames apart from the compressed bytes the
+    sinks hold until they upload a part
+    open_sink - callable open_sink(partition) returning the binary sink of a partition
+    '''
+
+    def __init__(self, open_sink, row_group_rows=100000):
+        self.open_sink = open_sink
+        self.row_group_rows = row_group_rows
+        self.schema = parquet_schema()
+        self.writers = {}
+
+    def write(self, frame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        years = pd.to_datetime(frame['Date']).dt.year
+        for year, rows in frame.groupby(years.to_numpy(), sort=True):
+            partition = f'{PARTITION_COLUMN}={year}'
+            table = pa.Table.from_pandas(conform(rows).rename(columns=PARQUET_COLUMNS), schema=self.schema, preserve_index=False)
+            if partition not in self.writers:
+                self.writers[partition] = pq.ParquetWriter(self.open_sink(partition), self.schema, compression='snappy')
+            self.writers[partition].write_table(table, row_group_size=self.row_group_rows)
+
+    def close(self):
+        '''
+        Closes the files and returns the written partitions
+        '''
+        for writer in self.writers.values():
+            writer.close()
+        return sorted(self.writers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+def to_parquet_partitions(data):
+    '''
+    Serializes the data into one parquet file per year, sorted by ticker and date
+    returns a dict of partition path (year=YYYY) to file content
+    '''
+    buffers = {}
+    with ParquetPartitionWriter(lambda partition: buffers.setdefault(partition, BytesIO())) as writer:
+        writer.write(conform(data).sort_values(['Ticker', 'Date'], kind='mergesort'))
+    return {partition: buffers[partition].getvalue() for partition in sorted(buffers)}
@@ -1,54 +1,423 @@
 import json
-import boto3
 import os
+import time
+import gzip
+import base64
+import bisect
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from clients import client
+from history_store import HistoryStore
+from analysis_versions import chain, compose, keys, read_document
+from analysis_rollups import GROUPS, METRICS as RANKED_METRICS, rollups
+from instrumentation import Metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# seconds a cached object is served before its ETag is revalidated with S3
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 60))
+# filtered responses kept per object version
+MAX_CACHED_RESPONSES = int(os.environ.get('MAX_CACHED_RESPONSES', 128))
+# versions a ?since= request is composed from, a client further behind gets the full summary
+MAX_DELTA_VERSIONS = int(os.environ.get('MAX_DELTA_VERSIONS', 30))
+# upper bound of the history files mapped from /tmp
+HISTORY_CACHE_BYTES = int(os.environ.get('HISTORY_CACHE_MB', 256)) * 2**20
+
+METRICS = ['consecutiveGrowthYears', 'dividendFrequency', 'beta', 'fiveYearCAGR', 'lastDividend', 'lastPrice']
+
+HEADERS = {
+    "Access-Control-Allow-Headers" : "Content-Type",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET"
+}
+
+# object key -> cached version of the object
+cache = {}
+# per-ticker history store, created by the first history request
+history = None
+
+
+class CachedObject:
+    '''
+    One version of an analysis file with its serialized bodies and filter indexes
+    only the summary document has companies to filter, a ticker document is served whole
+    '''
+
+    def __init__(self, etag, content):
+        self.etag = etag
+        self.checked_at = time.monotonic()
+        self.document = json.loads(content)
+        self.responses = {}
+        # rollups of the summary, read once per version
+        self.rollups = None
+
+        summary = self.document[0] if isinstance(self.document, list) and self.document else {}
+        self.companies = summary.get('companies', [])
+        self.by_ticker = {company['ticker']: position for position, company in enumerate(self.companies)}
+        self.by_field = {'sector': {}, 'industry': {}}
+        for position, company in enumerate(self.companies):
+            for field, index in self.by_field.items():
+                index.setdefault(company.get(field), []).append(position)
+
+        # metric values sorted ascending with the matching company positions, for range lookups
+        self.by_metric = {}
+        for metric in METRICS:
+            pairs = sorted((company[metric], position) for position, company in enumerate(self.companies) if company.get(metric) is not None)
+            self.by_metric[metric] = ([value for value, _ in pairs], [position for _, position in pairs])
+
+    def select(self, query):
+        '''
+        Returns the positions of the companies matching every filter of the query
+        '''
+        selected = None
+
+        def narrow(positions):
+            nonlocal selected
+            selected = set(positions) if selected is None else selected & set(positions)
+
+        if 'ticker' in query:
+            narrow(self.by_ticker[ticker] for ticker in query['ticker'].split(',') if ticker in self.by_ticker)
+        for field, index in self.by_field.items():
+            if field in query:
+                narrow(position for value in query[field].split(',') for position in index.get(value, []))
+        for metric, (values, positions) in self.by_metric.items():
+            low, high = query.get(f'min_{metric}'), query.get(f'max_{metric}')
+            if low is not None or high is not None:
+                start = bisect.bisect_left(values, float(low)) if low is not None else 0
+                end = bisect.bisect_right(values, float(high)) if high is not None else len(values)
+                narrow(positions[start:end])
+
+        return range(len(self.companies)) if selected is None else sorted(selected)
+
+    def response(self, query):
+        '''
+        Returns the serialized body and ETag of the query, built once per object version
+        '''
+        key = tuple(sorted(query.items()))
+        if key not in self.responses:
+            if not query or not isinstance(self.document, list):
+                document = self.document
+                etag = self.etag
+            else:
+                summary = dict(self.document[0]) if self.document else {}
+                summary['companies'] = [self.companies[position] for position in self.select(query)]
+                document = [summary]
+                etag = f'{self.etag}-{hashlib.md5(repr(key).encode("utf-8")).hexdigest()[:12]}'
+            self.store(key, {'body': json.dumps(document).encode('utf-8'), 'etag': etag, 'encoded': {}})
+        return self.responses[key]
+
+    def delta(self, bucket_name, since):
+        '''
+        Returns the serialized changes from the `since` version to this summary, built once per
+        object version and `since`
+        the deltas of the versions in between are composed into one, the full summary is returned
+        when `since` is unknown or more than MAX_DELTA_VERSIONS versions behind
+        '''
+        key = ('since', since)
+        if key not in self.responses:
+            summary = self.document[0] if isinstance(self.document, list) and self.document else {}
+            latest = summary.get('version')
+            # the versions are stored next to the summary
+            paths = keys(os.path.dirname(os.environ['OBJECT_KEY']))
+            versions = None
+            if latest == since:
+                versions = []
+            elif latest:
+                versions = chain(read_document(client('s3'), bucket_name, paths['index']) or {}, since, latest, MAX_DELTA_VERSIONS)
+            deltas = None
+            if versions is not None:
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    deltas = list(executor.map(lambda version: read_document(client('s3'), bucket_name, paths['delta'].format(version=version)), versions))
+            if deltas is None or None in deltas:
+                response = self.response({})
+            else:
+                document = compose(deltas)
+                document.update({'version': latest, 'previous': since, 'lastUpdated': summary.get('lastUpdated')})
+                response = self.serialize(key, document)
+            self.store(key, response)
+        return self.responses[key]
+
+    def serialize(self, key, document):
+        '''
+        Returns the compact body of a derived document, with an ETag of this version and the key
+        '''
+        return {
+            'body': json.dumps(document, separators=(',', ':')).encode('utf-8'),
+            'etag': f'{self.etag}-{hashlib.md5(repr(key).encode("utf-8")).hexdigest()[:12]}',
+            'encoded': {}
+        }
+
+    def store(self, key, response):
+        '''
+        Caches the response of a key, the oldest response is dropped beyond MAX_CACHED_RESPONSES
+        '''
+        if len(self.responses) >= MAX_CACHED_RESPONSES:
+            self.responses.pop(next(iter(self.responses)))
+        self.responses[key] = response
+        return response
+
+    def rollup_document(self, bucket_name):
+        '''
+        Returns the rollups the analysis job stored for this summary's version, or computes them
+        from the summary while the stored rollups are of another version
+        '''
+        if self.rollups is None:
+            summary = self.document[0] if isinstance(self.document, list) and self.document else {}
+            try:
+                stored = load(bucket_name, os.environ['ROLLUPS_KEY']).document
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise
+                stored = None
+            if stored and stored.get('version') == summary.get('version'):
+                self.rollups = stored
+            else:
+                self.rollups = rollups(summary)
+        return self.rollups
+
+    def group_rollups(self, bucket_name, query):
+        '''
+        Returns the serialized statistics of the groups of the query, every group by default
+        by is sector, industry or all and name a comma separated list of the group names
+        '''
+        key = ('rollups',) + tuple(sorted(query.items()))
+        if key not in self.responses:
+            document = self.rollup_document(bucket_name)
+            groups = document['groups']
+            if query.get('by'):
+                if query['by'] not in groups:
+                    raise ValueError(f"by must be one of {', '.join(groups)}")
+                groups = {query['by']: groups[query['by']]}
+            if query.get('name'):
+                names = query['name'].split(',')
+                groups = {group: {name: values[name] for name in names if name in values} for group, values in groups.items()}
+            self.store(key, self.serialize(key, {
+                'version': document['version'],
+                'lastUpdated': document['lastUpdated'],
+                'metrics': document['metrics'],
+                'groups': groups
+            }))
+        return self.responses[key]
+
+    def top(self, bucket_name, query):
+        '''
+        Returns the serialized k companies of a group with the highest (or lowest with order=lowest)
+        value of a metric, read from the precomputed rankings, every company by default
+        the group is given as sector=<name> or industry=<name>
+        '''
+        key = ('top',) + tuple(sorted(query.items()))
+        if key not in self.responses:
+            document = self.rollup_document(bucket_name)
+            metric = query.get('metric')
+            if metric not in RANKED_METRICS:
+                raise ValueError(f"metric must be one of {', '.join(RANKED_METRICS)}")
+            order = query.get('order', 'highest')
+            if order not in ('highest', 'lowest'):
+                raise ValueError('order must be highest or lowest')
+            k = int(query.get('k', document['topK']))
+            if not 0 < k <= document['topK']:
+                raise ValueError(f"k must be between 1 and {document['topK']}")
+            groups = [group for group in GROUPS if query.get(group)]
+            if len(groups) > 1:
+                raise ValueError('rank within a single group')
+            group, name = (groups[0], query[groups[0]]) if groups else ('all', 'all')
+
+            ranking = document['top'][group].get(name, {}).get(metric, {}).get(order, [])
+            self.store(key, self.serialize(key, {
+                'version': document['version'],
+                'metric': metric,
+                'order': order,
+                'group': group,
+                'name': name,
+                'companies': [self.companies[self.by_ticker[ticker]] for ticker in ranking[:k] if ticker in self.by_ticker]
+            }))
+        return self.responses[key]
+
+    def valuation(self, query):
+        '''
+        Returns the serialized fair value sweep of the query's assumptions, built once per object
+        version and assumption set
+        growth, risk_free and market_return are grids of rates, the companies can be filtered as in response
+        '''
+        from valuation import parse_grid, sweep
+
+        key = ('valuation',) + tuple(sorted(query.items()))
+        if key not in self.responses:
+            grids = {name: parse_grid(query[name]) for name in ('growth', 'risk_free', 'market_return') if query.get(name)}
+            summary = self.document[0] if isinstance(self.document, list) and self.document else {}
+            document = sweep(
+                [self.companies[position] for position in self.select(query)],
+                summary.get('benchmarks', []),
+                growth=grids.get('growth'),
+                risk_free=grids.get('risk_free'),
+                market_return=grids.get('market_return')
+            )
+            self.store(key, self.serialize(key, document))
+        return self.responses[key]
+
+
+def load(bucket_name, object_key):
+    '''
+    Returns the cached object, revalidating its ETag with a conditional get once the TTL expires
+    '''
+    cached = cache.get(object_key)
+    if cached and time.monotonic() - cached.checked_at < CACHE_TTL:
+        return cached
+
+    try:
+        if cached:
+            response = client('s3').get_object(Bucket=bucket_name, Key=object_key, IfNoneMatch=cached.etag)
+        else:
+            response = client('s3').get_object(Bucket=bucket_name, Key=object_key)
+    except ClientError as e:
+        if cached and e.response['Error']['Code'] in ('304', 'NotModified'):
+            cached.checked_at = time.monotonic()
+            return cached
+        raise
+
+    cache[object_key] = CachedObject(response['ETag'].strip('"'), response['Body'].read())
+    return cache[object_key]
+
+
+def history_response(bucket_name, ticker, query):
+    '''
+    Returns the prices and dividends of the ticker dated in [start, end) as columns
+    '''
+    global history
+    if history is None:
+        history = HistoryStore(client('s3'), bucket_name, os.environ['HISTORY_PREFIX'], ttl=CACHE_TTL, max_bytes=HISTORY_CACHE_BYTES)
+
+    records = history.range(ticker, query.get('start'), query.get('end'))
+    if query.get('dividends') == 'true':
+        records = records[records['dividends'] > 0]
+    body = json.dumps({
+        'ticker': ticker,
+        'date': records['date'].astype(str).tolist(),
+        'adj close': records['adj close'].tolist(),
+        'dividends': records['dividends'].tolist()
+    }).encode('utf-8')
+    return {'body': body, 'etag': hashlib.md5(body).hexdigest(), 'encoded': {}}
+
+
+def encode(response, accept_encoding):
+    '''
+    Returns the body compressed with the preferred encoding the client accepts
+    '''
+    accepted = [value.split(';')[0].strip() for value in accept_encoding.split(',')]
+    for encoding in ('br', 'gzip'):
+        if encoding not in accepted or (encoding == 'br' and brotli is None):
+            continue
+        if encoding not in response['encoded']:
+            if encoding == 'br':
+                response['encoded'][encoding] = brotli.compress(response['body'])
+            else:
+                response['encoded'][encoding] = gzip.compress(response['body'])
+        return encoding, response['encoded'][encoding]
+    return None, response['body']
+
+
+def server_timing(metrics):
+    '''
+    Emits the metrics of the request and returns them as a Server-Timing header
+    '''
+    report = metrics.report()
+    metrics.emit(report)
+    return ', '.join(f"{name};dur={step['ms']}" for name, step in report['Steps'].items())
 
-s3 = boto3.client('s3')
 
 def lambda_handler(event, context):
 
+    metrics = Metrics('read_s3')
+
     try:
 
         bucket_name = os.environ['BUCKET_NAME']
-        object_key = os.environ['OBJECT_KEY']
+        # /data serves the summary of every company, /data/{ticker} the details of one company
+        # /data/{ticker}/history its prices and dividends over any range and /data/valuation the
+        # fair values of the companies over a grid of assumptions, /data?since=<version> the changes
+        # of the summary since a version, /data/rollups the statistics of every sector and industry
+        # and /data/top the companies of a group ranked by a metric
+        ticker = (event.get('pathParameters') or {}).get('ticker')
+        query = event.get('queryStringParameters') or {}
+        request_headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+        resource = event.get('resource') or event.get('path') or ''
+
+        # a warm request only serves the cached body, a cold one reads and parses the object
+        with metrics.step('read'):
+            if ticker and resource.endswith('/history'):
+                response = history_response(bucket_name, ticker.upper(), query)
+            elif not ticker and resource.endswith('/valuation'):
+                response = load(bucket_name, os.environ['OBJECT_KEY']).valuation(query)
+            elif not ticker and resource.endswith('/rollups'):
+                response = load(bucket_name, os.environ['OBJECT_KEY']).group_rollups(bucket_name, query)
+            elif not ticker and resource.endswith('/top'):
+                response = load(bucket_name, os.environ['OBJECT_KEY']).top(bucket_name, query)
+            elif not ticker and 'since' in query:
+                if len(query) > 1:
+                    raise ValueError('since can not be combined with filters')
+                response = load(bucket_name, os.environ['OBJECT_KEY']).delta(bucket_name, query['since'])
+            else:
+                if ticker:
+                    object_key = f"{os.environ['TICKER_PREFIX']}/{ticker.upper()}.json"
+                else:
+                    object_key = os.environ['OBJECT_KEY']
+                response = load(bucket_name, object_key).response(query)
 
-        s3.head_object(Bucket=bucket_name, Key=object_key)
+        headers = dict(HEADERS, **{'Content-Type': 'application/json', 'ETag': f'"{response["etag"]}"', 'Vary': 'Accept-Encoding'})
 
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        json_content = json.loads(response['Body'].read())
+        if request_headers.get('if-none-match', '').strip('"') == response['etag']:
+            headers['Server-Timing'] = server_timing(metrics)
+            return {
+                'statusCode': 304,
+                'headers': headers,
+                'body': ''
+            }
+
+        with metrics.step('compress'):
+            encoding, body = encode(response, request_headers.get('accept-encoding', ''))
+        metrics.count('ResponseBytes', len(body))
+        headers['Server-Timing'] = server_timing(metrics)
+        if encoding is None:
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': body.decode('utf-8')
+            }
 
+        headers['Content-Encoding'] = encoding
         return {
             'statusCode': 200,
-            'headers': {
-                "Access-Control-Allow-Headers" : "Content-Type",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET"
-            },
-            'body': json.dumps(json_content)
+            'headers': headers,
+            'isBase64Encoded': True,
+            'body': base64.b64encode(body).decode('ascii')
         }
-    
+
+    except ValueError as e:
+
+        return {
+            'statusCode': 400,
+            'headers': HEADERS,
+            'body': f'Invalid query: {str(e)}'
+        }
+
     except ClientError as e:
 
-        if e.response['Error']['Code'] == '404':
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
 
             return {
                 'statusCode': 404,
-                'headers': {
-                    "Access-Control-Allow-Headers" : "Content-Type",
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "GET"
-                },
+                'headers': HEADERS,
                 'body': 'No data'
             }
-        
+
         else:
 
             return {
                 'statusCode': 500,
-                'headers': {
-                    "Access-Control-Allow-Headers" : "Content-Type",
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "GET"
-                },
+                'headers': HEADERS,
                 'body': f'Error: {str(e)}'
             }
@@ -0,0 +1,78 @@
+import os
+from clients import client
+from instrumentation import Metrics
+
+# batch_create_partition and batch_get_partition limits
+CREATE_BATCH_SIZE = 100
+GET_BATCH_SIZE = 1000
+
+
+def partition_values(keys):
+    '''
+    Returns the distinct partition values of the stored files, e.g. data/raw/year=2024/x.parquet
+    '''
+    values = set()
+    for key in keys:
+        parts = [part.split('=', 1)[1] for part in key.split('/')[:-1] if '=' in part]
+        if parts:
+            values.add(tuple(parts))
+    return sorted(values)
+
+
+def existing_partitions(glue, database, table, values):
+    existing = set()
+    for start in range(0, len(values), GET_BATCH_SIZE):
+        response = glue.batch_get_partition(
+            DatabaseName=database,
+            TableName=table,
+            PartitionsToGet=[{'Values': list(value)} for value in values[start:start + GET_BATCH_SIZE]]
+        )
+        existing.update(tuple(partition['Values']) for partition in response['Partitions'])
+    return existing
+
+
+def lambda_handler(event, context):
+    '''
+    This function registers the partitions of the files stored by the data collector
+    against the declared data table, so the data crawler does not have to run
+    it expects the 'Files' key of the data collector result in event['taskresult']
+    unpartitioned (csv) tables read every file under their location and need no registration
+    '''
+
+    result = {}
+    metrics = Metrics('register_partitions')
+
+    glue = client('glue')
+
+    database = os.environ['GLUE_DATABASE']
+    table_name = os.environ['TABLE_NAME']
+
+    with metrics.step('read'):
+        table = glue.get_table(DatabaseName=database, Name=table_name)['Table']
+    storage = table['StorageDescriptor']
+    partition_keys = [key['Name'] for key in table.get('PartitionKeys', [])]
+
+    values = partition_values(event['taskresult'].get('Files', [])) if partition_keys else []
+    with metrics.step('lookup'):
+        missing = sorted(set(values) - existing_partitions(glue, database, table_name, values)) if values else []
+    metrics.count('Partitions', len(values))
+    metrics.count('RegisteredPartitions', len(missing))
+
+    for start in range(0, len(missing), CREATE_BATCH_SIZE):
+        partitions = []
+        for value in missing[start:start + CREATE_BATCH_SIZE]:
+            location = storage['Location'].rstrip('/') + '/' + '/'.join(f'{name}={part}' for name, part in zip(partition_keys, value)) + '/'
+            partitions.append({'Values': list(value), 'StorageDescriptor': dict(storage, Location=location)})
+
+        with metrics.step('register'):
+            response = glue.batch_create_partition(DatabaseName=database, TableName=table_name, PartitionInputList=partitions)
+        # a concurrent run may have registered the same partition
+        errors = [error for error in response.get('Errors', []) if error['ErrorDetail']['ErrorCode'] != 'AlreadyExistsException']
+        if errors:
+            raise RuntimeError(f"Partition registration failed: {errors[0]['ErrorDetail']['ErrorMessage']}")
+
+    result['Table'] = table_name
+    result['Registered'] = ['/'.join(value) for value in missing]
+    result['Validation'] = 'SUCCESS'
+
+    return metrics.finish(result)
@@ -1,5 +1,6 @@
-import boto3
 import cfnresponse
+from clients import client
+from instrumentation import Metrics
 
 def handler(event, context):
     # Init ...
@@ -8,8 +9,7 @@ def handler(event, context):
     '''
 
     response_data = {}
-
-    s3_resource = boto3.resource('s3')
+    metrics = Metrics('s3_objects')
 
     the_bucket = event['ResourceProperties']['the_bucket']
     file_content = event['ResourceProperties']['file_content']
@@ -17,7 +17,10 @@ def handler(event, context):
 
     try:
         if event['RequestType'] in ('Create', 'Update'):
-            s3_resource.Object(the_bucket, file_prefix).put(Body = file_content)
+            with metrics.step('upload'):
+                client('s3').put_object(Bucket = the_bucket, Key = file_prefix, Body = file_content)
+            metrics.count('UploadedBytes', len(file_content.encode('utf-8')))
+            metrics.finish()
 
         cfnresponse.send(event,
                          context,
@@ -0,0 +1,135 @@
+'''
+File-like sink that streams writes to S3 through a multipart upload with a bounded buffer
+'''
+
+import io
+import tempfile
+
+# S3 rejects multipart parts smaller than 5 MB, except for the last one
+MIN_PART_SIZE = 5 * 2**20
+
+
+class S3MultipartWriter(io.RawIOBase):
+    '''
+    Buffers writes up to part_size and uploads every full buffer as a part
+    objects smaller than one part are written with a single put_object
+    a spilled writer keeps its buffer in a temporary file instead of memory
+    '''
+
+    def __init__(self, client, bucket_name, key, part_size=MIN_PART_SIZE):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.buffer = bytearray()
+        self.spill_file = None
+        self.spilled = 0
+        self.position = 0
+        self.upload_id = None
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        data = bytes(data) if not isinstance(data, str) else data.encode('utf-8')
+        self.position += len(data)
+        if self.spill_file is not None:
+            self.spill_file.write(data)
+            self.spilled += len(data)
+            if self.spilled >= self.part_size:
+                self._upload_part(self._take_spilled())
+            return len(data)
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def buffered(self):
+        '''
+        Bytes held in memory until the next part
+        '''
+        return len(self.buffer)
+
+    def spill(self):
+        '''
+        Moves the buffer to a temporary file, later writes are buffered there too
+        '''
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile()
+        self.spill_file.write(self.buffer)
+        self.spilled += len(self.buffer)
+        self.buffer = bytearray()
+
+    def _take_spilled(self):
+        self.spill_file.seek(0)
+        body = self.spill_file.read()
+        self.spill_file.seek(0)
+        self.spill_file.truncate()
+        self.spilled = 0
+        return body
+
+    def _remaining(self):
+        return self._take_spilled() if self.spill_file is not None else bytes(self.buffer)
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=self.key)['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=body
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self):
+        if self.closed:
+            return
+        body = self._remaining()
+        if self.upload_id is None:
+            self.client.put_object(Bucket=self.bucket_name, Key=self.key, Body=body)
+        else:
+            if body:
+                self._upload_part(body)
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts}
+            )
+        self._release()
+        super().close()
+
+    def _release(self):
+        self.buffer = bytearray()
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def abort(self):
+        '''
+        Drops the written data, nothing is stored under the key
+        '''
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+        self._release()
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def bound_buffers(sinks, max_bytes):
+    '''
+    Spills the largest in-memory buffers until the sinks together hold at most max_bytes
+    many small files, like the year partitions of a parquet batch, each stay below a part
+    '''
+    held = sum(sink.buffered() for sink in sinks)
+    for sink in sorted(sinks, key=lambda sink: sink.buffered(), reverse=True):
+        if held <= max_bytes:
+            break
+        held -= sink.buffered()
+        sink.spill()
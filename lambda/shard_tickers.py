@@ -0,0 +1,104 @@
+import os
+import json
+import heapq
+import math
+from datetime import datetime, timedelta
+from clients import client
+from instrumentation import Metrics
+from last_dates import read_last_dates
+
+# rows a shard is sized for, so every collector invocation ends well within its timeout
+SHARD_ROWS = int(os.environ.get('SHARD_ROWS', 1000000))
+# upper bound of the shards of a run, the step function runs at most MAX_CONCURRENCY of them at a time
+MAX_SHARDS = int(os.environ.get('MAX_SHARDS', 40))
+# expected rows of a ticker without stored data, whose whole history is downloaded
+BACKFILL_ROWS = int(os.environ.get('BACKFILL_ROWS', 252 * 30))
+# fixed cost of every ticker, in rows, for its request and its share of the batch writes
+TICKER_ROWS = int(os.environ.get('TICKER_ROWS', 250))
+
+def weekdays(start, end):
+    '''
+    Number of weekdays from start up to end, the range the collector downloads
+    '''
+    days = (end - start).days
+    if days <= 0:
+        return 0
+    weeks, rest = divmod(days, 7)
+    return weeks * 5 + sum((start + timedelta(days=day)).weekday() < 5 for day in range(rest))
+
+def expected_rows(tickers, last_dates, today):
+    '''
+    Expected rows of every ticker, the missing weekdays since its last stored date or a whole history
+    '''
+    rows = {}
+    for ticker in tickers:
+        if ticker in last_dates:
+            start = datetime.strptime(last_dates[ticker], '%Y-%m-%d') + timedelta(days=1)
+            rows[ticker] = weekdays(start, today)
+        else:
+            rows[ticker] = BACKFILL_ROWS
+    return rows
+
+def balance(weights, shards):
+    '''
+    Splits the tickers into shards of about the same weight, the heaviest ticker first into the lightest shard
+    returns the tickers and the weight of every shard
+    '''
+    heap = [(0, shard) for shard in range(shards)]
+    members = [[] for _ in range(shards)]
+    for ticker, weight in sorted(weights.items(), key = lambda item: (-item[1], item[0])):
+        load, shard = heapq.heappop(heap)
+        members[shard].append(ticker)
+        heapq.heappush(heap, (load + weight, shard))
+    loads = [0] * shards
+    for load, shard in heap:
+        loads[shard] = load
+    return members, loads
+
+def lambda_handler(event, context):
+
+    '''
+    This function splits the tickers of a run into shards of about the same expected history size,
+    which the step function collects in parallel
+    the input of every shard is written next to data_input.json, with the same New_Tickers and Old_Tickers
+    '''
+
+    result = {}
+    metrics = Metrics('shard_tickers')
+
+    s3 = client('s3')
+    bucket_name = event['bucket_name']
+    ticker_location = f"{event['ticker_folder']}/{event['transform_folder']}"
+
+    with metrics.step('read'):
+        response = s3.get_object(Bucket = bucket_name, Key = f"{ticker_location}/data_input.json")
+        json_data = json.loads(response['Body'].read().decode('utf-8'))
+        last_dates = read_last_dates(s3, bucket_name, f"{event['data_folder']}/{event['transform_folder']}/last_dates.json")
+
+    new_tickers = set(json_data.get('New_Tickers', []))
+    old_tickers = set(json_data.get('Old_Tickers', []))
+    today = datetime.today()
+
+    with metrics.step('balance'):
+        rows = expected_rows(new_tickers | old_tickers, last_dates, datetime(today.year, today.month, today.day))
+        weights = {ticker: count + TICKER_ROWS for ticker, count in rows.items()}
+        shards = max(1, min(MAX_SHARDS, len(weights), math.ceil(sum(weights.values()) / SHARD_ROWS)))
+        members, loads = balance(weights, shards)
+
+    file_name = event['file_name'].split('.')[0]
+    result['Shards'] = []
+    with metrics.step('upload'):
+        for shard, tickers in enumerate(members):
+            key = f"{ticker_location}/shards/{file_name}/shard-{shard}.json"
+            s3.put_object(Bucket = bucket_name, Key = key, Body = json.dumps({
+                'New_Tickers': sorted(ticker for ticker in tickers if ticker in new_tickers),
+                'Old_Tickers': sorted(ticker for ticker in tickers if ticker in old_tickers)
+            }))
+            result['Shards'].append({'index': shard, 'key': key, 'tickers': len(tickers), 'rows': loads[shard]})
+
+    metrics.count('Shards', shards)
+    metrics.count('ExpectedRows', sum(rows.values()))
+    result['ExpectedRows'] = sum(rows.values())
+    result['Validation'] = 'SUCCESS'
+
+    return(metrics.finish(result))
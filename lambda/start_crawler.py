@@ -1,4 +1,5 @@
-import boto3
+from clients import client
+from instrumentation import Metrics
 
 def lambda_handler(event, context):
 
@@ -7,12 +8,13 @@ def lambda_handler(event, context):
     it expects 'Crawler_name' key in the event object passed in the function
     '''
 
+    metrics = Metrics('start_crawler')
     crawler_name = event['Crawler_Name']
     
-    client = boto3.client('glue')    
-    client.start_crawler(Name=crawler_name)
+    with metrics.step('start'):
+        client('glue').start_crawler(Name=crawler_name)
 
     result = {}
     result['crawler_name'] = crawler_name
     
-    return(result)
\ No newline at end of file
+    return(metrics.finish(result))
\ No newline at end of file
@@ -1,7 +1,7 @@
 import json
-import boto3
+from clients import client
+from instrumentation import Metrics
 import os
-from datetime import datetime
 
 def lambda_handler(event, context):
 
@@ -9,6 +9,8 @@ def lambda_handler(event, context):
     This function start AWS Step Functions
     '''
 
+    metrics = Metrics('start_step_function')
+
     bucket_name = event["Records"][0]['s3']['bucket']['name'] 
     bucket_arn = event["Records"][0]['s3']['bucket']['arn']
     key_name = event["Records"][0]['s3']['object']['key']
@@ -23,8 +25,13 @@ def lambda_handler(event, context):
     step_function_input['transform_folder'] = os.environ['TRANSFORM_FOLDER']
     step_function_input['data_folder'] = os.environ['DATA_FOLDER']
     step_function_input['ticker_folder'] = os.environ['TICKER_FOLDER']
+    # declared - register files against the declared tables, crawler - discover the schema with the crawlers
+    step_function_input['catalog_mode'] = os.environ.get('CATALOG_MODE', 'declared')
     step_function_input['key_name'] = key_name
     step_function_input['file_name'] = file_name
 
-    client = boto3.client('stepfunctions')
-    client.start_execution(stateMachineArn = os.environ['STEP_FUNC_ARN'], input = json.dumps(step_function_input))
\ No newline at end of file
+    with metrics.step('start'):
+        client('stepfunctions').start_execution(stateMachineArn = os.environ['STEP_FUNC_ARN'], input = json.dumps(step_function_input))
+
+    # the S3 notification discards the result, the metrics only go to the log
+    metrics.finish()
\ No newline at end of file
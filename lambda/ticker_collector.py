@@ -1,25 +1,122 @@
 import json
-import pandas as pd
-from datetime import datetime
-import awswrangler as wr
+from datetime import datetime, date
+from clients import client
+from instrumentation import Metrics
+from market_calendar import sessions, session_date
+from detect_changes import read_json, refresh_last_updated
 import os
 
+# skip the run, and so the step function, when no session closed since the last stored data
+SKIP_CLOSED_DAYS = os.environ.get('SKIP_CLOSED_DAYS', 'true').lower() == 'true'
+# the S&P 500 index is collected on every run, its last stored date is the last collected session
+CALENDAR_SYMBOL = '^GSPC'
+
+# the constituent table of every universe, with the columns renamed to the ticker columns
+# the Russell 3000 has no maintained public list, its constituents are the holdings of the iShares
+# Russell 3000 ETF (IWV), any other universe can be given as csv:<url> of a file with a Symbol column
+UNIVERSES = {
+    'sp500': ('html', 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies', {}),
+    'sp400': ('html', 'https://en.wikipedia.org/wiki/List_of_S%26P_400_companies', {}),
+    'sp600': ('html', 'https://en.wikipedia.org/wiki/List_of_S%26P_600_companies', {}),
+    'russell1000': ('html', 'https://en.wikipedia.org/wiki/Russell_1000_Index', {'Company': 'Security'}),
+    'russell3000': (
+        'ishares',
+        'https://www.ishares.com/us/products/239714/ishares-russell-3000-etf/1467271812596.ajax?fileType=csv&fileName=IWV_holdings&dataType=fund',
+        {'Ticker': 'Symbol', 'Name': 'Security', 'Sector': 'GICS Sector'}
+    )
+}
+# rows of fund information above the holdings of an iShares holdings file
+ISHARES_HEADER_ROWS = 9
+
+def read_universe(name):
+    '''
+    Returns the constituents of a universe with the ticker columns it provides
+    '''
+    import pandas as pd
+
+    if name.startswith('csv:'):
+        kind, url, columns = 'csv', name[len('csv:'):], {}
+    else:
+        kind, url, columns = UNIVERSES[name]
+
+    if kind == 'html':
+        # the constituent table is the largest table with a Symbol column
+        tables = [table for table in pd.read_html(url, match = 'Symbol') if 'Symbol' in table.columns.map(str)]
+        companies = max(tables, key = len)
+    elif kind == 'ishares':
+        companies = pd.read_csv(url, skiprows = ISHARES_HEADER_ROWS)
+        companies = companies[companies['Asset Class'] == 'Equity']
+    else:
+        companies = pd.read_csv(url)
+
+    companies = companies.rename(columns = columns)
+    return companies[companies['Symbol'].notna()]
+
+def read_universes(names):
+    '''
+    Returns the constituents of every universe, a company listed in several universes is kept once
+    '''
+    import pandas as pd
+
+    companies = pd.concat([read_universe(name) for name in names])
+    companies['Symbol'] = companies['Symbol'].astype(str).str.strip()
+    return companies.drop_duplicates(subset = 'Symbol')
+
+def last_collected_session(s3):
+    '''
+    Returns the last stored date of the calendar symbol, or None before the first collection
+    '''
+    last_dates = read_json(s3, os.environ['BUCKETNAME'], f"{os.environ['DATA_FOLDER']}/{os.environ['TRANSFORM_FOLDER']}/last_dates.json")
+    last_date = (last_dates or {}).get(CALENDAR_SYMBOL)
+    return date.fromisoformat(last_date) if last_date else None
+
 def lambda_handler(event, context):
 
+    metrics = Metrics('ticker_collector')
+
     try:
 
         today = datetime.today()
 
-        companies = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')[0]
+        if SKIP_CLOSED_DAYS:
+            s3 = client('s3')
+            with metrics.step('calendar'):
+                last_session = last_collected_session(s3)
+            if last_session and not sessions(last_session, session_date(today)):
+                # weekends and holidays change nothing, only the time of the last check is updated
+                with metrics.step('refresh'):
+                    refresh_last_updated(s3, os.environ['BUCKETNAME'], os.environ['ANALYSIS_FOLDER'])
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps(metrics.finish({
+                        "message": f"No session since {last_session:%Y-%m-%d}, ticker collection skipped"
+                    }))
+                }
+
+        # pandas is only imported once there is something to collect, a skipped run stays light
+        import pandas as pd
+        from raw_data import TICKER_COLUMNS
+
+        universes = [name.strip() for name in os.environ.get('UNIVERSES', 'sp500').split(',') if name.strip()]
+        with metrics.step('download'):
+            companies = read_universes(universes)
 
         benchmarks = pd.DataFrame({
             "Symbol": ["^TNX", "^GSPC"],
             "Security": ["10 Year Treasury Note", "S&P 500"]
         })
 
+        # collect the data of any other benchmark beta is computed against
+        extra_benchmarks = [
+            symbol.strip() for symbol in os.environ.get('BENCHMARKS', '').split(',')
+            if symbol.strip() and symbol.strip() not in benchmarks['Symbol'].values
+        ]
+        benchmarks = pd.concat([benchmarks, pd.DataFrame({"Symbol": extra_benchmarks, "Security": extra_benchmarks})])
+
         tickers = pd.concat([companies, benchmarks])
 
         tickers['updatedAt'] = [today for row in tickers.index]
+        tickers = tickers.reindex(columns = TICKER_COLUMNS)
 
         if tickers.empty:
             return {
@@ -30,18 +127,23 @@ def lambda_handler(event, context):
             }
 
         file_name = today.strftime('%Y-%m-%d-%H-%M-%S')
-        wr.s3.to_csv(
-            df = tickers, 
-            path = f"s3://{os.environ['BUCKETNAME']}/{os.environ['TICKER_FOLDER']}/{os.environ['RAW_FOLDER']}/{file_name}.csv", 
-            index = False, 
-            sep = '|'
-        )
+        with metrics.step('serialize'):
+            body = tickers.to_csv(index = False, sep = '|').encode('utf-8')
+        metrics.count('Tickers', len(tickers))
+        metrics.count('UploadedBytes', len(body))
+        # put the csv directly, awswrangler is a heavy import for a single small file
+        with metrics.step('upload'):
+            client('s3').put_object(
+                Bucket = os.environ['BUCKETNAME'],
+                Key = f"{os.environ['TICKER_FOLDER']}/{os.environ['RAW_FOLDER']}/{file_name}.csv",
+                Body = body
+            )
 
         return {
             "statusCode": 200,
-            "body": json.dumps({
+            "body": json.dumps(metrics.finish({
                 "message": "Ticker collection successful"
-            })
+            }))
         }
     
     except Exception as e:
@@ -51,6 +153,3 @@ def lambda_handler(event, context):
                 "error": str(e)
             })
         }
-
-
-
@@ -0,0 +1,100 @@
+import csv
+import json
+from io import StringIO
+from botocore.exceptions import ClientError
+from clients import client
+from instrumentation import Metrics
+from detect_changes import ticker_hash
+
+
+def read_snapshot(s3, bucket_name, key):
+    '''
+    Reads the symbols of the previous ticker file, or None before the first run
+    '''
+    try:
+        response = s3.get_object(Bucket = bucket_name, Key = key)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise
+    return json.loads(response['Body'].read())
+
+
+def read_symbols(s3, bucket_name, key):
+    '''
+    Returns the symbols, the update time and the hash of the rows of a ticker file written by the ticker collector
+    '''
+    content = s3.get_object(Bucket = bucket_name, Key = key)['Body'].read().decode('utf-8')
+    rows = list(csv.DictReader(StringIO(content), delimiter = '|'))
+    return {row['Symbol'] for row in rows if row['Symbol']}, (rows[0]['updatedAt'] if rows else None), ticker_hash(rows)
+
+
+def diff(latest, previous):
+    '''
+    Splits the latest symbols into new and retained ones, and returns the previous symbols
+    that are no longer listed
+    '''
+    return sorted(latest - previous), sorted(latest & previous), sorted(previous - latest)
+
+
+def lambda_handler(event, context):
+    '''
+    This function identifies new, retained and removed tickers of the ticker file that started
+    the step function, against a snapshot of the previous file's symbols
+    only the new ticker file and the snapshot are read, however many ticker files are stored
+    retained tickers are written as Old_Tickers so removed tickers are no longer refreshed
+    '''
+
+    result = {}
+    metrics = Metrics('ticker_diff')
+
+    s3 = client('s3')
+
+    bucket_name = event['bucket_name']
+    transform_location = f"{event['ticker_folder']}/{event['transform_folder']}"
+    snapshot_key = f"{transform_location}/snapshot.json"
+
+    with metrics.step('read'):
+        latest, updated_at, rows_hash = read_symbols(s3, bucket_name, event['key_name'])
+    metrics.count('Symbols', len(latest))
+    if not latest:
+        # keep the snapshot, an empty list would mark every ticker as new on the next run
+        raise ValueError(f"No symbols in {event['key_name']}")
+
+    with metrics.step('read'):
+        snapshot = read_snapshot(s3, bucket_name, snapshot_key)
+
+    if snapshot is None:
+        previous = set()
+    elif snapshot['source'] == event['key_name']:
+        # a retried execution diffs the same file against the same previous snapshot
+        previous = set(snapshot['previous_symbols'])
+    else:
+        previous = set(snapshot['symbols'])
+
+    with metrics.step('diff'):
+        new_tickers, old_tickers, removed_tickers = diff(latest, previous)
+
+    data = {'New_Tickers': new_tickers, 'Old_Tickers': old_tickers, 'Removed_Tickers': removed_tickers}
+    with metrics.step('upload'):
+        s3.put_object(Bucket = bucket_name, Key = f"{transform_location}/data_input.json", Body = json.dumps(data))
+
+        s3.put_object(
+            Bucket = bucket_name,
+            Key = snapshot_key,
+            Body = json.dumps({
+                'source': event['key_name'],
+                'updatedAt': updated_at,
+                'hash': rows_hash,
+                'symbols': sorted(latest),
+                'previous_symbols': sorted(previous)
+            })
+        )
+
+    result['New'] = len(new_tickers)
+    result['Old'] = len(old_tickers)
+    result['Removed'] = removed_tickers
+    result['Hash'] = rows_hash
+    result['Validation'] = 'SUCCESS'
+
+    return metrics.finish(result)
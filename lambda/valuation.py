@@ -0,0 +1,123 @@
+'''
+Dividend valuations of the analysis companies, computed for every company at once with NumPy
+the required return is the CAPM rate, risk_free + beta * (market_return - risk_free), and the
+fair value is the Gordon Growth Model value of the next year's dividends,
+
+    annual_dividend * (1 + growth) / (required_return - growth)
+
+with the annual dividend taken as lastDividend * dividendFrequency
+the default assumptions are the rates of the summary benchmarks (^TNX for the risk free rate,
+the five year CAGR of ^GSPC for the market return) and the fiveYearCAGR of every company
+'''
+
+import math
+import numpy as np
+
+# fair values are rounded to cents and rates to basis points in sweep documents
+VALUE_DECIMALS = 2
+RATE_DECIMALS = 4
+# upper bound of the scenarios of a sweep, so a request can not build an arbitrarily large grid
+MAX_SCENARIOS = 10000
+
+
+def market_rates(benchmarks):
+    '''
+    Returns the default risk free rate and market return of the summary benchmarks
+    '''
+    rates = {benchmark['ticker']: benchmark['rate'] for benchmark in benchmarks}
+    return rates.get('^TNX'), rates.get('^GSPC')
+
+
+def inputs(companies):
+    '''
+    Returns the tickers and the annual dividend, growth and beta arrays of the companies
+    missing values are NaN
+    '''
+    def column(field):
+        return np.array([company.get(field) for company in companies], dtype='float64')
+
+    return (
+        [company['ticker'] for company in companies],
+        column('lastDividend') * column('dividendFrequency'),
+        column('fiveYearCAGR'),
+        column('beta')
+    )
+
+
+def required_return(beta, risk_free, market_return):
+    return risk_free + beta * (market_return - risk_free)
+
+
+def fair_value(annual_dividend, growth, required):
+    '''
+    Gordon Growth Model value, NaN when the required return does not exceed the growth
+    the arguments broadcast against each other
+    '''
+    spread = required - growth
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((spread > 0) & (annual_dividend > 0), annual_dividend * (1 + growth) / spread, np.nan)
+
+
+def default_valuation(annual_dividend, growth, beta, benchmarks):
+    '''
+    Returns the required return and fair value arrays under the default assumptions,
+    NaN when the benchmarks lack a rate
+    '''
+    risk_free, market_return = market_rates(benchmarks)
+    if risk_free is None or market_return is None:
+        missing = np.full(len(beta), np.nan)
+        return missing, missing
+    required = required_return(beta, risk_free, market_return)
+    return required, fair_value(annual_dividend, growth, required)
+
+
+def parse_grid(value):
+    '''
+    Parses a comma separated list of rates or a start:stop:step range (stop included)
+    '''
+    if ':' in value:
+        start, stop, step = (float(part) for part in value.split(':'))
+        if not all(math.isfinite(part) for part in (start, stop, step)) or step <= 0:
+            raise ValueError(f'{value} must be finite with a positive step')
+        # the length is checked before the grid is built, a fine step over a wide range would not fit in memory
+        n = math.floor((stop - start) / step + 1e-9) + 1
+        if n < 1:
+            raise ValueError(f'stop of {value} is below its start')
+        if n > MAX_SCENARIOS:
+            raise ValueError(f'{value} has {n} values, at most {MAX_SCENARIOS} are allowed')
+        return np.round(start + step * np.arange(n), 10)
+    return np.array([float(part) for part in value.split(',')], dtype='float64')
+
+
+def sweep(companies, benchmarks, growth=None, risk_free=None, market_return=None):
+    '''
+    Fair values of every company over the grid of growth, risk free and market return assumptions
+    an assumption left out is taken from the benchmarks (a single value) or, for the growth,
+    the fiveYearCAGR of every company
+    returns a document of the axes and the fair values as a flat row major array of shape
+    (tickers, growth, risk free, market return), null where undefined
+    '''
+    default_risk_free, default_market_return = market_rates(benchmarks)
+    risk_free = np.array([default_risk_free], dtype='float64') if risk_free is None else np.asarray(risk_free, dtype='float64')
+    market_return = np.array([default_market_return], dtype='float64') if market_return is None else np.asarray(market_return, dtype='float64')
+
+    tickers, annual_dividend, cagr, beta = inputs(companies)
+    growth_axis = None if growth is None else np.asarray(growth, dtype='float64')
+    scenarios = (1 if growth_axis is None else len(growth_axis)) * len(risk_free) * len(market_return)
+    if scenarios > MAX_SCENARIOS:
+        raise ValueError(f'{scenarios} scenarios, at most {MAX_SCENARIOS} are allowed')
+
+    # (tickers, 1, risk free, market return)
+    required = required_return(beta[:, None, None, None], risk_free[None, None, :, None], market_return[None, None, None, :])
+    rates = cagr[:, None, None, None] if growth_axis is None else growth_axis[None, :, None, None]
+    values = np.round(fair_value(annual_dividend[:, None, None, None], rates, required), VALUE_DECIMALS)
+
+    flat = values.ravel()
+    return {
+        'tickers': tickers,
+        'growth': None if growth_axis is None else np.round(growth_axis, RATE_DECIMALS).tolist(),
+        'riskFree': np.round(risk_free, RATE_DECIMALS).tolist(),
+        'marketReturn': np.round(market_return, RATE_DECIMALS).tolist(),
+        'shape': list(values.shape),
+        'fairValue': np.where(np.isnan(flat), None, flat).tolist()
+    }